@@ -0,0 +1,141 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2009 John Hampton <pacopablo@pacopablo.com>
+# All rights reserved.
+#
+# This software is licensed as described in the file COPYING, which
+# you should have received as part of this distribution.
+#
+# Author: John Hampton <pacopablo@pacopablo.com>
+
+"""
+Sums over IV00300 and IV30300, as Decimals and as scaled integers.
+
+Fills an in-memory SQLite database with random lot layers and history
+lines, then for each table times reading the quantity and cost columns and
+summing them in Python, once with the model's Numeric types and once
+through `gp10.types.scaled`.  The totals of both runs are checked to be
+exactly equal.
+
+    python benchmarks/scaled_sums.py [rows]
+"""
+
+# Standard library imports
+import os
+import random
+import sys
+import time
+from datetime import datetime
+from decimal import Decimal
+
+# Third Party imports
+from sqlalchemy import create_engine
+from sqlalchemy.sql import select
+from sqlalchemy.types import String, DateTime, Boolean, Numeric
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# Local imports
+from gp10 import Base
+from gp10.inventory import IV_Lot_MSTR, IV_TRX_HIST_LINE
+from gp10.types import scaled, from_scaled
+import gp10.manufacturing
+
+
+def _filler(table):
+    """ Return a row of placeholder values for every column of `table` """
+    row = {}
+    for col in table.columns:
+        ctype = getattr(col.type, 'impl', col.type)
+        if isinstance(ctype, String):
+            row[col.name] = ''
+        elif isinstance(ctype, DateTime):
+            row[col.name] = datetime(1900, 1, 1)
+        elif isinstance(ctype, Boolean):
+            row[col.name] = False
+        elif isinstance(ctype, Numeric):
+            row[col.name] = Decimal(0)
+        else:
+            row[col.name] = 0
+    return row
+
+
+def _amount(places=5, high=10000):
+    return Decimal(random.randint(0, high * 10 ** places)).scaleb(-places)
+
+
+def populate(engine, rows):
+    lots = IV_Lot_MSTR.__table__
+    hist = IV_TRX_HIST_LINE.__table__
+    Base.metadata.create_all(engine, tables=[lots, hist])
+    base = _filler(lots)
+    data = []
+    for i in range(rows):
+        row = dict(base)
+        row.update(ITEMNMBR='ITEM%05d' % (i % 5000), LOCNCODE='SITE%d' % (i % 7),
+                   DTSEQNUM=i, LOTNUMBR='LOT%d' % i, QTYRECVD=_amount(),
+                   QTYSOLD=_amount(high=100), UNITCOST=_amount(high=500))
+        data.append(row)
+    engine.execute(lots.insert(), data)
+    base = _filler(hist)
+    data = []
+    for i in range(rows):
+        row = dict(base)
+        row.update(TRXSORCE='IVTRX%08d' % (i // 10), DOCNUMBR='DOC%08d' % i,
+                   LNSEQNBR=16384, ITEMNMBR='ITEM%05d' % (i % 5000),
+                   TRXQTY=_amount(high=1000), UNITCOST=_amount(high=500),
+                   EXTDCOST=_amount(high=100000))
+        data.append(row)
+    engine.execute(hist.insert(), data)
+
+
+def _time(fn):
+    t0 = time.time()
+    result = fn()
+    return result, time.time() - t0
+
+
+def bench(engine, columns, extend):
+    """ Return ((decimal totals, seconds), (scaled totals, seconds)) """
+    def decimal_sums():
+        totals = [Decimal(0)] * (len(columns) + 1)
+        for row in engine.execute(select(columns)):
+            for i, v in enumerate(row):
+                totals[i] += v
+            totals[-1] += row[extend[0]] * row[extend[1]]
+        return totals
+
+    def scaled_sums():
+        totals = [0] * (len(columns) + 1)
+        for row in engine.execute(select([scaled(c) for c in columns])):
+            for i, v in enumerate(row):
+                totals[i] += v
+            # Exact product at 10^10, scaled back once at the end
+            totals[-1] += row[extend[0]] * row[extend[1]]
+        return totals
+
+    return _time(decimal_sums), _time(scaled_sums)
+
+
+def main(rows=200000):
+    engine = create_engine('sqlite://')
+    random.seed(0)
+    _, fill = _time(lambda: populate(engine, rows))
+    print('%d rows per table loaded in %.2fs' % (rows, fill))
+    lots = IV_Lot_MSTR.__table__.c
+    hist = IV_TRX_HIST_LINE.__table__.c
+    for name, columns, extend in (
+            ('IV00300', [lots.QTYRECVD, lots.QTYSOLD, lots.UNITCOST], (0, 2)),
+            ('IV30300', [hist.TRXQTY, hist.UNITCOST, hist.EXTDCOST], (0, 1))):
+        (dec, dtime), (sca, stime) = bench(engine, columns, extend)
+        sca = [from_scaled(v) for v in sca[:-1]] + \
+              [Decimal(sca[-1]).scaleb(-10)]
+        if dec != sca:
+            raise AssertionError('%s totals differ: %r != %r' % (name, dec, sca))
+        print('%s  Decimal %.3fs  scaled %.3fs  speedup %.2fx' %
+              (name, dtime, stime, dtime / stime))
+
+
+if __name__ == '__main__':
+    main(len(sys.argv) > 1 and int(sys.argv[1]) or 200000)
@@ -28,5 +28,5 @@ def get_session():
     else:
         raise UnboundMetadataError
     sm = sessionmaker(bind=engine)
-    return scoped_sesison(sm)
+    return scoped_session(sm)
 
@@ -0,0 +1,354 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2009 John Hampton <pacopablo@pacopablo.com>
+# All rights reserved.
+#
+# This software is licensed as described in the file COPYING, which
+# you should have received as part of this distribution.
+#
+# Author: John Hampton <pacopablo@pacopablo.com>
+
+"""
+History archival into compressed, indexed segment files.
+
+Old history rows are read out of the live table in primary key order, a
+bounded chunk at a time, and every chunk is written to its own segment
+file as zlib compressed blocks.  A sparse index holding the first and last
+key of every block is written next to it, so a single key lookup
+decompresses one block.  Keys are compared the way the database's default
+collation does, ignoring surrounding blanks and case, and the rows of a
+segment are sorted on that form in Python rather than trusting the order
+the database returned them in.  Segments of one run may therefore overlap
+in key range; lookups check the first and last key of every segment.  Only
+once a segment and its index are safely on disk are its rows deleted from
+the live table, with a commit before the next chunk is read.
+
+`ArchiveStore.lookup` checks the database first and falls back to the
+archive, so callers do not need to know where a row lives.
+"""
+
+# Standard library imports
+import os
+import time
+import zlib
+from bisect import bisect_right
+try:
+    import cPickle as pickle
+except ImportError:
+    import pickle
+
+# Third Party imports
+from sqlalchemy.orm import class_mapper
+from sqlalchemy.sql import select, and_, exists, bindparam
+
+# Local imports
+from gp10 import get_session
+from gp10.inventory import IV_TRX_HIST_LINE, IV_TRX_HIST_Serial_Lot
+from gp10.manufacturing import MOP_Pending_Serial_Lot_HIST
+from gp10.purchasing import POP_ReceiptHist
+from gp10.upsert import model_columns
+
+__all__ = [
+    'ArchiveSegment',
+    'ArchiveResult',
+    'ArchiveStore',
+    'history_rules',
+    'archive_history',
+]
+
+_PROTOCOL = 2
+
+try:
+    _string_types = basestring
+except NameError:
+    _string_types = str
+
+
+def _key_columns(table):
+    return [c for c in table.columns if c.primary_key]
+
+
+def _fold(value):
+    if isinstance(value, _string_types):
+        value = value.strip()
+        return getattr(value, 'casefold', value.lower)()
+    return value
+
+
+def _sort_key(key):
+    """ Return `key` in the form segments are sorted and searched on """
+    return tuple([_fold(v) for v in key])
+
+
+class ArchiveSegment(object):
+    """ One segment file and its sparse block index """
+
+    def __init__(self, path):
+        self.path = path
+        f = open(path + '.idx', 'rb')
+        try:
+            index = pickle.load(f)
+        finally:
+            f.close()
+        self.columns = index['columns']
+        self.keys = index['keys']
+        self.blocks = index['blocks']
+        self._firsts = [b[0] for b in self.blocks]
+        self._cache = (None, None)
+
+    def __len__(self):
+        return sum([b[4] for b in self.blocks])
+
+    def _first_key(self):
+        return self.blocks and self.blocks[0][0] or None
+    first_key = property(_first_key)
+
+    def _last_key(self):
+        return self.blocks and self.blocks[-1][1] or None
+    last_key = property(_last_key)
+
+    def _read_block(self, i):
+        if self._cache[0] == i:
+            return self._cache[1]
+        first, last, offset, length, count = self.blocks[i]
+        f = open(self.path + '.seg', 'rb')
+        try:
+            f.seek(offset)
+            data = f.read(length)
+        finally:
+            f.close()
+        rows = pickle.loads(zlib.decompress(data))
+        self._cache = (i, rows)
+        return rows
+
+    def get(self, key):
+        """ Return the archived row tuple for `key`, or None """
+        key = _sort_key(key)
+        i = bisect_right(self._firsts, key) - 1
+        if i < 0 or key > self.blocks[i][1]:
+            return None
+        keypos = [self.columns.index(k) for k in self.keys]
+        for row in self._read_block(i):
+            if _sort_key([row[p] for p in keypos]) == key:
+                return row
+        return None
+
+    def scan(self):
+        """ Yield every archived row in key order """
+        for i in range(len(self.blocks)):
+            for row in self._read_block(i):
+                yield row
+
+
+class ArchiveResult(object):
+    """ Outcome of archiving one table """
+
+    def __init__(self, table):
+        self.table = table
+        self.archived = 0
+        self.deleted = 0
+        self.segments = []
+        self.timings = {}
+
+    def __repr__(self):
+        return 'ArchiveResult(%s, archived=%d, deleted=%d, segments=%d)' % \
+               (self.table, self.archived, self.deleted, len(self.segments))
+
+
+class ArchiveStore(object):
+    """ A directory of archive segments, one subdirectory per table """
+
+    def __init__(self, directory):
+        self.directory = directory
+        self._segments = {}
+        self._serial = 0
+
+    def _table_dir(self, table):
+        path = os.path.join(self.directory, table.name)
+        if not os.path.isdir(path):
+            os.makedirs(path)
+        return path
+
+    def segments(self, model):
+        """ Return the complete segments of `model`, oldest first
+
+        A segment is only visible once its index file exists, so a crash
+        while writing never exposes a partial segment.
+        """
+        table = model.__table__
+        path = self._table_dir(table)
+        names = sorted([n[:-4] for n in os.listdir(path) if n.endswith('.idx')])
+        cached = self._segments.setdefault(table.name, {})
+        for name in names:
+            if name not in cached:
+                cached[name] = ArchiveSegment(os.path.join(path, name))
+        return [cached[n] for n in names]
+
+    def write(self, model, rows, blocksize=512):
+        """ Write `rows` (tuples in table column order) to a new segment
+        and return its path
+
+        The rows are sorted on their normalized primary key first, so they
+        are held in memory while the segment is written; `archive` passes
+        one chunk at a time.
+        """
+        table = model.__table__
+        columns = [c.name for c in table.columns]
+        keys = [c.name for c in _key_columns(table)]
+        keypos = [columns.index(k) for k in keys]
+        rows = sorted([tuple(row) for row in rows],
+                      key=lambda r: _sort_key([r[p] for p in keypos]))
+        now = time.time()
+        # The serial keeps segments written in the same microsecond apart
+        # and in the order they were written
+        self._serial += 1
+        name = '%s%06d-%d-%06d' % (
+            time.strftime('%Y%m%d%H%M%S', time.localtime(now)),
+            int((now % 1) * 1000000), os.getpid(), self._serial)
+        base = os.path.join(self._table_dir(table), name)
+        blocks = []
+        f = open(base + '.seg', 'wb')
+        try:
+            block = []
+
+            def flush():
+                data = zlib.compress(pickle.dumps(block, _PROTOCOL))
+                first = _sort_key([block[0][p] for p in keypos])
+                last = _sort_key([block[-1][p] for p in keypos])
+                blocks.append((first, last, f.tell(), len(data), len(block)))
+                f.write(data)
+
+            for row in rows:
+                block.append(row)
+                if len(block) >= blocksize:
+                    flush()
+                    block = []
+            if block:
+                flush()
+            f.flush()
+            os.fsync(f.fileno())
+        finally:
+            f.close()
+        if not blocks:
+            os.remove(base + '.seg')
+            return None
+        tmp = base + '.idx.tmp'
+        f = open(tmp, 'wb')
+        try:
+            pickle.dump({'columns': columns, 'keys': keys, 'blocks': blocks},
+                        f, _PROTOCOL)
+            f.flush()
+            os.fsync(f.fileno())
+        finally:
+            f.close()
+        os.rename(tmp, base + '.idx')
+        return base
+
+    def archive(self, s, model, criterion, batch=1000, blocksize=512):
+        """ Move the rows of `model` matching `criterion` into the archive
+
+        The rows are read `batch` at a time in primary key order.  Every
+        chunk is written to a segment of its own and then deleted from the
+        live table, committing before the next chunk is read, so neither
+        memory nor lock footprints grow with the number of rows archived.
+        Returns an `ArchiveResult`.
+        """
+        table = model.__table__
+        keycols = _key_columns(table)
+        columns = list(table.columns)
+        keypos = [columns.index(c) for c in keycols]
+        result = ArchiveResult(table.name)
+        result.timings = {'write': 0.0, 'delete': 0.0}
+        # Rows deleted by the previous chunk no longer match, so every
+        # chunk is simply the first `batch` rows that are left.
+        q = select(columns, criterion, order_by=keycols).limit(batch)
+        stmt = table.delete().where(and_(*[c == bindparam('k_' + c.name)
+                                           for c in keycols]))
+        while True:
+            t0 = time.time()
+            rows = s.execute(q).fetchall()
+            if not rows:
+                # End the transaction the last read opened
+                s.commit()
+                break
+            result.segments.append(self.write(model, rows, blocksize))
+            result.archived += len(rows)
+            t1 = time.time()
+            r = s.execute(stmt, [dict([('k_' + c.name, row[p])
+                                       for c, p in zip(keycols, keypos)])
+                                 for row in rows])
+            deleted = len(rows)
+            if r.supports_sane_multi_rowcount():
+                deleted = r.rowcount
+            s.commit()
+            result.deleted += deleted
+            result.timings['write'] += t1 - t0
+            result.timings['delete'] += time.time() - t1
+            if len(rows) < batch or not deleted:
+                # Rows that could not be deleted would be read again
+                break
+        return result
+
+    def get(self, model, key):
+        """ Return the archived row of `model` for `key` as a dict keyed by
+        attribute name, or None
+        """
+        if not isinstance(key, (tuple, list)):
+            key = (key,)
+        folded = _sort_key(key)
+        for segment in reversed(self.segments(model)):
+            first, last = segment.first_key, segment.last_key
+            if first is None or folded < first or folded > last:
+                continue
+            row = segment.get(key)
+            if row is not None:
+                names = dict([(c.name, a) for a, c in model_columns(model)])
+                return dict([(names[c], v) for c, v in zip(segment.columns, row)])
+        return None
+
+    def lookup(self, s, model, key):
+        """ Fetch `model` by primary key from the database or the archive
+
+        Archived rows come back as transient instances that are not attached
+        to the session.
+        """
+        s = s and s or get_session()
+        obj = s.query(model).get(key)
+        if obj is not None:
+            return obj
+        values = self.get(model, key)
+        if values is None:
+            return None
+        obj = class_mapper(model).class_manager.new_instance()
+        for attr, value in values.items():
+            setattr(obj, attr, value)
+        return obj
+
+
+def history_rules(cutoff):
+    """ Return ``(model, criterion)`` pairs selecting history older than
+    `cutoff`, children before parents
+    """
+    hist = IV_TRX_HIST_LINE.__table__.c
+    lots = IV_TRX_HIST_Serial_Lot.__table__.c
+    old_line = exists([hist.DOCNUMBR], and_(hist.TRXSORCE == lots.TRXSORCE,
+                                            hist.DOCTYPE == lots.IVDOCTYP,
+                                            hist.DOCNUMBR == lots.DOCNUMBR,
+                                            hist.LNSEQNBR == lots.LNSEQNBR,
+                                            hist.DOCDATE < cutoff))
+    return [
+        (IV_TRX_HIST_Serial_Lot, old_line),
+        (IV_TRX_HIST_LINE, hist.DOCDATE < cutoff),
+        (POP_ReceiptHist, POP_ReceiptHist.__table__.c.receiptdate < cutoff),
+        (MOP_Pending_Serial_Lot_HIST,
+         MOP_Pending_Serial_Lot_HIST.__table__.c.DATERECD < cutoff),
+    ]
+
+
+def archive_history(store, cutoff, s=None, batch=1000, blocksize=512):
+    """ Archive IV30400, IV30300, POP30300 and MOP1090 rows older than
+    `cutoff` into `store`; returns a list of `ArchiveResult`
+    """
+    s = s and s or get_session()
+    return [store.archive(s, model, criterion, batch, blocksize)
+            for model, criterion in history_rules(cutoff)]
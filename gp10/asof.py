@@ -0,0 +1,301 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2009 John Hampton <pacopablo@pacopablo.com>
+# All rights reserved.
+#
+# This software is licensed as described in the file COPYING, which
+# you should have received as part of this distribution.
+#
+# Author: John Hampton <pacopablo@pacopablo.com>
+
+"""
+Point-in-time on-hand quantities rebuilt from the IV history.
+
+`build_checkpoints` replays IV30300 (and the IV30400 lot detail) one month
+at a time and saves the running on-hand quantity and value per (item,
+site), and quantity per (item, site, lot), at the start of every month.
+
+A checkpoint is a file of zlib compressed blocks of records sorted by
+item, plus a small index of the first and last key of every block, so
+reading one item decompresses only a block or two.  `as_of` answers "on
+hand for item X at site Y at the end of day D" from the nearest earlier
+checkpoint and replays only the history after it.
+
+Quantities are in base units: TRXQTY times QTYBSUOM.  A transfer line
+takes its quantity and cost out of TRXLOCTN and puts it into TRNSTLOC;
+every other line adds its signed quantity to TRXLOCTN, with the extended
+cost carrying the sign of the quantity.
+"""
+
+# Standard library imports
+import os
+import zlib
+from bisect import bisect_left
+from datetime import datetime, timedelta
+from decimal import Decimal
+try:
+    import cPickle as pickle
+except ImportError:
+    import pickle
+
+# Third Party imports
+from sqlalchemy.sql import select, and_, or_, func
+
+# Local imports
+from gp10 import get_session
+from gp10.inventory import IV_TRX_HIST_LINE, IV_TRX_HIST_Serial_Lot
+
+__all__ = [
+    'Checkpoint',
+    'CheckpointStore',
+    'OnHand',
+    'build_checkpoints',
+    'as_of',
+]
+
+_ZERO = Decimal(0)
+_PROTOCOL = 2
+_FMT = '%Y%m%d'
+
+_line = IV_TRX_HIST_LINE.__table__.c
+_lot = IV_TRX_HIST_Serial_Lot.__table__.c
+
+
+def _day(when):
+    return datetime(when.year, when.month, when.day)
+
+
+def _next_month(when):
+    if when.month == 12:
+        return datetime(when.year + 1, 1, 1)
+    return datetime(when.year, when.month + 1, 1)
+
+
+def _moves(location, to_location, qty, qtybsuom, amount):
+    """ Return the (location, qty, amount) changes of one history line """
+    base = qty * qtybsuom
+    amount = abs(amount)
+    if to_location:
+        return [(location, -abs(base), -amount), (to_location, abs(base), amount)]
+    if base < 0:
+        amount = -amount
+    return [(location, base, amount)]
+
+
+def _line_rows(s, criterion):
+    q = select([_line.ITEMNMBR, _line.TRXLOCTN, _line.TRNSTLOC, _line.TRXQTY,
+                _line.QTYBSUOM, _line.EXTDCOST], criterion)
+    return s.execute(q)
+
+
+def _lot_rows(s, criterion):
+    join = and_(_lot.TRXSORCE == _line.TRXSORCE,
+                _lot.IVDOCTYP == _line.DOCTYPE,
+                _lot.DOCNUMBR == _line.DOCNUMBR,
+                _lot.LNSEQNBR == _line.LNSEQNBR)
+    q = select([_line.ITEMNMBR, _line.TRXLOCTN, _line.TRNSTLOC, _line.TRXQTY,
+                _line.QTYBSUOM, _lot.SERLTNUM, _lot.SERLTQTY],
+               and_(join, criterion))
+    return s.execute(q)
+
+
+def _apply(sites, lots, s, criterion):
+    """ Replay the history matching `criterion` into `sites` and `lots` """
+    for item, loc, to_loc, qty, qtybsuom, amount in _line_rows(s, criterion):
+        for location, dq, da in _moves(loc, to_loc, qty, qtybsuom, amount):
+            key = (item, location)
+            q, v = sites.get(key, (_ZERO, _ZERO))
+            sites[key] = (q + dq, v + da)
+    for item, loc, to_loc, qty, qtybsuom, lot, lotqty in _lot_rows(s, criterion):
+        # The lot quantity carries no sign; it follows its line
+        signed = qty < 0 and -lotqty or lotqty
+        for location, dq, da in _moves(loc, to_loc, signed, qtybsuom, _ZERO):
+            key = (item, location, lot)
+            lots[key] = lots.get(key, _ZERO) + dq
+
+
+class Checkpoint(object):
+    """ One checkpoint file: the state before `date` """
+
+    def __init__(self, path, date):
+        self.path = path
+        self.date = date
+        self._index = None
+
+    def _load_index(self):
+        if self._index is None:
+            f = open(self.path + '.idx', 'rb')
+            try:
+                self._index = pickle.load(f)
+            finally:
+                f.close()
+            self._lasts = [b[1] for b in self._index]
+        return self._index
+
+    def _block(self, i):
+        first, last, offset, length = self._index[i]
+        f = open(self.path + '.ckpt', 'rb')
+        try:
+            f.seek(offset)
+            data = f.read(length)
+        finally:
+            f.close()
+        return pickle.loads(zlib.decompress(data))
+
+    def records(self, item):
+        """ Return the ``(item, location, lot, qty, value)`` records of
+        `item`; site totals have a `lot` of None
+        """
+        index = self._load_index()
+        found = []
+        # First block that ends at or after the item's first key
+        for i in range(bisect_left(self._lasts, (item,)), len(index)):
+            if index[i][0][0] > item:
+                break
+            for rec in self._block(i):
+                if rec[0] == item:
+                    found.append(rec)
+        return found
+
+    def scan(self):
+        index = self._load_index()
+        for i in range(len(index)):
+            for rec in self._block(i):
+                yield rec
+
+
+class CheckpointStore(object):
+    """ A directory of checkpoints named by their date """
+
+    def __init__(self, directory):
+        self.directory = directory
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+
+    def checkpoints(self):
+        names = sorted([n[:-4] for n in os.listdir(self.directory)
+                        if n.endswith('.idx')])
+        return [Checkpoint(os.path.join(self.directory, n),
+                           datetime.strptime(n, _FMT)) for n in names]
+
+    def nearest(self, when):
+        """ Return the latest checkpoint dated no later than `when` """
+        best = None
+        for cp in self.checkpoints():
+            if cp.date <= when:
+                best = cp
+        return best
+
+    def write(self, date, sites, lots, blocksize=1024):
+        """ Save the state before `date`; zero entries are left out """
+        records = []
+        for (item, location), (qty, value) in sites.items():
+            if qty or value:
+                records.append((item, location, None, qty, value))
+        for (item, location, lot), qty in lots.items():
+            if qty:
+                records.append((item, location, lot, qty, None))
+        records.sort(key=lambda r: (r[0], r[1], r[2] or u''))
+        base = os.path.join(self.directory, date.strftime(_FMT))
+        index = []
+        f = open(base + '.ckpt', 'wb')
+        try:
+            for i in range(0, len(records), blocksize):
+                block = records[i:i + blocksize]
+                data = zlib.compress(pickle.dumps(block, _PROTOCOL))
+                index.append(((block[0][0], block[0][1]),
+                              (block[-1][0], block[-1][1]), f.tell(), len(data)))
+                f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+        finally:
+            f.close()
+        tmp = base + '.idx.tmp'
+        f = open(tmp, 'wb')
+        try:
+            pickle.dump(index, f, _PROTOCOL)
+            f.flush()
+            os.fsync(f.fileno())
+        finally:
+            f.close()
+        os.rename(tmp, base + '.idx')
+        return Checkpoint(base, date)
+
+
+def build_checkpoints(store, s=None, until=None):
+    """ Add monthly checkpoints to `store` up to `until` (default today)
+
+    Picks up from the latest checkpoint already in the store, so it can be
+    run periodically to keep the checkpoints current.  Returns the list of
+    checkpoints written.
+    """
+    s = s and s or get_session()
+    until = _day(until or datetime.now())
+    sites = {}
+    lots = {}
+    existing = store.checkpoints()
+    if existing:
+        start = existing[-1].date
+        for item, location, lot, qty, value in existing[-1].scan():
+            if lot is None:
+                sites[(item, location)] = (qty, value)
+            else:
+                lots[(item, location, lot)] = qty
+    else:
+        first = s.execute(select([func.min(_line.DOCDATE)])).scalar()
+        if first is None:
+            return []
+        start = datetime(first.year, first.month, 1)
+    written = []
+    date = start
+    while True:
+        nxt = _next_month(date)
+        if nxt > until:
+            break
+        _apply(sites, lots, s, and_(_line.DOCDATE >= date, _line.DOCDATE < nxt))
+        written.append(store.write(nxt, sites, lots))
+        date = nxt
+    return written
+
+
+class OnHand(object):
+    """ Quantity and value of an item at a site, with its lot quantities """
+
+    def __init__(self, item, location, when, qty, value, lots):
+        self.item = item
+        self.location = location
+        self.when = when
+        self.qty = qty
+        self.value = value
+        self.lots = lots
+
+    def __repr__(self):
+        return 'OnHand(%s, %s, %s, qty=%s, value=%s)' % \
+               (self.item, self.location, self.when.strftime('%Y-%m-%d'),
+                self.qty, self.value)
+
+
+def as_of(store, item, location, when, s=None):
+    """ Return the `OnHand` of `item` at `location` at the end of `when` """
+    s = s and s or get_session()
+    end = _day(when) + timedelta(days=1)
+    sites = {}
+    lots = {}
+    cp = store.nearest(end)
+    criterion = and_(_line.ITEMNMBR == item,
+                     or_(_line.TRXLOCTN == location, _line.TRNSTLOC == location),
+                     _line.DOCDATE < end)
+    if cp is not None:
+        for rec_item, rec_loc, lot, qty, value in cp.records(item):
+            if rec_loc != location:
+                continue
+            if lot is None:
+                sites[(item, location)] = (qty, value)
+            else:
+                lots[(item, location, lot)] = qty
+        criterion = and_(criterion, _line.DOCDATE >= cp.date)
+    _apply(sites, lots, s, criterion)
+    qty, value = sites.get((item, location), (_ZERO, _ZERO))
+    found = dict([(k[2], v) for k, v in lots.items()
+                  if k[1] == location and v])
+    return OnHand(item, location, when, qty, value, found)
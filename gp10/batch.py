@@ -0,0 +1,162 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2009 John Hampton <pacopablo@pacopablo.com>
+# All rights reserved.
+#
+# This software is licensed as described in the file COPYING, which
+# you should have received as part of this distribution.
+#
+# Author: John Hampton <pacopablo@pacopablo.com>
+
+"""
+Dependency ordered batch inserts of new model objects.
+
+`session.flush()` inserts new objects one statement at a time whenever
+per-row defaults such as `get_next_note_index` have to run between rows.
+A `BatchWriter` instead collects new objects, resolves their column
+defaults a table at a time and writes each table with one executemany
+insert, parents before children as given by the foreign key constraints
+declared on the models (IV30200 before IV30300 before IV30400, PK010033
+and MOP1210 before MOP1020, ...).
+
+Defaults are resolved as follows:
+
+  * NOTEINDX defaults (`get_next_note_index`) get their indexes reserved
+    with one `get_next_note_indexes` call per flush, committed on a
+    connection of its own so the inserts do not hold the SY01500 lock;
+  * other callable defaults (`gp_cur_date`, `gp_cur_time`, ...) are called
+    once per table per flush, so every row of a batch shares the value;
+  * scalar defaults are copied.
+
+The resolved values are set on the objects too.  The objects are not added
+to the session: they are written with Core inserts, so relationships are
+not followed and foreign key columns must be set directly.
+"""
+
+# Standard library imports
+import time
+
+# Third Party imports
+from sqlalchemy.orm import object_mapper
+from sqlalchemy.sql.util import sort_tables
+
+# Local imports
+from gp10 import get_session
+from gp10.upsert import model_columns
+from gp10.util import get_next_note_index, get_next_note_indexes
+
+__all__ = [
+    'BatchWriter',
+]
+
+
+def _is_note_index(default):
+    fn = default.arg
+    return fn is get_next_note_index or \
+           getattr(fn, '__wrapped__', None) is get_next_note_index
+
+
+def _default_value(default):
+    if default.is_callable:
+        # SQLAlchemy wraps zero argument callables to accept the execution
+        # context; the gp10 defaults do not need one
+        return default.arg(None)
+    return default.arg
+
+
+class BatchWriter(object):
+    """ Collects new objects and inserts them a table at a time """
+
+    def __init__(self, s=None, batchsize=None, note_indexes=None):
+        """ `batchsize` flushes automatically once that many objects are
+        pending (add parents before their children when using it);
+        `note_indexes` replaces `get_next_note_indexes` as the
+        source of note indexes and is called as ``note_indexes(count, s)``
+        """
+        self.s = s and s or get_session()
+        self.batchsize = batchsize
+        self.note_indexes = note_indexes or get_next_note_indexes
+        self.pending = {}
+        self.count = 0
+        self.rows = {}
+        self.timings = {}
+
+    def __len__(self):
+        return self.count
+
+    def add(self, obj):
+        table = object_mapper(obj).local_table
+        self.pending.setdefault(table, []).append(obj)
+        self.count += 1
+        if self.batchsize and self.count >= self.batchsize:
+            self.flush()
+
+    def add_all(self, objs):
+        for obj in objs:
+            self.add(obj)
+
+    def _columns(self, mapper):
+        """ Return (attribute, column) pairs of the mapper's own table """
+        return [(a, c) for a, c in model_columns(mapper.class_)
+                if c.table is mapper.local_table]
+
+    def _rows(self, table, objs, notes):
+        """ Resolve the defaults of `objs` and return their insert rows """
+        mapper = object_mapper(objs[0])
+        columns = self._columns(mapper)
+        values = {}
+        rows = []
+        for obj in objs:
+            state = obj.__dict__
+            row = {}
+            for attr, col in columns:
+                value = state.get(attr)
+                if value is None and col.default is not None:
+                    if _is_note_index(col.default):
+                        value = notes.pop()
+                    else:
+                        if col.name not in values:
+                            values[col.name] = _default_value(col.default)
+                        value = values[col.name]
+                    setattr(obj, attr, value)
+                row[col.name] = value
+            rows.append(row)
+        return rows
+
+    def _notes_needed(self):
+        count = 0
+        for table, objs in self.pending.items():
+            mapper = object_mapper(objs[0])
+            attrs = [a for a, c in self._columns(mapper)
+                     if c.default is not None and _is_note_index(c.default)]
+            for obj in objs:
+                for attr in attrs:
+                    if obj.__dict__.get(attr) is None:
+                        count += 1
+        return count
+
+    def flush(self):
+        """ Insert everything pending, one statement per table
+
+        Note indexes are reserved and committed first, on a separate
+        connection.  The inserts are not committed; that is left to the
+        caller, and indexes reserved for a batch that is rolled back are
+        simply left unused, as with `get_next_note_index`.
+        """
+        if not self.pending:
+            return
+        t0 = time.time()
+        notes = self.note_indexes(self._notes_needed(), self.s)
+        notes.reverse()
+        batches = []
+        for table in sort_tables(self.pending.keys()):
+            batches.append((table, self._rows(table, self.pending[table], notes)))
+        t1 = time.time()
+        for table, rows in batches:
+            self.s.execute(table.insert(), rows)
+            self.rows[table.name] = self.rows.get(table.name, 0) + len(rows)
+        t2 = time.time()
+        self.timings['defaults'] = self.timings.get('defaults', 0) + t1 - t0
+        self.timings['insert'] = self.timings.get('insert', 0) + t2 - t1
+        self.pending = {}
+        self.count = 0
@@ -0,0 +1,223 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2009 John Hampton <pacopablo@pacopablo.com>
+# All rights reserved.
+#
+# This software is licensed as described in the file COPYING, which
+# you should have received as part of this distribution.
+#
+# Author: John Hampton <pacopablo@pacopablo.com>
+
+"""
+Splitting of large batches into bounded sub-batches, and parallel posting.
+
+A `BatchSplitter` takes transactions as they arrive and deals them into
+sub-batches of at most `maxlines` lines (and `maxtrx` transactions),
+numbered ``<prefix>-0001``, ``<prefix>-0002``, ...  A transaction is never
+split across sub-batches.  Numbering continues after the highest batch
+already in SY00500 for the prefix.
+
+The SY00500 header of every sub-batch keeps NUMOFTRX and BCHTOTAL current
+incrementally: `save_headers` inserts the new headers with a `BatchWriter`
+and adds what was dealt to each since the last save with one
+``NUMOFTRX = NUMOFTRX + :n, BCHTOTAL = BCHTOTAL + :total`` executemany.
+Nothing is ever re-counted.
+
+`post_batches` posts IV sub-batches with `gp10.posting.post_batch` on a
+pool of threads, each sub-batch in its own transaction that also removes
+its SY00500 header.  Each posting then locks only its own header row.
+Every sub-batch is a separate posting and so needs its own audit trail
+code (IV30100 TRXSORCE).  Deadlock victims are retried with
+`gp10.chunked.run_in_transaction`.
+"""
+
+# Standard library imports
+from decimal import Decimal
+
+# Third Party imports
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.sql import select, and_, bindparam
+
+# Local imports
+from gp10 import Base, UnboundMetadataError, get_session
+from gp10.batch import BatchWriter
+from gp10.chunked import run_in_transaction, run_workers
+from gp10.company import Batch_Headers_DUP
+from gp10.posting import post_batch
+
+__all__ = [
+    'SubBatch',
+    'BatchSplitter',
+    'post_batches',
+]
+
+_ZERO = Decimal(0)
+
+# Length of SY00500.BACHNUMB, and of the generated sub-batch suffix
+_BATCHNUM_LEN = 15
+_DIGITS = 4
+
+
+def _lines(trx):
+    lines = getattr(trx, 'lines', None)
+    return lines is not None and len(lines) or 1
+
+
+class SubBatch(object):
+    """ One generated batch and the transactions dealt into it """
+
+    def __init__(self, batchsrc, batchnum):
+        self.batchsrc = batchsrc
+        self.batchnum = batchnum
+        self.transactions = []
+        self.numtrx = 0
+        self.lines = 0
+        self.total = _ZERO
+
+    def add(self, trx):
+        self.transactions.append(trx)
+        self.numtrx += 1
+        self.lines += _lines(trx)
+        self.total += trx.total
+
+    def __repr__(self):
+        return 'SubBatch(%s, %s, numtrx=%d, lines=%d, total=%s)' % \
+               (self.batchsrc, self.batchnum, self.numtrx, self.lines,
+                self.total)
+
+
+class BatchSplitter(object):
+    """ Deals transactions into bounded, generated sub-batches """
+
+    def __init__(self, batchsrc, prefix, maxlines=1000, maxtrx=None, s=None,
+                 **header):
+        """ `header` holds extra Batch_Headers_DUP attributes for the new
+        headers (``series``, ``glpostdate``, ``origin``, ...)
+        """
+        if len(prefix) + 1 + _DIGITS > _BATCHNUM_LEN:
+            raise ValueError('batch prefix %r is too long' % prefix)
+        self.s = s and s or get_session()
+        self.batchsrc = batchsrc
+        self.prefix = prefix
+        self.maxlines = maxlines
+        self.maxtrx = maxtrx
+        self.header = header
+        self.batches = []
+        self.current = None
+        self.next = self._first_number()
+        # batchnum -> [numtrx, total] not yet written to SY00500
+        self.pending = {}
+        self.created = set()
+
+    def _first_number(self):
+        c = Batch_Headers_DUP.__table__.c
+        q = select([c.BACHNUMB], and_(c.BCHSOURC == self.batchsrc,
+                                      c.BACHNUMB.like(self.prefix + '-%')))
+        last = 0
+        for num, in self.s.execute(q):
+            suffix = num.rstrip()[len(self.prefix) + 1:]
+            if suffix.isdigit():
+                last = max(last, int(suffix))
+        return last + 1
+
+    def _full(self, batch, trx):
+        if not batch.numtrx:
+            return False
+        if self.maxtrx is not None and batch.numtrx >= self.maxtrx:
+            return True
+        return batch.lines + _lines(trx) > self.maxlines
+
+    def add(self, trx):
+        """ Deal `trx` into the current sub-batch, starting a new one when
+        it is full; returns the `SubBatch`
+        """
+        if self.current is None or self._full(self.current, trx):
+            if len(str(self.next)) > _DIGITS:
+                raise ValueError('batch numbers for prefix %r are exhausted' %
+                                 self.prefix)
+            num = '%s-%0*d' % (self.prefix, _DIGITS, self.next)
+            self.next += 1
+            self.current = SubBatch(self.batchsrc, num)
+            self.batches.append(self.current)
+        self.current.add(trx)
+        delta = self.pending.setdefault(self.current.batchnum, [0, _ZERO])
+        delta[0] += 1
+        delta[1] += trx.total
+        return self.current
+
+    def add_all(self, transactions):
+        for trx in transactions:
+            self.add(trx)
+
+    def save_headers(self, commit=True, note_indexes=None):
+        """ Create the new SY00500 headers and apply the pending totals
+
+        Returns the number of headers updated.
+        """
+        new = [b for b in self.batches if b.batchnum not in self.created]
+        params = [{'b_batchsrc': self.batchsrc, 'b_batchnum': num,
+                   'b_numtrx': n, 'b_total': total}
+                  for num, (n, total) in sorted(self.pending.items()) if n]
+        try:
+            if new:
+                writer = BatchWriter(self.s, note_indexes=note_indexes)
+                for b in new:
+                    attrs = dict(self.header)
+                    attrs.update(batchsrc=b.batchsrc, numtrxs=0, total=_ZERO)
+                    writer.add(Batch_Headers_DUP(b.batchnum, **attrs))
+                writer.flush()
+            if params:
+                tbl = Batch_Headers_DUP.__table__
+                c = tbl.c
+                stmt = tbl.update().where(
+                            and_(c.BCHSOURC == bindparam('b_batchsrc'),
+                                 c.BACHNUMB == bindparam('b_batchnum'))) \
+                          .values(NUMOFTRX=c.NUMOFTRX + bindparam('b_numtrx'),
+                                  BCHTOTAL=c.BCHTOTAL + bindparam('b_total'))
+                self.s.execute(stmt, params)
+            if commit:
+                self.s.commit()
+        except Exception:
+            if commit:
+                self.s.rollback()
+            raise
+        self.created.update([b.batchnum for b in new])
+        self.pending = {}
+        return len(params)
+
+
+def _post_one(s, trxsrc, batch, posteddate):
+    tbl = Batch_Headers_DUP.__table__
+    result = post_batch(trxsrc, batch.batchsrc, batch.batchnum,
+                        batch.transactions, s=s, posteddate=posteddate,
+                        commit=False)
+    s.execute(tbl.delete().where(and_(tbl.c.BCHSOURC == batch.batchsrc,
+                                      tbl.c.BACHNUMB == batch.batchnum)))
+    return result
+
+
+def post_batches(trxsrc, batches, sm=None, workers=4, retries=3,
+                 posteddate=None):
+    """ Post `SubBatch` objects of `IVTransaction` in parallel
+
+    `trxsrc` is called with each `SubBatch` and returns its audit trail
+    code.  Every sub-batch is posted and its SY00500 header removed in one
+    transaction, by one of `workers` threads.  Deadlock victims are
+    retried up to `retries` times.
+
+    Returns a pair of dicts: ``(results, errors)`` keyed by batch number,
+    holding the `PostingResult` or the exception of each sub-batch.
+    """
+    if sm is None:
+        if not Base.metadata.bind:
+            raise UnboundMetadataError
+        sm = sessionmaker(bind=Base.metadata.bind)
+
+    def post(batch):
+        code = trxsrc(batch)
+        return run_in_transaction(sm,
+                    lambda s: _post_one(s, code, batch, posteddate),
+                    retries=retries)
+
+    return run_workers(batches, post, key=lambda batch: batch.batchnum,
+                       workers=workers)
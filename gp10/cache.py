@@ -0,0 +1,363 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2009 John Hampton <pacopablo@pacopablo.com>
+# All rights reserved.
+#
+# This software is licensed as described in the file COPYING, which
+# you should have received as part of this distribution.
+#
+# Author: John Hampton <pacopablo@pacopablo.com>
+
+"""
+Query result cache invalidated by writes.
+
+`QueryCache.execute` runs a select (or ``query.statement``) and keeps its
+rows keyed by the compiled SQL and its parameters, evicting the least
+recently used entries beyond `maxsize` entries or `maxrows` rows.
+
+Every entry remembers the tables it reads and the values its WHERE clause
+pins with ``column == value`` conditions (``ITEMNMBR = 'X' AND LOCNCODE =
+'PCSF'``).  Once attached to sessions with `QueryCache.attach`, a flush
+drops only the entries whose pinned values match the old or new values of
+a flushed row; entries without pinned values on a table are dropped by any
+write to it.  The flushed rows are kept on the session and dropped again
+when its transaction commits or rolls back, since other sessions can cache
+the old rows until the commit and the flushing session itself can cache
+rows that a rollback undoes.  Insert, update and delete statements run through an engine
+passed to `watch` drop every entry on their table.
+
+An optional `backend` shares entries between processes.  Invalidation
+across processes works per table: every table has a generation number in
+the backend, which is part of the entry key and bumped on each write.
+
+Every table also has a local generation, bumped by each invalidation.  A
+result is only stored if the generations of its tables did not change
+while it was being read, so a write that lands between the read and the
+store cannot leave a stale entry behind.
+"""
+
+# Standard library imports
+import hashlib
+import threading
+from collections import OrderedDict
+try:
+    import cPickle as pickle
+except ImportError:
+    import pickle
+
+# Third Party imports
+from sqlalchemy import event
+from sqlalchemy.orm import object_mapper
+from sqlalchemy.orm.attributes import get_history
+from sqlalchemy.sql import operators
+from sqlalchemy.sql.expression import BinaryExpression, BindParameter
+from sqlalchemy.sql.expression import BooleanClauseList, ColumnClause
+from sqlalchemy.sql.expression import UpdateBase
+from sqlalchemy.sql.util import find_tables
+
+# Local imports
+from gp10 import get_session
+
+__all__ = [
+    'QueryCache',
+    'MemcacheBackend',
+]
+
+try:
+    _string_types = basestring
+except NameError:
+    _string_types = str
+
+
+def _same(a, b):
+    if isinstance(a, _string_types) and isinstance(b, _string_types):
+        # StripString columns compare without the CHAR padding
+        return a.rstrip() == b.rstrip()
+    return a == b
+
+
+def _pins(stmt):
+    """ Return ``{table: {column: value}}`` for the equality conditions
+    ANDed into the WHERE clause of `stmt`
+    """
+    where = getattr(stmt, '_whereclause', None)
+    if where is None:
+        return {}
+    if isinstance(where, BooleanClauseList) and where.operator is operators.and_:
+        clauses = where.clauses
+    else:
+        clauses = [where]
+    pins = {}
+    for clause in clauses:
+        if not isinstance(clause, BinaryExpression) or \
+           clause.operator is not operators.eq:
+            continue
+        col, bind = clause.left, clause.right
+        if isinstance(col, BindParameter):
+            col, bind = bind, col
+        if not isinstance(col, ColumnClause) or not isinstance(bind, BindParameter):
+            continue
+        if getattr(col, 'table', None) is None or bind.callable is not None:
+            continue
+        pins.setdefault(col.table.name, {})[col.name] = bind.value
+    return pins
+
+
+class _Entry(object):
+    __slots__ = ('rows', 'tables', 'pins')
+
+    def __init__(self, rows, tables, pins):
+        self.rows = rows
+        self.tables = tables
+        self.pins = pins
+
+
+class MemcacheBackend(object):
+    """ Cross-process backend on a memcached style client
+
+    `client` needs ``get``, ``set``, ``add`` and ``incr``, as provided by
+    python-memcached and pylibmc.
+    """
+
+    def __init__(self, client, prefix='gp10qc:', expire=300):
+        self.client = client
+        self.prefix = prefix
+        self.expire = expire
+
+    def _key(self, key):
+        return self.prefix + hashlib.md5(key).hexdigest()
+
+    def get(self, key):
+        data = self.client.get(self._key(key))
+        if data is None:
+            return None
+        return pickle.loads(data)
+
+    def set(self, key, rows):
+        self.client.set(self._key(key), pickle.dumps(rows, 2), self.expire)
+
+    def generation(self, table):
+        gen = self.client.get(self.prefix + 'gen:' + table)
+        return gen is not None and int(gen) or 0
+
+    def bump(self, table):
+        key = self.prefix + 'gen:' + table
+        if self.client.incr(key) is None:
+            self.client.add(key, 1)
+
+
+class QueryCache(object):
+    """ LRU cache of select results """
+
+    def __init__(self, maxsize=10000, maxrows=1000000, backend=None):
+        self.maxsize = maxsize
+        self.maxrows = maxrows
+        self.backend = backend
+        self.entries = OrderedDict()
+        self.by_table = {}
+        self.generations = {}
+        self.rows = 0
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+        self.evictions = 0
+        self._lock = threading.RLock()
+        self._flushing = threading.local()
+        self._pending = 'gp10.cache.pending.%d' % id(self)
+
+    def _hit_ratio(self):
+        total = self.hits + self.misses
+        if not total:
+            return 0.0
+        return float(self.hits) / total
+    hit_ratio = property(_hit_ratio)
+
+    def stats(self):
+        return {'entries': len(self.entries), 'rows': self.rows,
+                'hits': self.hits, 'misses': self.misses,
+                'hit_ratio': self.hit_ratio,
+                'invalidations': self.invalidations,
+                'evictions': self.evictions}
+
+    def _key(self, s, stmt):
+        bind = s.get_bind(clause=stmt)
+        compiled = stmt.compile(dialect=bind.dialect)
+        params = sorted([(k, repr(v)) for k, v in compiled.params.items()])
+        return ('%s\n%r' % (compiled, params)).encode('utf-8')
+
+    def _backend_key(self, key, tables):
+        gens = ','.join(['%s=%d' % (t, self.backend.generation(t))
+                         for t in sorted(tables)])
+        return key + b'\n' + gens.encode('utf-8')
+
+    def execute(self, stmt, s=None):
+        """ Return the rows of `stmt` as a list of tuples, from the cache
+        if possible
+        """
+        s = s and s or get_session()
+        if hasattr(stmt, 'statement') and hasattr(stmt, 'session'):
+            stmt = stmt.statement
+        key = self._key(s, stmt)
+        tables = set([getattr(t, 'name', None) for t in find_tables(stmt)])
+        tables.discard(None)
+        if self.backend is not None:
+            # The table generations are part of the key, so a write in any
+            # process makes local entries miss as well
+            key = self._backend_key(key, tables)
+        self._lock.acquire()
+        try:
+            entry = self.entries.get(key)
+            if entry is not None:
+                self.entries.pop(key)
+                self.entries[key] = entry
+                self.hits += 1
+                return entry.rows
+            gens = [self.generations.get(t, 0) for t in sorted(tables)]
+        finally:
+            self._lock.release()
+
+        rows = None
+        if self.backend is not None:
+            rows = self.backend.get(key)
+        if rows is None:
+            rows = [tuple(r) for r in s.execute(stmt)]
+            if self.backend is not None:
+                self.backend.set(key, rows)
+        self._lock.acquire()
+        try:
+            self.misses += 1
+            if gens == [self.generations.get(t, 0) for t in sorted(tables)]:
+                self._store(key, _Entry(rows, tables, _pins(stmt)))
+        finally:
+            self._lock.release()
+        return rows
+
+    def _store(self, key, entry):
+        self._drop(key)
+        self.entries[key] = entry
+        self.rows += len(entry.rows)
+        for table in entry.tables:
+            self.by_table.setdefault(table, set()).add(key)
+        while self.entries and (len(self.entries) > self.maxsize or
+                                self.rows > self.maxrows):
+            oldest = next(iter(self.entries))
+            self._drop(oldest)
+            self.evictions += 1
+
+    def _drop(self, key):
+        entry = self.entries.pop(key, None)
+        if entry is None:
+            return False
+        self.rows -= len(entry.rows)
+        for table in entry.tables:
+            keys = self.by_table.get(table)
+            if keys is not None:
+                keys.discard(key)
+        return True
+
+    def invalidate(self, table, values=None):
+        """ Drop the entries reading `table` that could see a row with
+        `values` (a list of dicts of column name to value); all entries
+        on `table` if `values` is None
+        """
+        self._lock.acquire()
+        try:
+            self.generations[table] = self.generations.get(table, 0) + 1
+            for key in list(self.by_table.get(table, ())):
+                pins = self.entries[key].pins.get(table)
+                if values is not None and pins:
+                    match = False
+                    for row in values:
+                        for col, value in pins.items():
+                            if col in row and not _same(row[col], value):
+                                break
+                        else:
+                            match = True
+                            break
+                    if not match:
+                        continue
+                if self._drop(key):
+                    self.invalidations += 1
+        finally:
+            self._lock.release()
+        if self.backend is not None:
+            self.backend.bump(table)
+
+    def clear(self):
+        self._lock.acquire()
+        try:
+            self.entries.clear()
+            self.by_table.clear()
+            self.rows = 0
+        finally:
+            self._lock.release()
+
+    def _before_flush(self, session, flush_context, instances):
+        self._flushing.active = True
+
+    def _after_flush(self, session, flush_context):
+        self._flushing.active = False
+
+    def _rolled_back(self, session, previous_transaction):
+        # A failed flush never reaches after_flush_postexec
+        self._flushing.active = False
+
+    def _flushed(self, session, flush_context):
+        touched = {}
+        for obj in list(session.new) + list(session.dirty) + list(session.deleted):
+            try:
+                mapper = object_mapper(obj)
+            except Exception:
+                continue
+            old = {}
+            new = {}
+            for prop in mapper.column_attrs:
+                col = prop.columns[0]
+                hist = get_history(obj, prop.key)
+                if hist.added:
+                    new[col.name] = hist.added[0]
+                if hist.deleted:
+                    old[col.name] = hist.deleted[0]
+                if hist.unchanged:
+                    old[col.name] = new[col.name] = hist.unchanged[0]
+            rows = touched.setdefault(mapper.local_table.name, [])
+            rows.append(new)
+            if old and old != new:
+                rows.append(old)
+        pending = session.info.setdefault(self._pending, {})
+        for table, rows in touched.items():
+            self.invalidate(table, rows)
+            pending.setdefault(table, []).extend(rows)
+
+    def _ended(self, session):
+        # Other sessions may have cached the committed rows between the
+        # flush and the commit, and a rollback undoes whatever this session
+        # cached since the flush
+        pending = session.info.pop(self._pending, None)
+        if pending:
+            for table, rows in pending.items():
+                self.invalidate(table, rows)
+
+    def _executed(self, conn, clauseelement, multiparams, params, result):
+        # Flushes of attached sessions are handled row by row in _flushed
+        if getattr(self._flushing, 'active', False):
+            return
+        if isinstance(clauseelement, UpdateBase):
+            self.invalidate(clauseelement.table.name)
+
+    def attach(self, target):
+        """ Invalidate on every flush of `target`, a Session, sessionmaker
+        or the Session class, and again when its transaction ends
+        """
+        event.listen(target, 'before_flush', self._before_flush)
+        event.listen(target, 'after_flush', self._flushed)
+        event.listen(target, 'after_flush_postexec', self._after_flush)
+        event.listen(target, 'after_soft_rollback', self._rolled_back)
+        event.listen(target, 'after_commit', self._ended)
+        event.listen(target, 'after_rollback', self._ended)
+
+    def watch(self, engine):
+        """ Invalidate on insert, update and delete statements run on
+        `engine`, other than the flushes of attached sessions
+        """
+        event.listen(engine, 'after_execute', self._executed)
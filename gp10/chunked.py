@@ -0,0 +1,385 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2009 John Hampton <pacopablo@pacopablo.com>
+# All rights reserved.
+#
+# This software is licensed as described in the file COPYING, which
+# you should have received as part of this distribution.
+#
+# Author: John Hampton <pacopablo@pacopablo.com>
+
+"""
+Chunked batch writes that survive deadlocks and lock timeouts.
+
+A `ChunkedWriter` feeds rows to a write function a chunk at a time, each
+chunk in its own session and transaction:
+
+  * a chunk that loses a deadlock or times out on a lock (see
+    `is_retryable`) is rolled back and retried after a randomized,
+    exponentially growing pause;
+  * a chunk that still fails after `retries` attempts, or that fails with
+    any other error, is split in half and each half is run on its own, so
+    a bad row ends up alone and is reported in `failures` while the rest
+    is written;
+  * after a deadlock the chunk size is halved, and it doubles again after
+    every `grow_after` clean commits up to `chunksize`, so contention is
+    met with shorter transactions rather than repeated rollbacks of large
+    ones.
+
+Every committed chunk is recorded in a `Checkpoint` by row offset.  Run
+again with the same rows and checkpoint, the writer skips what was already
+committed, so an interrupted batch can be resumed without writing any row
+twice.  A `FileCheckpoint` keeps the record across processes; a crash
+between a commit and its checkpoint record can still replay that one
+chunk.
+
+`start_workers` and `run_workers` spread independent units of work, each
+usually one `run_in_transaction` call, over a pool of threads.
+"""
+
+# Standard library imports
+import os
+import random
+import re
+import threading
+import time
+try:
+    from Queue import Queue, Empty
+except ImportError:
+    from queue import Queue, Empty
+
+# Third Party imports
+from sqlalchemy.exc import DBAPIError, IntegrityError
+from sqlalchemy.orm import sessionmaker
+
+# Local imports
+from gp10 import Base, UnboundMetadataError
+
+__all__ = [
+    'is_retryable',
+    'backoff_delay',
+    'run_in_transaction',
+    'start_workers',
+    'run_workers',
+    'Checkpoint',
+    'FileCheckpoint',
+    'ChunkedWriter',
+]
+
+# SQL Server: deadlock victim, lock request timeout
+_RETRYABLE_CODES = (1205, 1222)
+# SQLSTATE of a deadlock or serialization failure
+_RETRYABLE_STATES = ('40001',)
+# pyodbc puts the native error number in brackets after the message
+_NATIVE_CODE = re.compile(r'\((\d+)\)\s*(?:\(SQL\w+\))?\s*$')
+
+try:
+    _string_types = basestring
+    _integer_types = (int, long)
+except NameError:
+    _string_types = (str, bytes)
+    _integer_types = (int,)
+
+
+def _error_codes(orig):
+    """ Return the native error numbers and SQLSTATEs carried by the DB-API
+    exception `orig`
+    """
+    codes = set()
+    for arg in getattr(orig, 'args', ()):
+        if isinstance(arg, _integer_types) and not isinstance(arg, bool):
+            # pymssql: (number, message)
+            codes.add(arg)
+        elif isinstance(arg, _string_types):
+            if isinstance(arg, bytes):
+                arg = arg.decode('utf-8', 'replace')
+            if len(arg) == 5 and arg.isalnum():
+                # pyodbc: (sqlstate, message)
+                codes.add(arg)
+            for line in arg.splitlines():
+                match = _NATIVE_CODE.search(line)
+                if match:
+                    codes.add(int(match.group(1)))
+    return codes
+
+
+def is_retryable(e):
+    """ Return True if `e` is a deadlock, lock timeout or lost connection,
+    after which the same transaction may succeed if run again
+
+    Only the error number or SQLSTATE reported by the driver counts, never
+    the text of the message, which can quote the offending values.
+    """
+    if not isinstance(e, DBAPIError) or isinstance(e, IntegrityError):
+        return False
+    if e.connection_invalidated:
+        return True
+    codes = _error_codes(getattr(e, 'orig', None))
+    for code in _RETRYABLE_CODES + _RETRYABLE_STATES:
+        if code in codes:
+            return True
+    return False
+
+
+def backoff_delay(attempt, backoff=0.05, maxbackoff=2.0):
+    """ Return a random pause before retry `attempt` (1 for the first)
+
+    The ceiling doubles with every attempt, up to `maxbackoff`.
+    """
+    return random.uniform(0, min(maxbackoff, backoff * (2 ** attempt)))
+
+
+def run_in_transaction(sm, fn, retries=3, backoff=0.05, maxbackoff=2.0,
+                       retryable=is_retryable):
+    """ Call ``fn(session)`` in a new session from `sm` and commit
+
+    On an error the transaction is rolled back; if `retryable` accepts the
+    error the whole call is repeated in a fresh session, up to `retries`
+    times, after a `backoff_delay` pause.  Returns what `fn` returned.
+    """
+    attempt = 0
+    while True:
+        s = sm()
+        try:
+            try:
+                result = fn(s)
+                s.commit()
+                return result
+            except Exception as e:
+                s.rollback()
+                if attempt >= retries or not retryable(e):
+                    raise
+        finally:
+            s.close()
+        attempt += 1
+        time.sleep(backoff_delay(attempt, backoff, maxbackoff))
+
+
+def start_workers(items, task, workers=4, stop=None):
+    """ Start up to `workers` threads calling ``task(item)`` for `items`
+
+    Items are handed out in the order given, one at a time, to whichever
+    thread is free.  A thread exits once the items run out or `stop` (a
+    ``threading.Event``) is set; the item it is working on is finished
+    first.  `task` must not raise.  The threads are daemons and are
+    returned already started, for the caller to join.
+    """
+    queue = Queue()
+    items = list(items)
+    for item in items:
+        queue.put(item)
+
+    def worker():
+        while stop is None or not stop.is_set():
+            try:
+                item = queue.get_nowait()
+            except Empty:
+                return
+            task(item)
+
+    threads = [threading.Thread(target=worker)
+               for i in range(max(1, min(workers, len(items))))]
+    for t in threads:
+        t.daemon = True
+        t.start()
+    return threads
+
+
+def run_workers(items, fn, key=None, workers=4):
+    """ Call ``fn(item)`` for every item of `items` on `workers` threads
+    and wait for all of them
+
+    Returns a pair of dicts keyed by ``key(item)``, or the item itself if
+    `key` is None: ``(results, errors)``, holding what `fn` returned or the
+    exception it raised for each item.
+    """
+    results = {}
+    errors = {}
+    lock = threading.Lock()
+
+    def task(item):
+        if key is not None:
+            k = key(item)
+        else:
+            k = item
+        try:
+            value = fn(item)
+            target = results
+        except Exception as e:
+            value = e
+            target = errors
+        lock.acquire()
+        try:
+            target[k] = value
+        finally:
+            lock.release()
+
+    for t in start_workers(items, task, workers):
+        t.join()
+    return results, errors
+
+
+class Checkpoint(object):
+    """ In memory record of the row offsets already committed """
+
+    def __init__(self):
+        self.offsets = set()
+
+    def __len__(self):
+        return len(self.offsets)
+
+    def done(self, offset):
+        return offset in self.offsets
+
+    def mark(self, offsets):
+        self.offsets.update(offsets)
+
+
+def _ranges(offsets):
+    """ Collapse sorted `offsets` into ``(start, count)`` runs """
+    runs = []
+    for o in offsets:
+        if runs and runs[-1][0] + runs[-1][1] == o:
+            runs[-1][1] += 1
+        else:
+            runs.append([o, 1])
+    return runs
+
+
+class FileCheckpoint(Checkpoint):
+    """ Checkpoint appended to a file as ``start count`` lines """
+
+    def __init__(self, path):
+        Checkpoint.__init__(self)
+        self.path = path
+        if os.path.exists(path):
+            f = open(path, 'r')
+            try:
+                for line in f:
+                    parts = line.split()
+                    if len(parts) != 2:
+                        # A line cut short by a crash
+                        continue
+                    start, count = int(parts[0]), int(parts[1])
+                    self.offsets.update(range(start, start + count))
+            finally:
+                f.close()
+
+    def mark(self, offsets):
+        offsets = sorted(offsets)
+        f = open(self.path, 'a')
+        try:
+            for start, count in _ranges(offsets):
+                f.write('%d %d\n' % (start, count))
+            f.flush()
+            os.fsync(f.fileno())
+        finally:
+            f.close()
+        Checkpoint.mark(self, offsets)
+
+    def clear(self):
+        if os.path.exists(self.path):
+            os.remove(self.path)
+        self.offsets = set()
+
+
+class ChunkedWriter(object):
+    """ Applies a write function to rows in retried, self-splitting chunks """
+
+    def __init__(self, write, sm=None, chunksize=500, retries=5,
+                 backoff=0.05, maxbackoff=2.0, grow_after=4, checkpoint=None,
+                 retryable=is_retryable):
+        """ `write` is called as ``write(session, rows)`` and must only
+        issue statements on the session; the writer commits.  `sm` is a
+        sessionmaker, by default bound to the metadata's engine.
+        """
+        if sm is None:
+            if not Base.metadata.bind:
+                raise UnboundMetadataError
+            sm = sessionmaker(bind=Base.metadata.bind)
+        self.write = write
+        self.sm = sm
+        self.chunksize = max(1, chunksize)
+        self.retries = retries
+        self.backoff = backoff
+        self.maxbackoff = maxbackoff
+        self.grow_after = grow_after
+        if checkpoint is None:
+            checkpoint = Checkpoint()
+        self.checkpoint = checkpoint
+        self.retryable = retryable
+        self.size = self.chunksize
+        self._clean = 0
+        self.failures = []
+        self.stats = {'rows': 0, 'chunks': 0, 'skipped': 0, 'retries': 0,
+                      'splits': 0, 'failed': 0, 'sleep': 0.0}
+
+    def run(self, rows):
+        """ Write `rows`, a sequence; return the ``(offset, row, error)``
+        failures of this run
+
+        Offsets are positions in `rows`, so a resumed run must be given
+        the rows in the same order.
+        """
+        failures = []
+        pending = []
+        for offset, row in enumerate(rows):
+            if self.checkpoint.done(offset):
+                self.stats['skipped'] += 1
+                continue
+            pending.append((offset, row))
+            if len(pending) >= self.size:
+                failures.extend(self._chunk(pending))
+                pending = []
+        if pending:
+            failures.extend(self._chunk(pending))
+        self.failures.extend(failures)
+        return failures
+
+    def _pause(self, attempt):
+        delay = backoff_delay(attempt, self.backoff, self.maxbackoff)
+        self.stats['sleep'] += delay
+        time.sleep(delay)
+
+    def _attempt(self, chunk):
+        s = self.sm()
+        try:
+            try:
+                self.write(s, [row for offset, row in chunk])
+                s.commit()
+            except Exception:
+                s.rollback()
+                raise
+        finally:
+            s.close()
+
+    def _chunk(self, chunk):
+        """ Write one chunk, retrying and splitting as needed """
+        attempt = 0
+        while True:
+            try:
+                self._attempt(chunk)
+            except Exception as e:
+                if self.retryable(e):
+                    # Shorter transactions for everything that follows
+                    self.size = max(1, self.size // 2)
+                    self._clean = 0
+                    if attempt < self.retries:
+                        attempt += 1
+                        self.stats['retries'] += 1
+                        self._pause(attempt)
+                        continue
+                if len(chunk) == 1:
+                    self.stats['failed'] += 1
+                    return [(chunk[0][0], chunk[0][1], e)]
+                self.stats['splits'] += 1
+                half = len(chunk) // 2
+                return self._chunk(chunk[:half]) + self._chunk(chunk[half:])
+            self.checkpoint.mark([offset for offset, row in chunk])
+            self.stats['chunks'] += 1
+            self.stats['rows'] += len(chunk)
+            self._clean += 1
+            if self._clean >= self.grow_after and self.size < self.chunksize:
+                self.size = min(self.chunksize, self.size * 2)
+                self._clean = 0
+            return []
@@ -0,0 +1,211 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2009 John Hampton <pacopablo@pacopablo.com>
+# All rights reserved.
+#
+# This software is licensed as described in the file COPYING, which
+# you should have received as part of this distribution.
+#
+# Author: John Hampton <pacopablo@pacopablo.com>
+
+"""
+Registry of GP company databases and parallel fan-out queries.
+
+Every company database (INTERID) gets its own engine and sessionmaker.
+The gp10 models are not tied to an engine, so the same query function can
+be run against any company's session.  `CompanyRegistry.fan_out` runs one
+function in every company on a pool of threads and returns the results
+keyed by company; `CompanyRegistry.stream` yields result rows tagged with
+their company as soon as any database returns them.
+"""
+
+# Standard library imports
+import threading
+try:
+    from Queue import Queue, Full
+except ImportError:
+    from queue import Queue, Full
+
+# Third Party imports
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.sql import text
+
+# Local imports
+from gp10.chunked import start_workers, run_workers
+from gp10.errors import UnknownCompany
+
+__all__ = [
+    'CompanyRegistry',
+]
+
+_DONE = object()
+
+try:
+    _string_types = basestring
+except NameError:
+    _string_types = str
+
+
+class CompanyRegistry(object):
+    """ Engines and sessionmakers for a set of company databases """
+
+    def __init__(self, companies=None, **kwargs):
+        """ `companies` maps an INTERID to an engine or a database URL;
+        `kwargs` are passed to `create_engine` for URLs
+        """
+        self._engines = {}
+        self._makers = {}
+        self._lock = threading.Lock()
+        for company, bind in (companies or {}).items():
+            self.add(company, bind, **kwargs)
+
+    @classmethod
+    def load(cls, dynamics, url, **kwargs):
+        """ Register every company listed in DYNAMICS..SY01500
+
+        `dynamics` is an engine able to read the DYNAMICS system database and
+        `url` a database URL containing ``%(interid)s`` where the company
+        database name goes.
+        """
+        registry = cls()
+        rows = dynamics.execute(text('SELECT INTERID FROM DYNAMICS..SY01500'))
+        for (interid,) in rows:
+            interid = interid.strip()
+            registry.add(interid, url % {'interid': interid}, **kwargs)
+        return registry
+
+    def add(self, company, bind, **kwargs):
+        if isinstance(bind, _string_types):
+            bind = create_engine(bind, **kwargs)
+        self._lock.acquire()
+        try:
+            self._engines[company] = bind
+            self._makers[company] = sessionmaker(bind=bind)
+        finally:
+            self._lock.release()
+
+    def remove(self, company):
+        self._lock.acquire()
+        try:
+            self._engines.pop(company, None)
+            self._makers.pop(company, None)
+        finally:
+            self._lock.release()
+
+    def _companies(self):
+        return sorted(self._engines)
+    companies = property(_companies)
+
+    def __contains__(self, company):
+        return company in self._engines
+
+    def __len__(self):
+        return len(self._engines)
+
+    def engine(self, company):
+        try:
+            return self._engines[company]
+        except KeyError:
+            raise UnknownCompany(company)
+
+    def session(self, company):
+        """ Return a new session on `company`'s database """
+        try:
+            return self._makers[company]()
+        except KeyError:
+            raise UnknownCompany(company)
+
+    def _select(self, companies):
+        if companies is None:
+            return self.companies
+        for company in companies:
+            if company not in self._engines:
+                raise UnknownCompany(company)
+        return list(companies)
+
+    def fan_out(self, fn, companies=None, workers=None):
+        """ Run `fn(session)` in every company in parallel
+
+        Each company gets its own session, closed once `fn` returns, so `fn`
+        should return fully fetched results (e.g. ``query.all()``).  By
+        default there is one thread per company.
+
+        Returns a pair of dicts keyed by company: ``(results, errors)``.
+        """
+        companies = self._select(companies)
+
+        def run(company):
+            s = self.session(company)
+            try:
+                return fn(s)
+            finally:
+                s.close()
+
+        return run_workers(companies, run, workers=workers or len(companies))
+
+    def stream(self, fn, companies=None, workers=None, buffer=1000):
+        """ Yield ``(company, row)`` for every row of `fn(session)`
+
+        `fn` returns an iterable of rows, such as a Query or the result of
+        ``session.execute``.  Rows are handed over as soon as each database
+        returns them, so the slowest company does not hold up the rest;
+        there is no ordering across companies.  At most `buffer` rows are
+        held in memory.  The first error raised in any company is re-raised
+        here once the row stream stops.
+        """
+        companies = self._select(companies)
+        queue = Queue(buffer)
+        stop = threading.Event()
+
+        def put(item):
+            while not stop.is_set():
+                try:
+                    queue.put(item, True, 0.1)
+                    return True
+                except Full:
+                    pass
+            return False
+
+        def task(company):
+            s = self.session(company)
+            try:
+                try:
+                    for row in fn(s):
+                        if not put((company, row)):
+                            return
+                    put((company, _DONE))
+                except Exception as e:
+                    put((_DONE, e))
+            finally:
+                s.close()
+
+        threads = start_workers(companies, task,
+                                workers or len(companies), stop)
+        remaining = len(companies)
+        try:
+            while remaining:
+                company, row = queue.get()
+                if company is _DONE:
+                    raise row
+                if row is _DONE:
+                    remaining -= 1
+                    continue
+                yield company, row
+        finally:
+            stop.set()
+            for t in threads:
+                t.join()
+
+    def query(self, fn, companies=None, workers=None):
+        """ Return a list of ``(company, row)`` from every company
+
+        Like `stream`, but merged into one list in company order.
+        """
+        results, errors = self.fan_out(lambda s: list(fn(s)), companies, workers)
+        if errors:
+            raise errors[sorted(errors)[0]]
+        rows = []
+        for company in sorted(results):
+            rows.extend([(company, row) for row in results[company]])
+        return rows
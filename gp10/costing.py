@@ -0,0 +1,230 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2009 John Hampton <pacopablo@pacopablo.com>
+# All rights reserved.
+#
+# This software is licensed as described in the file COPYING, which
+# you should have received as part of this distribution.
+#
+# Author: John Hampton <pacopablo@pacopablo.com>
+
+"""
+Multi-level standard cost rollup.
+
+The item structure (BM010115), the primary routings (RT010001/RT010130) and
+the item master costs are each read with a single query.  Items are then
+costed bottom-up in low-level-code order, so every assembly is computed once
+and reused by every parent that consumes it.  Rolled costs are written back
+to IV00101 with one executemany update.
+"""
+
+# Standard library imports
+from decimal import Decimal
+
+# Third Party imports
+from sqlalchemy.sql import select, and_, bindparam
+
+# Local imports
+from gp10 import get_session
+from gp10.errors import BOMCycle
+from gp10.inventory import IV_Item_MSTR
+from gp10.manufacturing import BOM_Line, routing_mstr, routing_line
+
+__all__ = [
+    'RolledCost',
+    'CostRollup',
+]
+
+_ZERO = Decimal(0)
+_PLACES = Decimal('0.00001')
+
+# Cost bucket numbers as used by ITEM_COSTS_ARRAY_I_n on the WIP stack
+MATERIAL_BUCKET = 1
+LABOR_BUCKET = 2
+MACHINE_BUCKET = 3
+
+
+class RolledCost(object):
+    """ Rolled cost of a single item, split into cost buckets """
+    __slots__ = ('item', 'level', 'material', 'labor', 'machine')
+
+    def __init__(self, item, level, material=_ZERO, labor=_ZERO, machine=_ZERO):
+        self.item = item
+        self.level = level
+        self.material = material
+        self.labor = labor
+        self.machine = machine
+
+    def _total(self):
+        return self.material + self.labor + self.machine
+    total = property(_total)
+
+    def buckets(self):
+        """ Return the costs keyed by their ITEM_COSTS_ARRAY_I bucket """
+        return {MATERIAL_BUCKET: self.material,
+                LABOR_BUCKET: self.labor,
+                MACHINE_BUCKET: self.machine}
+
+    def __repr__(self):
+        return 'RolledCost(%s, level=%d, material=%s, labor=%s, machine=%s)' % \
+               (self.item, self.level, self.material, self.labor, self.machine)
+
+
+class CostRollup(object):
+    """ Bottom-up cost rollup over the bill of materials
+
+    `wc_rates` maps a work center id to a ``(labor_rate, machine_rate)``
+    pair of hourly rates.  The work center tables in this model carry no
+    rates, so they must be supplied by the caller.  Setup time is charged at
+    the labor rate and spread over `lot_size` units.
+    """
+
+    def __init__(self, costs, components, operations, wc_rates=None, lot_size=1):
+        self.costs = costs
+        self.components = components
+        self.operations = operations
+        self.wc_rates = wc_rates or {}
+        self.lot_size = Decimal(lot_size)
+        self._rolled = {}
+
+    @classmethod
+    def load(cls, s=None, wc_rates=None, lot_size=1, bomcat=1, bomname='',
+             costcol='stdcost'):
+        """ Read the item costs, BOM lines and primary routings """
+        s = s and s or get_session()
+        itm = IV_Item_MSTR.__table__.c
+        costcol = getattr(IV_Item_MSTR, costcol)
+        costs = dict(s.execute(select([itm.ITEMNMBR, costcol])).fetchall())
+
+        bom = BOM_Line.__table__.c
+        q = select([bom.PPN_I, bom.CPN_I, bom.QUANTITY_I],
+                   and_(bom.BOMCAT_I == bomcat, bom.BOMNAME_I == bomname))
+        components = {}
+        for parent, item, qty in s.execute(q):
+            components.setdefault(parent, []).append((item, qty))
+
+        rtm = routing_mstr.__table__.c
+        rtl = routing_line.__table__.c
+        q = select([rtl.ITEMNMBR, rtl.WCID_I, rtl.SETUPTIME_I,
+                    rtl.LABORTIME_I, rtl.MACHINETIME_I],
+                   and_(rtl.ITEMNMBR == rtm.ITEMNMBR,
+                        rtl.ROUTINGNAME_I == rtm.ROUTINGNAME_I,
+                        rtm.RTPRIMARY_I == 1))
+        operations = {}
+        for row in s.execute(q):
+            operations.setdefault(row[0], []).append(tuple(row[1:]))
+        return cls(costs, components, operations, wc_rates, lot_size)
+
+    def levels(self, items=None):
+        """ Return the items to roll up ordered lowest level first
+
+        Items are grouped by low-level code: purchased parts are level 0 and
+        every assembly sits one level above its deepest component.  Raises
+        `BOMCycle` if the structure is not a DAG.
+        """
+        if items is None:
+            items = set(self.costs) | set(self.components)
+        # Collect the closure of the requested items
+        pending = list(items)
+        seen = set()
+        while pending:
+            item = pending.pop()
+            if item in seen:
+                continue
+            seen.add(item)
+            for child, qty in self.components.get(item, ()):
+                if child not in seen:
+                    pending.append(child)
+
+        # Kahn's algorithm over component -> parent edges
+        waiting = {}
+        parents = {}
+        for item in seen:
+            children = set([c for c, q in self.components.get(item, ())])
+            waiting[item] = len(children)
+            for child in children:
+                parents.setdefault(child, []).append(item)
+        level = {}
+        ready = sorted([i for i, n in waiting.items() if n == 0])
+        for item in ready:
+            level[item] = 0
+        order = []
+        while ready:
+            item = ready.pop()
+            order.append(item)
+            for parent in parents.get(item, ()):
+                level[parent] = max(level.get(parent, 0), level[item] + 1)
+                waiting[parent] -= 1
+                if not waiting[parent]:
+                    ready.append(parent)
+        if len(order) != len(seen):
+            raise BOMCycle(sorted([i for i, n in waiting.items() if n]))
+        order.sort(key=lambda i: (level[i], i))
+        return [(i, level[i]) for i in order]
+
+    def _operation_cost(self, item):
+        labor = machine = _ZERO
+        for wc, setup, labortime, machinetime in self.operations.get(item, ()):
+            labor_rate, machine_rate = self.wc_rates.get(wc, (_ZERO, _ZERO))
+            labor += (labortime + setup / self.lot_size) * labor_rate
+            machine += machinetime * machine_rate
+        return labor, machine
+
+    def roll(self, items=None):
+        """ Roll up `items` (default: everything) and return their costs
+
+        Results are cached on the rollup, so rolling a second set of items
+        only costs the assemblies that were not reached the first time.
+        """
+        rolled = self._rolled
+        for item, level in self.levels(items):
+            if item in rolled:
+                continue
+            children = self.components.get(item)
+            if not children:
+                rolled[item] = RolledCost(item, level,
+                                          material=self.costs.get(item, _ZERO))
+                continue
+            material = labor = machine = _ZERO
+            for child, qty in children:
+                cost = rolled[child]
+                material += cost.material * qty
+                labor += cost.labor * qty
+                machine += cost.machine * qty
+            oplabor, opmachine = self._operation_cost(item)
+            rolled[item] = RolledCost(item, level,
+                                      material.quantize(_PLACES),
+                                      (labor + oplabor).quantize(_PLACES),
+                                      (machine + opmachine).quantize(_PLACES))
+        if items is None:
+            return dict(rolled)
+        return dict([(i, rolled[i]) for i in items])
+
+    def changes(self, rolled=None):
+        """ Return ``(item, cost)`` pairs whose rolled total differs """
+        if rolled is None:
+            rolled = self._rolled
+        changed = []
+        for item, cost in sorted(rolled.items()):
+            if item in self.costs and cost.total != self.costs[item]:
+                changed.append((item, cost.total))
+        return changed
+
+    def save(self, s=None, costcol='stdcost', rolled=None):
+        """ Write changed rolled costs back to IV00101 in one batch
+
+        Returns the number of items updated.  The caller owns the
+        transaction.
+        """
+        s = s and s or get_session()
+        changed = self.changes(rolled)
+        if not changed:
+            return 0
+        tbl = IV_Item_MSTR.__table__
+        colname = getattr(IV_Item_MSTR, costcol).property.columns[0].name
+        stmt = tbl.update().where(tbl.c.ITEMNMBR == bindparam('b_item')) \
+                  .values({colname: bindparam('b_cost')})
+        s.execute(stmt, [{'b_item': i, 'b_cost': c} for i, c in changed])
+        for item, cost in changed:
+            self.costs[item] = cost
+        return len(changed)
@@ -0,0 +1,195 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2009 John Hampton <pacopablo@pacopablo.com>
+# All rights reserved.
+#
+# This software is licensed as described in the file COPYING, which
+# you should have received as part of this distribution.
+#
+# Author: John Hampton <pacopablo@pacopablo.com>
+
+"""
+Atomic delta updates of the allocation and sold counters.
+
+Rather than loading a row, changing ``qtyallocated`` and flushing it back,
+a `CounterBatch` collects signed deltas per row and applies them as
+``ATYALLOC = ATYALLOC + :delta`` updates guarded in the WHERE clause:
+
+  * increases on the stock tables (IV00102, IV00300, MOP1000) require the
+    available quantity to cover the delta;
+  * decreases never take a counter below zero.
+
+Deltas for the same row are added together, and each flush issues one
+executemany statement per table, counter and direction, with the keys in
+sorted order so concurrent pickers lock rows in the same order.  A row
+whose guard fails is reported as `InsufficientLotQuantity`.
+"""
+
+# Standard library imports
+from decimal import Decimal
+
+# Third Party imports
+from sqlalchemy.orm import class_mapper
+from sqlalchemy.sql import select, and_, bindparam, case
+
+# Local imports
+from gp10 import get_session
+from gp10.errors import InsufficientLotQuantity
+
+__all__ = [
+    'CounterBatch',
+]
+
+_ZERO = Decimal(0)
+
+# Quantity the counters of a stock table are taken out of
+_TOTALS = {
+    'IV00102': 'QTYONHND',
+    'IV00300': 'QTYRECVD',
+    'MOP1000': 'QTYRECVD',
+}
+
+# Counters that make up the committed part of the stock.  IV00102 on hand
+# is already net of what was sold, so only the allocations come out of it.
+_COMMITTED = {
+    'IV00102': ('ATYALLOC',),
+    'IV00300': ('ATYALLOC', 'QTYSOLD'),
+    'MOP1000': ('ATYALLOC', 'QTYSOLD'),
+}
+
+
+def _available(table):
+    """ Return the SQL expression for the available quantity of `table`,
+    or None if it is not a stock table
+    """
+    total = _TOTALS.get(table.name)
+    if total is None:
+        return None
+    expr = table.c[total]
+    for name in _COMMITTED[table.name]:
+        if name not in table.c:
+            continue
+        col = table.c[name]
+        if name == 'ATYALLOC':
+            # Negative allocations do not add stock, as in `available`
+            col = case([(col > 0, col)], else_=0)
+        expr = expr - col
+    return expr
+
+
+class CounterBatch(object):
+    """ Coalesced, guarded counter deltas waiting to be flushed """
+
+    def __init__(self, s=None):
+        self.s = s and s or get_session()
+        self.deltas = {}
+
+    def __len__(self):
+        return len(self.deltas)
+
+    def _key(self, model, key):
+        mapper = class_mapper(model)
+        if isinstance(key, model):
+            return tuple(mapper.primary_key_from_instance(key))
+        if hasattr(key, 'items'):
+            values = []
+            for c in mapper.primary_key:
+                attr = mapper.get_property_by_column(c).key
+                if attr in key:
+                    values.append(key[attr])
+                else:
+                    values.append(key.get(c.name))
+            return tuple(values)
+        if not isinstance(key, (tuple, list)):
+            key = (key,)
+        return tuple(key)
+
+    def add(self, model, key, qty, attr='qtyallocated'):
+        """ Add `qty` (negative to subtract) to counter `attr` of a row
+
+        `key` is an instance of `model`, its primary key values in column
+        order, or a dict keyed by attribute or column name.
+        """
+        column = getattr(model, attr).property.columns[0]
+        k = (model, column.name, self._key(model, key))
+        self.deltas[k] = self.deltas.get(k, _ZERO) + Decimal(qty)
+
+    def allocate(self, model, key, qty):
+        self.add(model, key, qty, 'qtyallocated')
+
+    def release(self, model, key, qty):
+        self.add(model, key, -Decimal(qty), 'qtyallocated')
+
+    def sell(self, model, key, qty):
+        self.add(model, key, qty, 'qtysold')
+
+    def _groups(self):
+        groups = {}
+        for (model, column, key), delta in self.deltas.items():
+            if not delta:
+                continue
+            g = (model.__table__.name, column, delta > 0)
+            groups.setdefault(g, (model, []))[1].append((key, delta))
+        for g in sorted(groups):
+            model, rows = groups[g]
+            rows.sort()
+            yield model, g[1], g[2], rows
+
+    def _statement(self, model, column, increase):
+        table = model.__table__
+        keycols = list(class_mapper(model).primary_key)
+        col = table.c[column]
+        where = [c == bindparam('k_' + c.name) for c in keycols]
+        if increase:
+            available = _available(table)
+            if available is not None:
+                where.append(available >= bindparam('b_delta'))
+        else:
+            where.append(col + bindparam('b_delta') >= 0)
+        stmt = table.update().where(and_(*where)) \
+                    .values({column: col + bindparam('b_delta')})
+        return stmt, keycols
+
+    def _available(self, model, column, increase, keycols, key):
+        table = model.__table__
+        expr = None
+        if increase:
+            expr = _available(table)
+        if expr is None:
+            expr = table.c[column]
+        where = and_(*[c == v for c, v in zip(keycols, key)])
+        r = self.s.execute(select([expr], where)).fetchone()
+        return r is not None and r[0] or _ZERO
+
+    def flush(self):
+        """ Apply every pending delta
+
+        Raises `InsufficientLotQuantity` for the first row whose guard
+        fails.  Updates already issued are not undone; the caller should
+        roll back the transaction.
+        """
+        try:
+            for model, column, increase, rows in self._groups():
+                stmt, keycols = self._statement(model, column, increase)
+                params = []
+                for key, delta in rows:
+                    p = dict([('k_' + c.name, v) for c, v in zip(keycols, key)])
+                    p['b_delta'] = delta
+                    params.append(p)
+                dialect = self.s.connection(mapper=class_mapper(model)).dialect
+                if len(params) > 1 and dialect.supports_sane_multi_rowcount:
+                    # One statement for the whole group; only if a guard
+                    # failed is it undone and replayed row by row to find
+                    # the culprit.
+                    nested = self.s.begin_nested()
+                    if self.s.execute(stmt, params).rowcount == len(params):
+                        nested.commit()
+                        continue
+                    nested.rollback()
+                for p, (key, delta) in zip(params, rows):
+                    if self.s.execute(stmt, p).rowcount != 1:
+                        raise InsufficientLotQuantity(key, abs(delta),
+                                self._available(model, column, increase,
+                                                keycols, key))
+        finally:
+            self.deltas = {}
@@ -18,6 +18,10 @@ __all__ = [
     'InsufficientLotQuantity',
     'InvalidSite',
     'InvalidLot',
+    'BOMCycle',
+    'InvalidUofM',
+    'InvalidTransaction',
+    'UnknownCompany',
 ]
 
 class InsufficientLotQuantity(Exception):
@@ -61,3 +65,55 @@ class InvalidLot(Exception):
     def __str__(self):
         msg = 'InvalidLot: %s has no lot %s in site %s' % (self.item, self.lot, self.site)
         return msg
+
+
+class BOMCycle(Exception):
+    def __init__(self, items):
+        self.items = items
+
+    def __repr__(self):
+        return 'BOMCycle(%s)' % (', '.join(self.items))
+
+    def __str__(self):
+        msg = 'BOMCycle: items %s form a cycle in the bill of materials' % \
+              ', '.join(self.items)
+        return msg
+
+
+class InvalidUofM(Exception):
+    def __init__(self, item, uom):
+        self.item = item
+        self.uom = uom
+
+    def __repr__(self):
+        return 'InvalidUofM(%s, %s)' % (self.item, self.uom)
+
+    def __str__(self):
+        msg = 'InvalidUofM: %s is not a U of M of item %s' % (self.uom, self.item)
+        return msg
+
+
+class InvalidTransaction(Exception):
+    def __init__(self, docnum, reason):
+        self.docnum = docnum
+        self.reason = reason
+
+    def __repr__(self):
+        return 'InvalidTransaction(%s, %s)' % (self.docnum, self.reason)
+
+    def __str__(self):
+        msg = 'InvalidTransaction: %s %s' % (self.docnum, self.reason)
+        return msg
+
+
+class UnknownCompany(Exception):
+    def __init__(self, company):
+        self.company = company
+
+    def __repr__(self):
+        return 'UnknownCompany(%s)' % (self.company)
+
+    def __str__(self):
+        msg = 'UnknownCompany: no engine is registered for company %s' % \
+              self.company
+        return msg
@@ -0,0 +1,275 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2009 John Hampton <pacopablo@pacopablo.com>
+# All rights reserved.
+#
+# This software is licensed as described in the file COPYING, which
+# you should have received as part of this distribution.
+#
+# Author: John Hampton <pacopablo@pacopablo.com>
+
+"""
+Expiration ordered lot index for FEFO picking and expiry sweeps.
+
+The index keeps, per (item, site), the lots with stock ordered by
+expiration date.  Expiration dates are gathered once from the serial/lot
+history (IV30400), the MO lot issues (WO010302) and the lot attributes
+(IV00301), in that order of preference.  Lots whose only date is the GP
+epoch are treated as never expiring and sort last.
+"""
+
+# Standard library imports
+from bisect import bisect_left, bisect_right, insort
+from datetime import datetime
+from decimal import Decimal
+
+# Third Party imports
+from sqlalchemy.sql import select, and_
+
+# Local imports
+from gp10 import get_session
+from gp10.errors import InsufficientLotQuantity
+from gp10.inventory import IV_Lot_MSTR, IV_Lot_Attribute, IV_TRX_HIST_Serial_Lot
+from gp10.manufacturing import MOP_Lot_Issue
+from gp10.util import gp_epoch_start
+
+__all__ = [
+    'NEVER',
+    'LotEntry',
+    'ExpiryIndex',
+]
+
+_ZERO = Decimal(0)
+
+NEVER = datetime.max
+
+
+def _normalize(d):
+    if d is None or d <= gp_epoch_start():
+        return None
+    return d
+
+
+class LotEntry(object):
+    """ A lot layer with stock, as held by the index
+
+    `received`, `dateseq` and `qtytype` complete the IV00300 key of the
+    layer within its (item, site).
+    """
+    __slots__ = ('item', 'location', 'lot', 'received', 'dateseq',
+                 'qtytype', 'expiration', 'available')
+
+    def __init__(self, item, location, lot, received, dateseq, expiration,
+                 available, qtytype=1):
+        self.item = item
+        self.location = location
+        self.lot = lot
+        self.received = received
+        self.dateseq = dateseq
+        self.qtytype = qtytype
+        self.expiration = expiration or NEVER
+        self.available = available
+
+    def _sortkey(self):
+        return (self.expiration, self.received, self.dateseq, self.qtytype,
+                self.lot)
+    sortkey = property(_sortkey)
+
+    def __repr__(self):
+        return 'LotEntry(%s, %s, %s, expiration=%s, available=%s)' % \
+               (self.item, self.location, self.lot, self.expiration,
+                self.available)
+
+
+class _Bucket(object):
+    """ Lots of one (item, site), kept sorted by expiration """
+    __slots__ = ('keys', 'entries')
+
+    def __init__(self):
+        self.keys = []
+        self.entries = {}
+
+    def add(self, entry):
+        key = entry.sortkey
+        if key in self.entries:
+            self.entries[key].available += entry.available
+        else:
+            insort(self.keys, key)
+            self.entries[key] = entry
+
+    def remove(self, entry):
+        key = entry.sortkey
+        del self.entries[key]
+        del self.keys[bisect_left(self.keys, key)]
+
+    def between(self, start, end):
+        lo = bisect_left(self.keys, (start,))
+        hi = bisect_right(self.keys, (end, NEVER))
+        return [self.entries[k] for k in self.keys[lo:hi]]
+
+
+class ExpiryIndex(object):
+    """ Per (item, site) index of lot stock ordered by expiration """
+
+    def __init__(self):
+        self.buckets = {}
+        self.expirations = {}
+
+    def __len__(self):
+        return sum([len(b.keys) for b in self.buckets.values()])
+
+    @classmethod
+    def load(cls, s=None, items=None, attribute='attr4'):
+        """ Build an index from the database
+
+        One query is issued per source table.  `attribute` names the
+        IV_Lot_Attribute date column holding the expiration date.
+        """
+        s = s and s or get_session()
+        index = cls()
+        index.expirations.update(_load_expirations(s, items, attribute))
+        index._load_lots(s, items)
+        return index
+
+    def _load_lots(self, s, items):
+        c = IV_Lot_MSTR.__table__.c
+        # Only on hand stock can be picked; returned, in use, in service
+        # and damaged layers are left out
+        crit = [c.QTYTYPE == 1, c.QTYRECVD - c.ATYALLOC - c.QTYSOLD > 0]
+        if items is not None:
+            crit.append(c.ITEMNMBR.in_(list(items)))
+        q = select([c.ITEMNMBR, c.LOCNCODE, c.LOTNUMBR, c.DATERECD, c.DTSEQNUM,
+                    c.QTYTYPE, c.QTYRECVD, c.ATYALLOC, c.QTYSOLD], and_(*crit))
+        for item, location, lot, received, dateseq, qtytype, qtyrecvd, alloc, sold in s.execute(q):
+            available = qtyrecvd - (alloc >= 0 and alloc or 0) - sold
+            if available > 0:
+                self.add(LotEntry(item, location, lot, received, dateseq,
+                                  self.expirations.get((item, lot)), available,
+                                  qtytype))
+
+    def refresh(self, s, items, attribute='attr4'):
+        """ Reload the lots of `items` only
+
+        Intended to be called with the items touched by new receipts and
+        issues, so the index never needs a full rebuild.
+        """
+        items = list(items)
+        for key in [k for k in self.buckets if k[0] in items]:
+            del self.buckets[key]
+        for key in [k for k in self.expirations if k[0] in items]:
+            del self.expirations[key]
+        if items:
+            self.expirations.update(_load_expirations(s, items, attribute))
+            self._load_lots(s, items)
+
+    def add(self, entry):
+        key = (entry.item, entry.location)
+        bucket = self.buckets.get(key)
+        if bucket is None:
+            bucket = self.buckets[key] = _Bucket()
+        bucket.add(entry)
+
+    def receive(self, item, location, lot, received, dateseq, qty,
+                expiration=None, qtytype=1):
+        """ Record a receipt into the index """
+        expiration = _normalize(expiration)
+        if expiration is not None:
+            self.expirations[(item, lot)] = expiration
+        else:
+            expiration = self.expirations.get((item, lot))
+        self.add(LotEntry(item, location, lot, received, dateseq, expiration,
+                          Decimal(qty), qtytype))
+
+    def issue(self, item, location, lot, qty):
+        """ Record an issue of `qty` from `lot`, oldest layers first """
+        bucket = self.buckets.get((item, location))
+        qty = Decimal(qty)
+        if bucket is None:
+            raise InsufficientLotQuantity(lot, qty, _ZERO)
+        entries = [bucket.entries[k] for k in bucket.keys
+                   if bucket.entries[k].lot == lot]
+        available = sum([e.available for e in entries], _ZERO)
+        if qty > available:
+            raise InsufficientLotQuantity(lot, qty, available)
+        for entry in entries:
+            take = min(entry.available, qty)
+            entry.available -= take
+            qty -= take
+            if not entry.available:
+                bucket.remove(entry)
+            if not qty:
+                break
+
+    def expiring(self, start, end, item=None, location=None):
+        """ Return lots with stock expiring between `start` and `end`
+
+        Limit the sweep to one item and/or site by passing `item` and
+        `location`.  Results are ordered by expiration within each
+        (item, site).
+        """
+        found = []
+        for key in sorted(self.buckets):
+            if item is not None and key[0] != item:
+                continue
+            if location is not None and key[1] != location:
+                continue
+            found.extend(self.buckets[key].between(start, end))
+        return found
+
+    def pick(self, item, location, qty, asof=None, commit=False):
+        """ Choose lots first-expiring-first to cover `qty`
+
+        Lots expiring before `asof` are skipped.  Returns a list of
+        ``(entry, qty)`` pairs.  When `commit` is True the picked quantity
+        is also removed from the index.
+        """
+        qty = Decimal(qty)
+        bucket = self.buckets.get((item, location))
+        keys = bucket and bucket.keys or []
+        if asof is not None:
+            keys = keys[bisect_left(keys, (asof,)):]
+        picks = []
+        remaining = qty
+        for key in keys:
+            if remaining <= 0:
+                break
+            entry = bucket.entries[key]
+            take = min(entry.available, remaining)
+            picks.append((entry, take))
+            remaining -= take
+        if remaining > 0:
+            raise InsufficientLotQuantity(item, qty, qty - remaining)
+        if commit:
+            for entry, take in picks:
+                entry.available -= take
+                if not entry.available:
+                    bucket.remove(entry)
+        return picks
+
+
+def _load_expirations(s, items, attribute):
+    """ Return {(item, lot): expiration} merged from every source
+
+    Sources are applied from least to most preferred so that the serial/lot
+    history wins over MO lot issues, which win over lot attributes.
+    """
+    expirations = {}
+    lattr = IV_Lot_Attribute.__table__.c
+    datecol = getattr(IV_Lot_Attribute, attribute).property.columns[0]
+    mli = MOP_Lot_Issue.__table__.c
+    hist = IV_TRX_HIST_Serial_Lot.__table__.c
+    sources = [
+        (lattr.ITEMNMBR, lattr.LOTNUMBR, datecol),
+        (mli.ITEMNMBR, mli.LOTNUMBR, mli.EXPNDATE),
+        (hist.ITEMNMBR, hist.SERLTNUM, hist.EXPNDATE),
+    ]
+    for itemcol, lotcol, datecol in sources:
+        crit = [datecol > gp_epoch_start()]
+        if items is not None:
+            crit.append(itemcol.in_(list(items)))
+        q = select([itemcol, lotcol, datecol], and_(*crit)).distinct()
+        for item, lot, expiration in s.execute(q):
+            expiration = _normalize(expiration)
+            if expiration is not None:
+                expirations[(item, lot)] = expiration
+    return expirations
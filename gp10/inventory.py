@@ -106,7 +106,7 @@ class IV_Item_MSTR_QTYS(Base):
         pass
 
     def _available(self):
-        return self.qtyonhand - (self.qtyallocated >= 0 and self.qtyallocated or 0) - self.qtysold
+        return self.qtyonhand - (self.qtyallocated >= 0 and self.qtyallocated or 0)
     available = property(_available)
 
 
@@ -186,6 +186,34 @@ class IV_UofM_SETP_HDR(Base):
         pass
 
 
+class IV_UofM_SETP_DTL(Base):
+    """ Inventory U of M Schedule Detail Setup """
+    __tablename__ = 'IV40202'
+    __table_args__ = (ForeignKeyConstraint(['UOMSCHDL'],
+                                           ['IV40201.UOMSCHDL']), {})
+
+    schedule = Column('UOMSCHDL', StripString(11), primary_key=True)
+    seq = Column('SEQNUMBR', Integer, primary_key=True, autoincrement=False)
+    uom = Column('UOFM', StripString(9), nullable=False)
+    longdesc = Column('UOFMLONGDESC', StripString(21), nullable=False, default='')
+    equivuom = Column('EQUIVUOM', StripString(9), nullable=False)
+    equivqty = Column('EQUOMQTY', Numeric(19,5), nullable=False)
+    qtybsuom = Column('QTYBSUOM', Numeric(19,5), nullable=False)
+
+    def __init__(self, schedule, seq, uom, equivuom, equivqty, qtybsuom, **kwargs):
+        self.schedule = schedule
+        self.seq = seq
+        self.uom = uom
+        self.equivuom = equivuom
+        self.equivqty = equivqty
+        self.qtybsuom = qtybsuom
+
+        for k, v in kwargs.items():
+            setattr(self, k, v)
+
+        pass
+
+
 class IV_Location_SETP(Base):
     """ Site Setup """
     __tablename__ = 'IV40700'
@@ -0,0 +1,178 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2009 John Hampton <pacopablo@pacopablo.com>
+# All rights reserved.
+#
+# This software is licensed as described in the file COPYING, which
+# you should have received as part of this distribution.
+#
+# Author: John Hampton <pacopablo@pacopablo.com>
+
+"""
+Primary key lookups with precompiled statements.
+
+``session.query(Model).get(key)`` builds and compiles a new statement for
+every identity map miss, which dominates the cost of a lookup on the wide
+composite keys of IV00300, IV00102 and PK010033.  A `KeyLookup` compiles
+its statements once per dialect and reuses them:
+
+  * `get` fetches a single key, checking the identity map first;
+  * `get_many` fetches any number of keys in chunks of OR-ed key matches.
+    Every chunk is padded to the same size, so one compiled statement
+    serves all of them.
+"""
+
+# Standard library imports
+import threading
+
+# Third Party imports
+from sqlalchemy.orm import class_mapper
+from sqlalchemy.sql import select, and_, or_, bindparam
+
+# Local imports
+from gp10 import get_session
+
+__all__ = [
+    'KeyLookup',
+    'lookup_for',
+    'get',
+    'get_many',
+]
+
+# SQL Server accepts at most 2100 parameters per statement
+_MAX_PARAMS = 2000
+
+
+class KeyLookup(object):
+    """ Cached primary key statements for one model """
+
+    def __init__(self, model, chunksize=None):
+        self.model = model
+        self.mapper = class_mapper(model)
+        self.table = model.__table__
+        self.keycols = list(self.mapper.primary_key)
+        if chunksize is None:
+            chunksize = _MAX_PARAMS // len(self.keycols)
+        self.chunksize = chunksize
+        self._compiled = {}
+        self._lock = threading.Lock()
+
+    def _statement(self, n):
+        """ Select matching `n` keys, bound as k<i>_<column> """
+        clauses = [and_(*[c == bindparam('k%d_%s' % (i, c.name))
+                          for c in self.keycols])
+                   for i in range(n)]
+        if n == 1:
+            return select(list(self.table.columns), clauses[0])
+        return select(list(self.table.columns), or_(*clauses))
+
+    def _compile(self, dialect, n):
+        k = (dialect.name, n)
+        compiled = self._compiled.get(k)
+        if compiled is None:
+            self._lock.acquire()
+            try:
+                compiled = self._compiled.get(k)
+                if compiled is None:
+                    compiled = self._statement(n).compile(dialect=dialect)
+                    self._compiled[k] = compiled
+            finally:
+                self._lock.release()
+        return compiled
+
+    def _params(self, keys):
+        params = {}
+        for i, key in enumerate(keys):
+            for c, v in zip(self.keycols, key):
+                params['k%d_%s' % (i, c.name)] = v
+        return params
+
+    def _key(self, key):
+        if not isinstance(key, (tuple, list)):
+            key = (key,)
+        return tuple(key)
+
+    def _cached(self, s, key):
+        ident = self.mapper.identity_key_from_primary_key(list(key))
+        return s.identity_map.get(ident)
+
+    def _fetch(self, s, keys, n):
+        conn = s.connection(mapper=self.mapper)
+        compiled = self._compile(conn.dialect, n)
+        result = conn.execute(compiled, self._params(keys))
+        return list(s.query(self.model).instances(result))
+
+    def get(self, key, s=None):
+        """ Return the instance with primary key `key`, or None """
+        s = s and s or get_session()
+        key = self._key(key)
+        obj = self._cached(s, key)
+        if obj is not None:
+            return obj
+        found = self._fetch(s, [key], 1)
+        if not found:
+            return None
+        return found[0]
+
+    def get_many(self, keys, s=None):
+        """ Return a dict of primary key tuple to instance for `keys`
+
+        Keys already in the session's identity map are not fetched again.
+        Keys that do not exist are left out of the result.
+        """
+        s = s and s or get_session()
+        found = {}
+        missing = []
+        for key in keys:
+            key = self._key(key)
+            if key in found:
+                continue
+            obj = self._cached(s, key)
+            if obj is not None:
+                found[key] = obj
+            else:
+                missing.append(key)
+        missing = sorted(set(missing))
+        size = self.chunksize
+        if len(missing) < size:
+            # Small requests are padded to the next power of two instead,
+            # which keeps the number of cached statements small
+            size = 1
+            while size < len(missing):
+                size *= 2
+        for i in range(0, len(missing), size):
+            chunk = missing[i:i + size]
+            # Pad with the last key so every chunk reuses one statement
+            chunk = chunk + [chunk[-1]] * (size - len(chunk))
+            for obj in self._fetch(s, chunk, size):
+                key = tuple(self.mapper.primary_key_from_instance(obj))
+                found[key] = obj
+        return found
+
+
+_lookups = {}
+_lookups_lock = threading.Lock()
+
+
+def lookup_for(model):
+    """ Return the shared `KeyLookup` of `model` """
+    lookup = _lookups.get(model)
+    if lookup is None:
+        _lookups_lock.acquire()
+        try:
+            lookup = _lookups.get(model)
+            if lookup is None:
+                lookup = _lookups[model] = KeyLookup(model)
+        finally:
+            _lookups_lock.release()
+    return lookup
+
+
+def get(model, key, s=None):
+    """ Fetch one `model` instance by primary key """
+    return lookup_for(model).get(key, s)
+
+
+def get_many(model, keys, s=None):
+    """ Fetch many `model` instances by primary key """
+    return lookup_for(model).get_many(keys, s)
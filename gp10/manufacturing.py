@@ -444,6 +444,9 @@ class routing_line(Base):
     routeseq = Column('RTSEQNUM_I', StripString(11), primary_key=True)
     routedesc = Column('RTSEQDES_I', StripString(101), nullable=False)
     wcid = Column('WCID_I', StripString(11), nullable=False)
+    setuptime = Column('SETUPTIME_I', Numeric(19,5), nullable=False, default=Decimal(0))
+    labortime = Column('LABORTIME_I', Numeric(19,5), nullable=False, default=Decimal(0))
+    machinetime = Column('MACHINETIME_I', Numeric(19,5), nullable=False, default=Decimal(0))
     noteidx = Column('NOTEINDX', Numeric(19,5), nullable=False, default=get_next_note_index)
 
     def __init__(self, name, item, routeseq, routedesc, wcid, **kwargs):
@@ -484,6 +487,36 @@ class BOM_Revision(Base):
         pass
 
 
+class BOM_Line(Base):
+    """ Bill of Materials Line """
+    __tablename__ = 'BM010115'
+    __table_args__ = (ForeignKeyConstraint(['PPN_I',
+                                            'BOMCAT_I',
+                                            'BOMNAME_I'],
+                                           ['BM010415.ITEMNMBR',
+                                            'BM010415.BOMCAT_I',
+                                            'BM010415.BOMNAME_I']), {})
+
+    fgitem = Column('PPN_I', StripString(31), primary_key=True)
+    cat = Column('BOMCAT_I', Integer, primary_key=True, autoincrement=False, default=1)
+    name = Column('BOMNAME_I', StripString(15), primary_key=True, default='')
+    item = Column('CPN_I', StripString(31), primary_key=True)
+    posnum = Column('POSITION_NUMBER', Integer, primary_key=True, autoincrement=False)
+    qty = Column('QUANTITY_I', Numeric(19,5), nullable=False)
+    uom = Column('UOFM', StripString(9), nullable=False, default='Each')
+
+    def __init__(self, fgitem, item, posnum, qty, **kwargs):
+        self.fgitem = fgitem
+        self.item = item
+        self.posnum = posnum
+        self.qty = qty
+
+        for k, v in kwargs.items():
+            setattr(self, k, v)
+
+        pass
+
+
 class MOP_Picklist_Site_QTYS(Base):
     """  """
     __tablename__ = 'MOP1400'
@@ -0,0 +1,498 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2009 John Hampton <pacopablo@pacopablo.com>
+# All rights reserved.
+#
+# This software is licensed as described in the file COPYING, which
+# you should have received as part of this distribution.
+#
+# Author: John Hampton <pacopablo@pacopablo.com>
+
+"""
+Batched posting of inventory transactions into the IV history tables.
+
+A batch of `IVTransaction` objects is validated in memory, each history
+table (IV30100, IV30200, IV30300, IV30301, IV30400) is written with one
+executemany insert, and the quantity changes are aggregated per key and
+applied to IV00102/IV00300 as ``col = col + delta`` updates.  Receipts and
+transfers into a site or lot layer that does not exist yet insert it
+instead.  Everything runs inside a single transaction.
+
+`post_pick_documents` posts MOP pick documents the same set-based way:
+the pending lots are moved from MOP1020 to MOP1090 with INSERT ... SELECT
+and DELETE, a chunk of documents per transaction.
+"""
+
+# Standard library imports
+import time
+from decimal import Decimal
+
+# Third Party imports
+from sqlalchemy.sql import select, and_, bindparam
+
+# Local imports
+from gp10 import get_session
+from gp10.errors import InvalidTransaction, InvalidSite, InvalidLot
+from gp10.inventory import IV_Item_MSTR_QTYS, IV_Lot_MSTR
+from gp10.inventory import IV_TRX_HIST_Batch, IV_TRX_HIST_HDR, IV_TRX_HIST_LINE
+from gp10.inventory import IV_TRX_HIST_LINE_DTL, IV_TRX_HIST_Serial_Lot
+from gp10.manufacturing import MOP_Pending_Serial_Lot
+from gp10.manufacturing import MOP_Pending_Serial_Lot_HIST, MOP_Lot_Issue
+from gp10.manufacturing import MOP_PickDoc_MSTR
+from gp10.upsert import model_columns
+from gp10.util import gp_cur_date, gp_epoch_start
+
+__all__ = [
+    'IVLineLot',
+    'IVLineDetail',
+    'IVLine',
+    'IVTransaction',
+    'PostingResult',
+    'validate',
+    'post_batch',
+    'post_pick_documents',
+]
+
+_ZERO = Decimal(0)
+
+_CHUNK = 1000
+
+
+class IVLineLot(object):
+    """ Serial/lot detail of a transaction line (IV30400)
+
+    `received` and `dateseq` identify the IV00300 layer the quantity is
+    moved in or out of.  A layer that is relieved must already exist; a
+    receipt creates its layer if needed.  Transfers relieve the layer at
+    the source site and add to the layer of the same receipt at the
+    destination.
+    """
+
+    def __init__(self, lotseq, lot, qty, received, dateseq, from_bin='',
+                 to_bin='', mfgdate=None, expiration=None, qtytype=1):
+        self.lotseq = lotseq
+        self.lot = lot
+        self.qty = Decimal(qty)
+        self.received = received
+        self.dateseq = dateseq
+        self.from_bin = from_bin
+        self.to_bin = to_bin
+        self.mfgdate = mfgdate or gp_epoch_start()
+        self.expiration = expiration or gp_epoch_start()
+        self.qtytype = qtytype
+
+
+class IVLineDetail(object):
+    """ Receipt layer detail of a transaction line (IV30301) """
+
+    def __init__(self, detailseq, rctnum, qty, extcost, qtytype=1):
+        self.detailseq = detailseq
+        self.rctnum = rctnum
+        self.qty = Decimal(qty)
+        self.extcost = Decimal(extcost)
+        self.qtytype = qtytype
+
+
+class IVLine(object):
+    """ A single transaction line (IV30300) """
+
+    def __init__(self, seq, item, uom, qty, unitcost, location, invidx,
+                 invoffset, to_location='', qtybsuom=1, extcost=None,
+                 customer='', hist_module='IV', lots=None, details=None,
+                 **kwargs):
+        self.seq = seq
+        self.item = item
+        self.uom = uom
+        self.qty = Decimal(qty)
+        self.unitcost = Decimal(unitcost)
+        self.location = location
+        self.invidx = invidx
+        self.invoffset = invoffset
+        self.to_location = to_location
+        self.qtybsuom = Decimal(qtybsuom)
+        if extcost is None:
+            extcost = (self.qty * self.unitcost).quantize(Decimal('0.00001'))
+        self.extcost = Decimal(extcost)
+        self.customer = customer
+        self.hist_module = hist_module
+        self.lots = lots or []
+        self.details = details or []
+        self.extra = kwargs
+
+    def _base_qty(self):
+        return self.qty * self.qtybsuom
+    base_qty = property(_base_qty)
+
+
+class IVTransaction(object):
+    """ An inventory document (IV30200) and its lines """
+
+    def __init__(self, docnum, docdate, lines, doctype=1, glpostdate=None,
+                 source_ref='', source_indicator=0, noteidx=_ZERO):
+        self.docnum = docnum
+        self.docdate = docdate
+        self.lines = lines
+        self.doctype = doctype
+        self.glpostdate = glpostdate or docdate
+        self.source_ref = source_ref
+        self.source_indicator = source_indicator
+        self.noteidx = noteidx
+
+    def _total(self):
+        return sum([l.extcost for l in self.lines], _ZERO)
+    total = property(_total)
+
+
+class PostingResult(object):
+    """ Row counts, totals and timings of a `post_batch` run """
+
+    def __init__(self):
+        self.rows = {}
+        self.numtrx = 0
+        self.total = _ZERO
+        self.timings = {}
+
+    def __repr__(self):
+        return 'PostingResult(numtrx=%d, total=%s, rows=%r, timings=%r)' % \
+               (self.numtrx, self.total, self.rows, self.timings)
+
+
+_names = {}
+
+
+def _row(model, **attrs):
+    """ Map model attribute names to column names for a Core insert """
+    names = _names.get(model)
+    if names is None:
+        names = _names[model] = dict([(a, c.name) for a, c in model_columns(model)])
+    return dict([(names[a], v) for a, v in attrs.items()])
+
+
+def validate(transactions, s=None):
+    """ Check a batch in memory, raising `InvalidTransaction` on a problem
+
+    When a session `s` is given, the IV00102 sites and IV00300 lot layers
+    the batch draws stock from are also looked up, raising `InvalidSite`
+    or `InvalidLot` if one does not exist.
+    """
+    seen = set()
+    for trx in transactions:
+        key = (trx.doctype, trx.docnum)
+        if key in seen:
+            raise InvalidTransaction(trx.docnum, 'duplicate document number')
+        seen.add(key)
+        if not trx.lines:
+            raise InvalidTransaction(trx.docnum, 'no lines')
+        seqs = set()
+        for line in trx.lines:
+            if line.seq in seqs:
+                raise InvalidTransaction(trx.docnum, 'duplicate line %s' % line.seq)
+            seqs.add(line.seq)
+            if not line.qty:
+                raise InvalidTransaction(trx.docnum, 'line %s has no quantity' % line.seq)
+            if line.lots:
+                lotqty = sum([l.qty for l in line.lots], _ZERO)
+                if lotqty != abs(line.qty):
+                    raise InvalidTransaction(trx.docnum,
+                            'line %s lot quantity %s does not match %s' %
+                            (line.seq, lotqty, abs(line.qty)))
+                lotseqs = set([l.lotseq for l in line.lots])
+                if len(lotseqs) != len(line.lots):
+                    raise InvalidTransaction(trx.docnum,
+                            'line %s has duplicate lot sequences' % line.seq)
+    if s is not None:
+        sites, lots = _quantity_deltas(transactions)
+        _check_keys(sites, lots, *_existing_keys(s, sites, lots))
+
+
+def _add_layer(lots, key, lot, cost, received, sold):
+    layer = lots.get(key)
+    if layer is None:
+        layer = lots[key] = [lot, cost, _ZERO, _ZERO]
+    layer[2] += received
+    layer[3] += sold
+
+
+def _quantity_deltas(transactions):
+    """ Aggregate the IV00102 and IV00300 changes of a batch per key
+
+    Returns ``(sites, lots)``: `sites` maps (item, location) to the change
+    in on hand quantity and `lots` maps an IV00300 key to ``[lot number,
+    unit cost, received, sold]``, all in base units.
+    """
+    sites = {}
+    lots = {}
+    for trx in transactions:
+        for line in trx.lines:
+            base = line.base_qty
+            if line.to_location:
+                # Transfers move stock between sites rather than change it
+                moves = [(line.location, -abs(base)), (line.to_location, abs(base))]
+            else:
+                moves = [(line.location, base)]
+            for location, delta in moves:
+                key = (line.item, location)
+                sites[key] = sites.get(key, _ZERO) + delta
+            sign = line.qty < 0 and -1 or 1
+            cost = line.unitcost
+            if line.qtybsuom:
+                cost = cost / line.qtybsuom
+            for lot in line.lots:
+                key = (line.item, line.location, lot.received, lot.dateseq,
+                       lot.qtytype)
+                qty = lot.qty * line.qtybsuom
+                if sign < 0 or line.to_location:
+                    _add_layer(lots, key, lot.lot, cost, _ZERO, qty)
+                else:
+                    _add_layer(lots, key, lot.lot, cost, qty, _ZERO)
+                if line.to_location:
+                    key = (line.item, line.to_location, lot.received,
+                           lot.dateseq, lot.qtytype)
+                    _add_layer(lots, key, lot.lot, cost, qty, _ZERO)
+    return sites, lots
+
+
+def _existing_keys(s, sites, lots):
+    """ Return the sets of `sites` and `lots` keys present in IV00102 and
+    IV00300
+    """
+    q = IV_Item_MSTR_QTYS.__table__.c
+    l = IV_Lot_MSTR.__table__.c
+    items = sorted(set([k[0] for k in sites] + [k[0] for k in lots]))
+    found_sites = set()
+    found_lots = set()
+    for i in range(0, len(items), _CHUNK):
+        chunk = items[i:i + _CHUNK]
+        if sites:
+            for row in s.execute(select([q.ITEMNMBR, q.LOCNCODE],
+                                        and_(q.ITEMNMBR.in_(chunk),
+                                             q.RCRDTYPE == 2))):
+                found_sites.add(tuple(row))
+        if lots:
+            for row in s.execute(select([l.ITEMNMBR, l.LOCNCODE, l.DATERECD,
+                                         l.DTSEQNUM, l.QTYTYPE],
+                                        l.ITEMNMBR.in_(chunk))):
+                found_lots.add(tuple(row))
+    return found_sites & set(sites), found_lots & set(lots)
+
+
+def _check_keys(sites, lots, found_sites, found_lots):
+    """ Raise for a site or lot layer the batch takes stock from that is
+    not in `found_sites` / `found_lots`
+    """
+    for key, delta in sorted(sites.items()):
+        if delta < 0 and key not in found_sites:
+            raise InvalidSite(key[0], key[1])
+    for key, (lot, cost, received, sold) in sorted(lots.items()):
+        if not received and key not in found_lots:
+            raise InvalidLot(key[0], lot, key[1])
+
+
+def _check_rowcount(s, result, expected, sites, lots):
+    """ Raise `InvalidSite` / `InvalidLot` if an update matched fewer rows
+    than it was given, i.e. a row went away since it was looked up
+    """
+    if not result.dialect.supports_sane_multi_rowcount and expected > 1:
+        return
+    if result.rowcount == expected:
+        return
+    found_sites, found_lots = _existing_keys(s, sites, lots)
+    for key in sorted(sites):
+        if key not in found_sites:
+            raise InvalidSite(key[0], key[1])
+    for key in sorted(lots):
+        if key not in found_lots:
+            raise InvalidLot(key[0], lots[key][0], key[1])
+
+
+def post_batch(trxsrc, batchsrc, batchnum, transactions, s=None,
+               posteddate=None, commit=True):
+    """ Post a batch of `IVTransaction` objects
+
+    Every history table gets one multi-row insert and the quantity deltas
+    are applied as one aggregated update per table.  The work is committed
+    (or rolled back on error) as a single transaction unless `commit` is
+    False, in which case the caller owns the transaction.
+
+    Returns a `PostingResult`.
+    """
+    s = s and s or get_session()
+    result = PostingResult()
+    transactions = list(transactions)
+    t0 = time.time()
+    validate(transactions)
+    posteddate = posteddate or gp_cur_date()
+
+    result.numtrx = len(transactions)
+    result.total = sum([t.total for t in transactions], _ZERO)
+    batch = [_row(IV_TRX_HIST_Batch, trxsrc=trxsrc, batchsrc=batchsrc,
+                  batch=batchnum, posteddate=posteddate, hist_removed=0,
+                  batch_total=result.total, control_total=result.total,
+                  control_trx_count=result.numtrx, numtrans=result.numtrx)]
+    headers = []
+    lines = []
+    details = []
+    serials = []
+    for trx in transactions:
+        headers.append(_row(IV_TRX_HIST_HDR, trxsrc=trxsrc, doctype=trx.doctype,
+                            docnum=trx.docnum, docdate=trx.docdate,
+                            batchsrc=batchsrc, batchnum=batchnum,
+                            noteidx=trx.noteidx, gl_post_date=trx.glpostdate,
+                            source_ref=trx.source_ref,
+                            source_indicator=trx.source_indicator))
+        for line in trx.lines:
+            attrs = dict(line.extra)
+            attrs.update(trxsrc=trxsrc, doctype=trx.doctype, docnum=trx.docnum,
+                         seq=line.seq, docdate=trx.docdate,
+                         hist_module=line.hist_module, customer=line.customer,
+                         item=line.item, uom=line.uom, trxqty=line.qty,
+                         unitcost=line.unitcost, extcost=line.extcost,
+                         trxlocation=line.location,
+                         trx_to_location=line.to_location, invidx=line.invidx,
+                         invoffset=line.invoffset, qtybsuom=line.qtybsuom)
+            lines.append(_row(IV_TRX_HIST_LINE, **attrs))
+            for dtl in line.details:
+                details.append(_row(IV_TRX_HIST_LINE_DTL, doctype=trx.doctype,
+                                    docnum=trx.docnum, seq=line.seq,
+                                    detailseq=dtl.detailseq, qtytype=dtl.qtytype,
+                                    rctnum=dtl.rctnum, qty=dtl.qty,
+                                    extcost=dtl.extcost))
+            for lot in line.lots:
+                serials.append(_row(IV_TRX_HIST_Serial_Lot, trxsrc=trxsrc,
+                                    doctype=trx.doctype, docnum=trx.docnum,
+                                    seq=line.seq, lotseq=lot.lotseq, lot=lot.lot,
+                                    qty=lot.qty, from_bin=lot.from_bin,
+                                    to_bin=lot.to_bin, item=line.item,
+                                    mfgdate=lot.mfgdate,
+                                    expiration=lot.expiration))
+    sites, lots = _quantity_deltas(transactions)
+    t1 = time.time()
+    result.timings['prepare'] = t1 - t0
+
+    try:
+        for model, rows in ((IV_TRX_HIST_Batch, batch),
+                            (IV_TRX_HIST_HDR, headers),
+                            (IV_TRX_HIST_LINE, lines),
+                            (IV_TRX_HIST_LINE_DTL, details),
+                            (IV_TRX_HIST_Serial_Lot, serials)):
+            if rows:
+                s.execute(model.__table__.insert(), rows)
+            result.rows[model.__tablename__] = len(rows)
+        t2 = time.time()
+        result.timings['insert'] = t2 - t1
+
+        found_sites, found_lots = _existing_keys(s, sites, lots)
+        _check_keys(sites, lots, found_sites, found_lots)
+        if sites:
+            tbl = IV_Item_MSTR_QTYS.__table__
+            c = tbl.c
+            update = dict([(k, d) for k, d in sites.items()
+                           if d and k in found_sites])
+            new = [_row(IV_Item_MSTR_QTYS, item=k[0], location=k[1],
+                        recordtype=2, qtyonhand=d)
+                   for k, d in sorted(sites.items())
+                   if d and k not in found_sites]
+            if update:
+                stmt = tbl.update().where(and_(c.ITEMNMBR == bindparam('b_item'),
+                                               c.LOCNCODE == bindparam('b_location'),
+                                               c.RCRDTYPE == 2)) \
+                          .values(QTYONHND=c.QTYONHND + bindparam('b_delta'))
+                rows = s.execute(stmt, [{'b_item': i, 'b_location': l,
+                                         'b_delta': d}
+                                        for (i, l), d in sorted(update.items())])
+                _check_rowcount(s, rows, len(update), update, {})
+            if new:
+                s.execute(tbl.insert(), new)
+            result.rows['IV00102'] = len(update) + len(new)
+        if lots:
+            tbl = IV_Lot_MSTR.__table__
+            c = tbl.c
+            update = dict([(k, v) for k, v in lots.items() if k in found_lots])
+            new = [_row(IV_Lot_MSTR, item=k[0], location=k[1], received=k[2],
+                        dateseq=k[3], qtytype=k[4], lot=lot, cost=cost,
+                        qtyreceived=received, qtysold=sold)
+                   for k, (lot, cost, received, sold) in sorted(lots.items())
+                   if k not in found_lots]
+            if update:
+                stmt = tbl.update().where(and_(c.ITEMNMBR == bindparam('b_item'),
+                                               c.LOCNCODE == bindparam('b_location'),
+                                               c.DATERECD == bindparam('b_received'),
+                                               c.DTSEQNUM == bindparam('b_dateseq'),
+                                               c.QTYTYPE == bindparam('b_qtytype'))) \
+                          .values(QTYRECVD=c.QTYRECVD + bindparam('b_received_qty'),
+                                  QTYSOLD=c.QTYSOLD + bindparam('b_sold_qty'))
+                rows = s.execute(stmt, [{'b_item': k[0], 'b_location': k[1],
+                                         'b_received': k[2], 'b_dateseq': k[3],
+                                         'b_qtytype': k[4], 'b_received_qty': r,
+                                         'b_sold_qty': so}
+                                        for k, (lot, cost, r, so)
+                                        in sorted(update.items())])
+                _check_rowcount(s, rows, len(update), {}, update)
+            if new:
+                s.execute(tbl.insert(), new)
+            result.rows['IV00300'] = len(update) + len(new)
+        result.timings['quantities'] = time.time() - t2
+        if commit:
+            s.commit()
+    except Exception:
+        if commit:
+            s.rollback()
+        raise
+    return result
+
+
+def post_pick_documents(picknums, s=None, chunksize=100, posteddate=None):
+    """ Post MOP pick documents
+
+    For every chunk of `chunksize` pick numbers, in one transaction:
+
+      * the MOP1020 pending lots of the documents are copied to MOP1090
+        with a single INSERT ... SELECT and then deleted;
+      * their WO010302 lot issues are marked posted, with the pending
+        quantity moved to consumed;
+      * the MOP1200 documents are marked posted.
+
+    A failing chunk is rolled back and the error re-raised; chunks already
+    committed stay posted, and since posted lots are no longer pending,
+    running the same pick numbers again carries on where it stopped.
+
+    Returns a `PostingResult` whose `rows` hold the affected row counts.
+    """
+    s = s and s or get_session()
+    result = PostingResult()
+    posteddate = posteddate or gp_cur_date()
+    picknums = sorted(set(picknums))
+    pending = MOP_Pending_Serial_Lot.__table__
+    hist = MOP_Pending_Serial_Lot_HIST.__table__
+    issues = MOP_Lot_Issue.__table__
+    docs = MOP_PickDoc_MSTR.__table__
+    names = [c.name for c in hist.columns]
+    counts = {'MOP1090': 0, 'MOP1020': 0, 'WO010302': 0, 'MOP1200': 0}
+    t0 = time.time()
+    for i in range(0, len(picknums), chunksize):
+        chunk = picknums[i:i + chunksize]
+        try:
+            moved = s.execute(hist.insert().from_select(names,
+                    select([pending.c[n] for n in names],
+                           pending.c.DOCNUMBR.in_(chunk))))
+            counts['MOP1090'] += moved.rowcount
+            counts['MOP1020'] += s.execute(pending.delete()
+                    .where(pending.c.DOCNUMBR.in_(chunk))).rowcount
+            counts['WO010302'] += s.execute(issues.update()
+                    .where(and_(issues.c.PICKNUMBER.in_(chunk),
+                                issues.c.POSTED == 0))
+                    .values(POSTED=1,
+                            QTYCONSUMED=issues.c.QTYCONSUMED + issues.c.QTYPENDING,
+                            QTYPENDING=0)).rowcount
+            counts['MOP1200'] += s.execute(docs.update()
+                    .where(and_(docs.c.PICKNUMBER.in_(chunk),
+                                docs.c.POSTED == False))
+                    .values(POSTED=True, POSTEDDT=posteddate)).rowcount
+            s.commit()
+        except Exception:
+            s.rollback()
+            raise
+        result.numtrx += len(chunk)
+    result.rows = counts
+    result.timings['post'] = time.time() - t0
+    return result
@@ -22,6 +22,7 @@ from gp10 import Base, get_session
 from gp10.types import StripString, Ordinal
 from gp10.util import get_session, get_next_note_index, gp_cur_date
 from gp10.util import gp_cur_time, gp_epoch_start
+from gp10.inventory import get_currency
 
 class PM_Vendor_MSTR(Base):
     """ PM Vendor Master File """
@@ -0,0 +1,228 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2009 John Hampton <pacopablo@pacopablo.com>
+# All rights reserved.
+#
+# This software is licensed as described in the file COPYING, which
+# you should have received as part of this distribution.
+#
+# Author: John Hampton <pacopablo@pacopablo.com>
+
+"""
+Reconciliation of the IV00102 site quantities against their IV00300 lots.
+
+The item key space is split into ranges, and each range is handled by a
+worker thread with its own session.  A worker runs two queries: one reads
+the site rows and the other GROUP BYs the lot quantities per (item,
+site).  It then compares the two by key.  Every difference is yielded
+as a `Discrepancy` as soon as its range is done.  `correct` writes the lot
+figures back to IV00102 with batched updates.
+
+Only lot and serial tracked items are checked, and only on-hand lots
+(QTYTYPE 1) against site records (RCRDTYPE 2).  The measures compared are
+listed in `MEASURES`: QTYONHND against what the lots received less what
+they sold, and ATYALLOC against the lots' allocations.
+"""
+
+# Standard library imports
+import threading
+from decimal import Decimal
+try:
+    from Queue import Queue
+except ImportError:
+    from queue import Queue
+
+# Third Party imports
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.sql import select, and_, func, bindparam
+
+# Local imports
+from gp10 import Base, UnboundMetadataError
+from gp10.chunked import start_workers
+from gp10.inventory import IV_Item_MSTR, IV_Item_MSTR_QTYS, IV_Lot_MSTR
+
+__all__ = [
+    'MEASURES',
+    'Discrepancy',
+    'item_ranges',
+    'reconcile',
+    'correct',
+]
+
+_ZERO = Decimal(0)
+
+_site = IV_Item_MSTR_QTYS.__table__.c
+_lot = IV_Lot_MSTR.__table__.c
+_item = IV_Item_MSTR.__table__.c
+
+# IV00102 column and the lot aggregate it should equal
+MEASURES = (
+    ('QTYONHND', func.sum(_lot.QTYRECVD - _lot.QTYSOLD)),
+    ('ATYALLOC', func.sum(_lot.ATYALLOC)),
+)
+
+_TRACKED = (2, 3)
+
+
+class Discrepancy(object):
+    """ A site quantity that does not match the sum of its lots """
+
+    def __init__(self, item, location, column, site, lots):
+        self.item = item
+        self.location = location
+        self.column = column
+        self.site = site
+        self.lots = lots
+
+    def _diff(self):
+        return (self.site or _ZERO) - (self.lots or _ZERO)
+    diff = property(_diff)
+
+    def __repr__(self):
+        return 'Discrepancy(%s, %s, %s, site=%s, lots=%s)' % \
+               (self.item, self.location, self.column, self.site, self.lots)
+
+
+def item_ranges(s, partitions):
+    """ Split the tracked items into `partitions` ``(low, high)`` ranges
+
+    `low` is inclusive and `high` exclusive; the last range has a `high`
+    of None.
+    """
+    q = select([_item.ITEMNMBR], _item.ITMTRKOP.in_(_TRACKED),
+               order_by=[_item.ITEMNMBR])
+    items = [r[0] for r in s.execute(q)]
+    if not items:
+        return []
+    partitions = max(1, min(partitions, len(items)))
+    size = -(-len(items) // partitions)
+    bounds = items[::size]
+    return [(bounds[i], i + 1 < len(bounds) and bounds[i + 1] or None)
+            for i in range(len(bounds))]
+
+
+def _in_range(col, low, high):
+    if high is None:
+        return col >= low
+    return and_(col >= low, col < high)
+
+
+def _check_range(s, low, high, tolerance):
+    tracked = select([_item.ITEMNMBR], _item.ITMTRKOP.in_(_TRACKED))
+    names = [m[0] for m in MEASURES]
+    sites = select([_site.ITEMNMBR, _site.LOCNCODE] + [_site[n] for n in names],
+                   and_(_in_range(_site.ITEMNMBR, low, high),
+                        _site.RCRDTYPE == 2,
+                        _site.ITEMNMBR.in_(tracked)))
+    lots = select([_lot.ITEMNMBR, _lot.LOCNCODE] + [m[1] for m in MEASURES],
+                  and_(_in_range(_lot.ITEMNMBR, low, high),
+                       _lot.QTYTYPE == 1,
+                       _lot.ITEMNMBR.in_(tracked)),
+                  group_by=[_lot.ITEMNMBR, _lot.LOCNCODE])
+    site_rows = dict([((r[0], r[1]), r[2:]) for r in s.execute(sites)])
+    lot_rows = dict([((r[0], r[1]), r[2:]) for r in s.execute(lots)])
+    found = []
+    none = (None,) * len(names)
+    for key in sorted(set(site_rows) | set(lot_rows)):
+        site = site_rows.get(key, none)
+        lot = lot_rows.get(key, none)
+        for name, sv, lv in zip(names, site, lot):
+            if abs((sv or _ZERO) - (lv or _ZERO)) > tolerance or \
+               (sv is None) != (lv is None):
+                found.append(Discrepancy(key[0], key[1], name, sv, lv))
+    return found
+
+
+def reconcile(sm=None, partitions=16, workers=4, tolerance=_ZERO):
+    """ Yield a `Discrepancy` for every site quantity out of step with its
+    lots
+
+    `sm` is a sessionmaker; each worker opens its own session from it.
+    Discrepancies come out one range at a time, sorted within a range.
+    A site row without lots reports a `lots` of None, and lots without a
+    site row report a `site` of None.  Closing the generator early stops
+    the workers once their current range is done.
+    """
+    if sm is None:
+        if not Base.metadata.bind:
+            raise UnboundMetadataError
+        sm = sessionmaker(bind=Base.metadata.bind)
+    s = sm()
+    try:
+        ranges = item_ranges(s, partitions)
+    finally:
+        s.close()
+    if not ranges:
+        return
+    results = Queue()
+    stop = threading.Event()
+
+    def task(r):
+        s = sm()
+        try:
+            try:
+                results.put(_check_range(s, r[0], r[1], tolerance))
+            except Exception as e:
+                results.put(e)
+        finally:
+            s.close()
+
+    threads = start_workers(ranges, task, workers, stop)
+    try:
+        for i in range(len(ranges)):
+            found = results.get()
+            if isinstance(found, Exception):
+                raise found
+            for d in found:
+                yield d
+    finally:
+        # The consumer stopped early or a range failed: let the workers
+        # finish the range they are on and take no more
+        stop.set()
+        for t in threads:
+            t.join()
+
+
+def correct(discrepancies, s, chunksize=1000):
+    """ Set the IV00102 quantities of `discrepancies` to their lot totals
+
+    Each update only applies if the site quantity still holds the value
+    that was reported, so rows changed since the reconciliation are left
+    alone.  Site rows without lots are set to zero; lots without a site row
+    are skipped.  Returns the number of rows updated.  The session is not
+    committed.
+    """
+    tbl = IV_Item_MSTR_QTYS.__table__
+    stmts = {}
+    pending = {}
+    updated = 0
+
+    def flush(column):
+        rows = pending.pop(column, [])
+        if not rows:
+            return 0
+        stmt = stmts.get(column)
+        if stmt is None:
+            c = tbl.c
+            stmt = stmts[column] = tbl.update().where(
+                and_(c.ITEMNMBR == bindparam('b_item'),
+                     c.LOCNCODE == bindparam('b_location'),
+                     c.RCRDTYPE == 2,
+                     c[column] == bindparam('b_site'))) \
+                .values({column: bindparam('b_lots')})
+        result = s.execute(stmt, rows)
+        if len(rows) == 1 or result.supports_sane_multi_rowcount():
+            return result.rowcount
+        return len(rows)
+
+    for d in discrepancies:
+        if d.site is None:
+            continue
+        rows = pending.setdefault(d.column, [])
+        rows.append({'b_item': d.item, 'b_location': d.location,
+                     'b_site': d.site, 'b_lots': d.lots or _ZERO})
+        if len(rows) >= chunksize:
+            updated += flush(d.column)
+    for column in list(pending):
+        updated += flush(column)
+    return updated
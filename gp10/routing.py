@@ -0,0 +1,219 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2009 John Hampton <pacopablo@pacopablo.com>
+# All rights reserved.
+#
+# This software is licensed as described in the file COPYING, which
+# you should have received as part of this distribution.
+#
+# Author: John Hampton <pacopablo@pacopablo.com>
+
+"""
+Read/write engine routing.
+
+`RoutingSession` sends flushes and every insert, update, delete or textual
+statement to the primary engine, and sends reads of the configured
+read-only models (e.g. the IV30300/IV30400/POP30300 history) to a replica.
+Replicas that are unreachable or lag by more than the configured tolerance
+are skipped, falling back to the primary.  A replica that fails a read
+between health checks is marked down and the read is run again on another
+replica or the primary, both for `execute` and for ORM queries.  Once a
+session has written
+anything, it reads from the primary until the transaction ends so that it
+always sees its own writes.
+"""
+
+# Standard library imports
+import random
+import time
+
+# Third Party imports
+from sqlalchemy.exc import DBAPIError
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.orm.query import Query
+from sqlalchemy.orm.session import Session
+from sqlalchemy.sql.expression import Select
+from sqlalchemy.sql.util import find_tables
+
+# Local imports
+
+__all__ = [
+    'Replica',
+    'RoutingQuery',
+    'RoutingSession',
+    'routing_sessionmaker',
+]
+
+
+class Replica(object):
+    """ A replica engine and its health bookkeeping
+
+    `lag_check` is an optional callable taking a connection and returning the
+    replica lag in seconds; how lag is measured depends on the replication
+    in use, so it is left to the caller.  Health is re-checked at most once
+    every `interval` seconds.
+    """
+
+    def __init__(self, engine, lag_check=None, interval=5.0):
+        self.engine = engine
+        self.lag_check = lag_check
+        self.interval = interval
+        self.lag = 0
+        self.available = True
+        self._checked = 0
+
+    def check(self, force=False):
+        now = time.time()
+        if not force and now - self._checked < self.interval:
+            return self.available
+        self._checked = now
+        try:
+            conn = self.engine.connect()
+            try:
+                if self.lag_check is not None:
+                    self.lag = self.lag_check(conn)
+                else:
+                    conn.execute('SELECT 1')
+            finally:
+                conn.close()
+            self.available = True
+        except Exception:
+            self.available = False
+        return self.available
+
+    def mark_down(self):
+        self.available = False
+        self._checked = time.time()
+
+
+class RoutingQuery(Query):
+    """ Query whose reads fall back when their replica fails """
+
+    def _execute_and_instances(self, querycontext):
+        return self.session._read(
+                lambda: Query._execute_and_instances(self, querycontext))
+
+
+class RoutingSession(Session):
+    """ Session routing reads of `read_models` to healthy replicas
+
+    Constructor arguments beyond the standard Session ones:
+
+    `primary`
+        Engine receiving flushes, writes and all other reads.
+    `replicas`
+        Engines or `Replica` objects serving the read-only models.
+    `read_models`
+        Mapped classes or tables whose reads may go to a replica.
+    `max_lag`
+        Largest acceptable replica lag in seconds; None accepts any lag.
+    """
+
+    def __init__(self, primary=None, replicas=(), read_models=(), max_lag=None,
+                 **kwargs):
+        kwargs.pop('bind', None)
+        kwargs.setdefault('query_cls', RoutingQuery)
+        Session.__init__(self, bind=primary, **kwargs)
+        self.primary = primary
+        self.replicas = [isinstance(r, Replica) and r or Replica(r)
+                         for r in replicas]
+        self.read_tables = set([getattr(m, '__table__', m) for m in read_models])
+        self.max_lag = max_lag
+        self._force = None
+        self._wrote = False
+        self._reading = None
+
+    def use_primary(self):
+        """ Route every following read to the primary """
+        self._force = 'primary'
+
+    def use_replica(self):
+        """ Route every following select to a replica, whatever it reads """
+        self._force = 'replica'
+
+    def use_default(self):
+        self._force = None
+
+    def _replica(self):
+        candidates = []
+        for replica in self.replicas:
+            if not replica.check():
+                continue
+            if self.max_lag is not None and replica.lag > self.max_lag:
+                continue
+            candidates.append(replica)
+        if not candidates:
+            return None
+        return random.choice(candidates)
+
+    def _is_read(self, mapper, clause):
+        if self._force == 'primary' or self._wrote or self._flushing:
+            return False
+        if clause is not None:
+            if not isinstance(clause, Select):
+                return False
+            if self._force == 'replica':
+                return True
+            tables = find_tables(clause, include_aliases=True)
+            return bool(tables) and \
+                   set([getattr(t, 'original', t) for t in tables]) <= self.read_tables
+        if mapper is not None:
+            return self._force == 'replica' or \
+                   mapper.local_table in self.read_tables
+        return False
+
+    def get_bind(self, mapper=None, clause=None, **kwargs):
+        if self.replicas and self._is_read(mapper, clause):
+            replica = self._replica()
+            if replica is not None:
+                self._reading = replica
+                return replica.engine
+        return self.primary
+
+    def _read(self, fn):
+        """ Call `fn`; if it fails on a replica, mark that replica down and
+        call it again, until it runs on a healthy replica or the primary
+        """
+        while True:
+            self._reading = None
+            try:
+                return fn()
+            except DBAPIError:
+                replica = self._reading
+                if replica is None:
+                    raise
+                replica.mark_down()
+
+    def flush(self, objects=None):
+        if self.new or self.dirty or self.deleted:
+            self._wrote = True
+        Session.flush(self, objects)
+
+    def execute(self, clause, params=None, mapper=None, **kwargs):
+        if not isinstance(clause, Select):
+            self._wrote = True
+            return Session.execute(self, clause, params=params, mapper=mapper,
+                                   **kwargs)
+        return self._read(lambda: Session.execute(self, clause, params=params,
+                                                  mapper=mapper, **kwargs))
+
+    def commit(self):
+        Session.commit(self)
+        self._wrote = False
+
+    def rollback(self):
+        Session.rollback(self)
+        self._wrote = False
+
+
+def routing_sessionmaker(primary, replicas=(), read_models=(), max_lag=None,
+                         **kwargs):
+    """ Return a sessionmaker producing `RoutingSession` objects
+
+    Plain replica engines are wrapped in `Replica` objects here, so their
+    health is shared by every session the factory creates.
+    """
+    replicas = [isinstance(r, Replica) and r or Replica(r) for r in replicas]
+    return sessionmaker(class_=RoutingSession, primary=primary,
+                        replicas=replicas, read_models=read_models,
+                        max_lag=max_lag, **kwargs)
@@ -0,0 +1,430 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2009 John Hampton <pacopablo@pacopablo.com>
+# All rights reserved.
+#
+# This software is licensed as described in the file COPYING, which
+# you should have received as part of this distribution.
+#
+# Author: John Hampton <pacopablo@pacopablo.com>
+
+"""
+In-memory prefix and trigram search over the item master.
+
+The index is built from one bulk read of IV00101 and answers typeahead
+queries without touching the database.  Prefix matches come from a sorted
+token list searched with bisect; substring matches come from a trigram
+posting list, which is what ``LIKE '%x%'`` was being used for.
+
+Removing an item leaves a hole in the document list; once holes
+outnumber the live documents the index is rebuilt with `compact`.
+
+`dump` writes the index to a flat file that a `MappedSearchIndex` maps
+read-only, so a parent process can build it once and every worker
+searches the same pages instead of holding its own copy.  The layout
+follows `gp10.snapshot`, all integers little endian:
+
+  * an 8 byte magic, a 4 byte header length and a pickled header holding
+    the section offsets and counts;
+  * a string pool: uint32 offsets followed by the UTF-8 bytes of every
+    distinct string;
+  * the documents, one uint32 pool id per field;
+  * the prefix list, sorted, as (token id, field, docid) uint32 triples;
+  * the trigrams, sorted, as (trigram id, first posting, count) uint32
+    triples, followed by the uint32 docids of all the postings.
+"""
+
+# Standard library imports
+import mmap
+import os
+import re
+import struct
+from bisect import bisect_left, insort
+try:
+    import cPickle as pickle
+except ImportError:
+    import pickle
+
+# Third Party imports
+from sqlalchemy.sql import select
+
+# Local imports
+from gp10 import get_session
+from gp10.inventory import IV_Item_MSTR
+
+__all__ = [
+    'FIELDS',
+    'ItemSearchIndex',
+    'MappedSearchIndex',
+]
+
+_MAGIC = b'GP10IDX1'
+
+# Holes in the document list tolerated before `remove` compacts
+_MIN_HOLES = 1024
+
+# Searched IV_Item_MSTR attributes and the weight of a match in each
+FIELDS = (
+    ('item', 10),
+    ('alternate1', 8),
+    ('alternate2', 8),
+    ('shortname', 6),
+    ('itemdesc', 4),
+    ('usercategory1', 2),
+    ('usercategory2', 2),
+    ('usercategory3', 2),
+    ('usercategory4', 2),
+    ('usercategory5', 2),
+    ('usercategory6', 2),
+)
+
+_WORD = re.compile(r'[^\W_]+', re.UNICODE)
+
+
+def _normalize(value):
+    return (value or '').strip().lower()
+
+
+def _text(value):
+    if not isinstance(value, type(u'')):
+        value = value.decode('utf-8')
+    return value
+
+
+def _columns():
+    return [getattr(IV_Item_MSTR, f).property.columns[0] for f, w in FIELDS]
+
+
+def _trigrams(value):
+    return set([value[i:i + 3] for i in range(len(value) - 2)])
+
+
+class _Searcher(object):
+    """ Ranking shared by the in-memory and the mapped index
+
+    Subclasses provide `_matches`, the prefix entries from the first one
+    not sorting before `query`; `_postings`, the docids holding a trigram;
+    and `_doc`, the field values of a docid.
+    """
+
+    def search(self, text, limit=20):
+        """ Return up to `limit` ``(item, score)`` pairs matching `text`
+
+        Prefix matches on any token score the field weight, doubled for an
+        exact token match.  Queries of three or more characters also match
+        anywhere in a field through the trigram postings: a document must
+        hold every query trigram and is confirmed with a substring test.
+        """
+        query = _normalize(text)
+        if not query:
+            return []
+        weights = [w for f, w in FIELDS]
+        scores = {}
+        for token, field, docid in self._matches(query):
+            if not token.startswith(query):
+                break
+            score = weights[field] * (token == query and 2 or 1)
+            if score > scores.get(docid, 0):
+                scores[docid] = score
+        grams = _trigrams(query)
+        if grams:
+            postings = [self._postings(tri) for tri in grams]
+            postings.sort(key=len)
+            candidates = set(postings[0]).intersection(*postings[1:])
+            for docid in candidates:
+                best = 0
+                for field, value in enumerate(self._doc(docid)):
+                    if query in _normalize(value):
+                        best = max(best, weights[field] * 0.5)
+                if best:
+                    scores[docid] = max(scores.get(docid, 0), best)
+        items = dict([(d, self._doc(d)[0]) for d in scores])
+        ranked = sorted(scores.items(), key=lambda x: (-x[1], items[x[0]]))
+        return [(items[d], score) for d, score in ranked[:limit]]
+
+
+class ItemSearchIndex(_Searcher):
+    """ Prefix and trigram index over the searchable item fields """
+
+    def __init__(self):
+        self.docs = []
+        self.ids = {}
+        self.prefixes = []
+        self.trigrams = {}
+        self.holes = 0
+
+    def __len__(self):
+        return len(self.ids)
+
+    @classmethod
+    def load(cls, s=None):
+        """ Build the index from a single scan of IV00101 """
+        s = s and s or get_session()
+        index = cls()
+        for row in s.execute(select(_columns())):
+            index._add(tuple(row))
+        index.prefixes.sort()
+        return index
+
+    @classmethod
+    def load_file(cls, path):
+        """ Read a file written by `dump` back into an updatable index """
+        mapped = MappedSearchIndex(path)
+        try:
+            index = cls()
+            for docid in range(len(mapped)):
+                index._add(mapped._doc(docid))
+            index.prefixes.sort()
+        finally:
+            mapped.close()
+        return index
+
+    def dump(self, path):
+        """ Write the index to `path` in the `MappedSearchIndex` layout
+
+        The file is written next to `path` and renamed into place, so a
+        worker never maps a partial index.
+        """
+        if self.holes:
+            self.compact()
+        strings = set()
+        for values in self.docs:
+            strings.update([v or u'' for v in values])
+        strings.update([token for token, field, docid in self.prefixes])
+        strings.update(self.trigrams.keys())
+        strings = sorted([_text(v) for v in strings])
+        ids = dict([(v, i) for i, v in enumerate(strings)])
+        encoded = [v.encode('utf-8') for v in strings]
+        offsets = [0]
+        for v in encoded:
+            offsets.append(offsets[-1] + len(v))
+        pool = struct.pack('<%dI' % len(offsets), *offsets) + b''.join(encoded)
+
+        docs = []
+        for values in self.docs:
+            docs.extend([ids[_text(v or u'')] for v in values])
+        prefixes = []
+        for token, field, docid in self.prefixes:
+            prefixes.extend((ids[_text(token)], field, docid))
+        trigrams = []
+        postings = []
+        for tri in sorted(self.trigrams, key=_text):
+            docids = sorted(self.trigrams[tri])
+            trigrams.extend((ids[_text(tri)], len(postings), len(docids)))
+            postings.extend(docids)
+        sections = [pool]
+        for values in (docs, prefixes, trigrams, postings):
+            sections.append(struct.pack('<%dI' % len(values), *values))
+
+        header = {'fields': len(FIELDS), 'docs': len(self.docs),
+                  'strings': len(strings), 'prefixes': len(self.prefixes),
+                  'trigrams': len(self.trigrams)}
+        offset = 0
+        for name, data in zip(('pool', 'docs_at', 'prefixes_at',
+                               'trigrams_at', 'postings_at'), sections):
+            header[name] = offset
+            offset += len(data)
+        head = pickle.dumps(header, 2)
+
+        tmp = '%s.%d.tmp' % (path, os.getpid())
+        f = open(tmp, 'wb')
+        try:
+            f.write(_MAGIC)
+            f.write(struct.pack('<I', len(head)))
+            f.write(head)
+            for data in sections:
+                f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+        finally:
+            f.close()
+        os.rename(tmp, path)
+        return path
+
+    def _tokens(self, values):
+        """ Yield (token, field) for every indexable token of a document """
+        for field, value in enumerate(values):
+            value = _normalize(value)
+            if not value:
+                continue
+            yield value, field
+            for word in _WORD.findall(value):
+                if word != value:
+                    yield word, field
+
+    def _add(self, values, sort=False):
+        docid = len(self.docs)
+        self.docs.append(values)
+        self.ids[values[0]] = docid
+        seen = set()
+        for token, field in self._tokens(values):
+            if (token, field) in seen:
+                continue
+            seen.add((token, field))
+            if sort:
+                insort(self.prefixes, (token, field, docid))
+            else:
+                self.prefixes.append((token, field, docid))
+        for field, value in enumerate(values):
+            for tri in _trigrams(_normalize(value)):
+                self.trigrams.setdefault(tri, set()).add(docid)
+
+    def remove(self, item):
+        """ Drop `item` from the index """
+        docid = self.ids.pop(item, None)
+        if docid is None:
+            return
+        values = self.docs[docid]
+        self.docs[docid] = None
+        self.holes += 1
+        for token, field in set(self._tokens(values)):
+            i = bisect_left(self.prefixes, (token, field, docid))
+            if i < len(self.prefixes) and self.prefixes[i] == (token, field, docid):
+                del self.prefixes[i]
+        for field, value in enumerate(values):
+            for tri in _trigrams(_normalize(value)):
+                postings = self.trigrams.get(tri)
+                if postings is not None:
+                    postings.discard(docid)
+                    if not postings:
+                        del self.trigrams[tri]
+        if self.holes >= _MIN_HOLES and self.holes > len(self.ids):
+            self.compact()
+
+    def compact(self):
+        """ Renumber the live documents, dropping the holes left by
+        `remove`
+        """
+        live = [values for values in self.docs if values is not None]
+        self.docs = []
+        self.ids = {}
+        self.prefixes = []
+        self.trigrams = {}
+        self.holes = 0
+        for values in live:
+            self._add(values)
+        self.prefixes.sort()
+
+    def update(self, row):
+        """ Add or replace one item
+
+        `row` is an IV_Item_MSTR instance or a dict keyed by the attribute
+        names in `FIELDS`, such as a row fed to `gp10.upsert.bulk_upsert`.
+        """
+        if hasattr(row, 'get'):
+            values = tuple([row.get(f, '') for f, w in FIELDS])
+        else:
+            values = tuple([getattr(row, f, '') for f, w in FIELDS])
+        self.remove(values[0])
+        self._add(values, sort=True)
+
+    def update_many(self, rows):
+        for row in rows:
+            self.update(row)
+
+    def refresh(self, s, items):
+        """ Re-read `items` from IV00101 and update the index """
+        items = list(items)
+        if not items:
+            return
+        cols = _columns()
+        found = set()
+        for row in s.execute(select(cols, cols[0].in_(items))):
+            found.add(row[0])
+            self.remove(row[0])
+            self._add(tuple(row), sort=True)
+        for item in items:
+            if item not in found:
+                self.remove(item)
+
+    def _matches(self, query):
+        for i in range(bisect_left(self.prefixes, (query,)), len(self.prefixes)):
+            yield self.prefixes[i]
+
+    def _postings(self, tri):
+        return self.trigrams.get(tri, ())
+
+    def _doc(self, docid):
+        return self.docs[docid]
+
+
+class MappedSearchIndex(_Searcher):
+    """ A file written by `ItemSearchIndex.dump`, mapped read-only
+
+    Searches decode only the prefix entries, trigrams and documents they
+    touch.  To pick up changes, dump a new file and open it again.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        f = open(path, 'rb')
+        try:
+            self.map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        finally:
+            f.close()
+        if self.map[:len(_MAGIC)] != _MAGIC:
+            self.map.close()
+            raise ValueError('%s is not a gp10 search index' % path)
+        pos = len(_MAGIC)
+        headlen = struct.unpack_from('<I', self.map, pos)[0]
+        pos += 4
+        header = pickle.loads(self.map[pos:pos + headlen])
+        base = pos + headlen
+        self._nfields = header['fields']
+        self._ndocs = header['docs']
+        self._nprefixes = header['prefixes']
+        self._ntrigrams = header['trigrams']
+        self._offsets = base + header['pool']
+        self._strings = self._offsets + 4 * (header['strings'] + 1)
+        self._docs = base + header['docs_at']
+        self._prefixes = base + header['prefixes_at']
+        self._trigrams = base + header['trigrams_at']
+        self._postings_at = base + header['postings_at']
+        self._doc_fmt = '<%dI' % self._nfields
+
+    def __len__(self):
+        return self._ndocs
+
+    def _string(self, i):
+        start, end = struct.unpack_from('<II', self.map, self._offsets + 4 * i)
+        return self.map[self._strings + start:self._strings + end].decode('utf-8')
+
+    def _triple(self, at, i):
+        return struct.unpack_from('<III', self.map, at + 12 * i)
+
+    def _bisect(self, at, count, key):
+        """ First entry of a sorted triple section whose string is not
+        less than `key`
+        """
+        lo, hi = 0, count
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self._string(self._triple(at, mid)[0]) < key:
+                lo = mid + 1
+            else:
+                hi = mid
+        return lo
+
+    def _matches(self, query):
+        for i in range(self._bisect(self._prefixes, self._nprefixes, query),
+                       self._nprefixes):
+            token, field, docid = self._triple(self._prefixes, i)
+            yield self._string(token), field, docid
+
+    def _postings(self, tri):
+        i = self._bisect(self._trigrams, self._ntrigrams, tri)
+        if i == self._ntrigrams:
+            return ()
+        key, first, count = self._triple(self._trigrams, i)
+        if self._string(key) != tri:
+            return ()
+        return struct.unpack_from('<%dI' % count, self.map,
+                                  self._postings_at + 4 * first)
+
+    def _doc(self, docid):
+        ids = struct.unpack_from(self._doc_fmt, self.map,
+                                 self._docs + 4 * self._nfields * docid)
+        return tuple([self._string(i) for i in ids])
+
+    def close(self):
+        self.map.close()
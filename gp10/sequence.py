@@ -0,0 +1,200 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2009 John Hampton <pacopablo@pacopablo.com>
+# All rights reserved.
+#
+# This software is licensed as described in the file COPYING, which
+# you should have received as part of this distribution.
+#
+# Author: John Hampton <pacopablo@pacopablo.com>
+
+"""
+Line sequence allocation for GP ordinal numbering.
+
+GP numbers document lines (LNITMSEQ, SLTSQNUM, ...) in steps of 16384 so
+that lines can later be inserted between two others; see `gp10.util.to_ord`
+and `from_ord`.  An `OrdinalAllocator` reads a document's sequence numbers
+with one query and then hands out new ones in memory:
+
+  * `append` reserves a contiguous run after the last line;
+  * `insert_after` spreads new lines evenly over the gap after a line;
+  * when a gap is too small the document is renumbered back to whole
+    steps, and `save` writes the moves in three batched updates.
+
+Numbers handed out by `append` and `insert_after` are pending until they
+are passed to `commit`.  A renumbering that would move a pending number
+raises `ValueError` instead, since the caller may already be using it;
+commit what was handed out (and `save`) before inserting into a full gap.
+
+The sequence numbers handled here are the raw integers stored in the
+database, not the decimal values returned by `from_ord`.
+"""
+
+# Standard library imports
+from bisect import bisect_right, insort
+
+# Third Party imports
+from sqlalchemy.sql import select, and_, bindparam
+
+# Local imports
+from gp10 import get_session
+
+__all__ = [
+    'STEP',
+    'OrdinalAllocator',
+]
+
+# One whole line, i.e. to_ord(1)
+STEP = 16384
+
+
+class OrdinalAllocator(object):
+    """ Sequence numbers of the lines of one document """
+
+    def __init__(self, existing=(), step=STEP):
+        self.step = step
+        self.lines = sorted(set(existing))
+        self.stored = set(self.lines)
+        self.pending = set()
+        self.moves = {}
+
+    @classmethod
+    def load(cls, column, criterion, s=None, step=STEP, lock=False):
+        """ Read the sequence numbers in `column` of the rows matching
+        `criterion` with a single query
+
+        With `lock` the rows are read FOR UPDATE so that concurrent
+        allocators on the same document wait for each other.
+        """
+        s = s and s or get_session()
+        q = select([column], criterion, for_update=lock)
+        return cls([r[0] for r in s.execute(q)], step)
+
+    def __len__(self):
+        return len(self.lines)
+
+    def __iter__(self):
+        return iter(self.lines)
+
+    def append(self, n=1):
+        """ Reserve `n` sequence numbers after the last line """
+        last = self.lines and self.lines[-1] or 0
+        # Keep appended lines on whole steps even after odd inserts
+        start = (last // self.step + 1) * self.step
+        seqs = [start + i * self.step for i in range(n)]
+        self.lines.extend(seqs)
+        self.pending.update(seqs)
+        return seqs
+
+    def _gap(self, seq):
+        """ Return the (low, high) bounds of the gap following `seq` """
+        if seq is None:
+            low = 0
+            i = 0
+        else:
+            i = bisect_right(self.lines, seq)
+            low = seq
+        if i < len(self.lines):
+            high = self.lines[i]
+        else:
+            high = None
+        return low, high
+
+    def insert_after(self, seq, n=1):
+        """ Reserve `n` sequence numbers between `seq` and the next line
+
+        A `seq` of None inserts before the first line.  If the gap cannot
+        hold `n` more lines the document is renumbered first; `seq` is
+        translated, so it must be a current sequence number.  See
+        `renumber` for when that is refused.
+        """
+        low, high = self._gap(seq)
+        if high is None:
+            return self.append(n)
+        if high - low <= n:
+            moved = self.renumber()
+            if seq is not None:
+                seq = moved.get(seq, seq)
+            low, high = self._gap(seq)
+            if high - low <= n:
+                # A whole step still cannot take n lines; widen the gap
+                moved = self.renumber(spacing=dict([(seq, n + 1)]))
+                low, high = self._gap(seq)
+        width = (high - low) // (n + 1)
+        seqs = [low + width * (i + 1) for i in range(n)]
+        for v in seqs:
+            insort(self.lines, v)
+        self.pending.update(seqs)
+        return seqs
+
+    def renumber(self, spacing=None):
+        """ Respace every line to whole steps
+
+        `spacing` maps a sequence number to the number of steps to leave
+        after it (default one).  Returns a dict of old to new sequence
+        number for every line that moved, and records the moves of stored
+        lines in `moves` for `save`.
+
+        Raises `ValueError`, leaving the lines as they were, if a pending
+        number (handed out but not yet committed) would move.
+        """
+        spacing = spacing or {}
+        moved = {}
+        pos = 0
+        lines = []
+        for v in self.lines:
+            pos += self.step
+            lines.append(pos)
+            if v != pos:
+                moved[v] = pos
+            pos += (spacing.get(v, 1) - 1) * self.step
+        held = sorted(self.pending.intersection(moved))
+        if held:
+            raise ValueError('renumbering would move the uncommitted sequence '
+                             'numbers %s' % ', '.join([str(v) for v in held]))
+        # Record moves against the values stored in the database
+        origin = dict([(cur, orig) for orig, cur in self.moves.items()])
+        for old, new in moved.items():
+            orig = origin.get(old, old)
+            if orig in self.stored:
+                if orig == new:
+                    self.moves.pop(orig, None)
+                else:
+                    self.moves[orig] = new
+        self.lines = lines
+        return moved
+
+    def save(self, targets, s=None):
+        """ Write the pending renumbering of stored lines
+
+        `targets` is a sequence of ``(column, criterion)`` pairs, one per
+        table carrying the sequence, e.g. the line table and its serial/lot
+        detail.  Each target is first negated as a whole, which keeps the
+        new values from colliding with old ones in the primary key; the
+        moved lines are then set with one executemany and the rest flipped
+        back.
+        """
+        if not self.moves:
+            return
+        s = s and s or get_session()
+        olds = sorted(self.moves)
+        for column, criterion in targets:
+            table = column.table
+            s.execute(table.update()
+                      .where(and_(criterion, column > 0))
+                      .values({column.name: -column}))
+            s.execute(table.update()
+                      .where(and_(criterion, column == bindparam('b_old')))
+                      .values({column.name: bindparam('b_new')}),
+                      [{'b_old': -old, 'b_new': self.moves[old]}
+                       for old in olds])
+            s.execute(table.update()
+                      .where(and_(criterion, column < 0))
+                      .values({column.name: -column}))
+        self.stored = (self.stored - set(olds)) | set(self.moves.values())
+        self.moves = {}
+
+    def commit(self, seqs):
+        """ Mark `seqs` as written to the database """
+        self.stored.update(seqs)
+        self.pending.difference_update(seqs)
@@ -0,0 +1,239 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2009 John Hampton <pacopablo@pacopablo.com>
+# All rights reserved.
+#
+# This software is licensed as described in the file COPYING, which
+# you should have received as part of this distribution.
+#
+# Author: John Hampton <pacopablo@pacopablo.com>
+
+"""
+Serializers compiled from the model column definitions.
+
+For every model (and field selection) a `Serializer` generates the source
+of one JSON and one msgpack encoder function, with the attribute reads and
+the conversion for each column type written out inline, and compiles it
+once.  Encoding an object is then a single function call; no dict is built
+per row.
+
+Conversions:
+
+  * Numeric and Ordinal values are written as exact JSON numbers, and as
+    strings in msgpack, which has no decimal type;
+  * DateTime values are written as ISO 8601 strings;
+  * None is written as null (nil).
+
+msgpack support needs the msgpack package.
+"""
+
+# Standard library imports
+import json
+import threading
+
+# Third Party imports
+from sqlalchemy.types import Integer, Numeric, DateTime, Boolean
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+# Local imports
+from gp10.types import Ordinal
+from gp10.upsert import model_columns
+
+__all__ = [
+    'Serializer',
+    'serializer_for',
+]
+
+
+def _json_str(v):
+    if v is None:
+        return 'null'
+    return json.dumps(v)
+
+
+def _json_num(v):
+    if v is None:
+        return 'null'
+    if isinstance(v, float):
+        return repr(v)
+    return str(v)
+
+
+def _json_int(v):
+    if v is None:
+        return 'null'
+    return '%d' % v
+
+
+def _json_bool(v):
+    if v is None:
+        return 'null'
+    return v and 'true' or 'false'
+
+
+def _json_date(v):
+    if v is None:
+        return 'null'
+    return '"%s"' % v.isoformat()
+
+
+def _mp_num(v):
+    if v is None:
+        return None
+    return str(v)
+
+
+def _mp_date(v):
+    if v is None:
+        return None
+    return v.isoformat()
+
+
+def _kind(column):
+    if isinstance(column.type, Ordinal) or isinstance(column.type, Numeric):
+        return 'num'
+    if isinstance(column.type, Boolean):
+        return 'bool'
+    if isinstance(column.type, Integer):
+        return 'int'
+    if isinstance(column.type, DateTime):
+        return 'date'
+    return 'str'
+
+_JSON = {'num': '_json_num', 'int': '_json_int', 'bool': '_json_bool',
+         'date': '_json_date', 'str': '_json_str'}
+_MSGPACK = {'num': '_mp_num', 'date': '_mp_date'}
+
+_local = threading.local()
+
+
+def _packer():
+    packer = getattr(_local, 'packer', None)
+    if packer is None:
+        packer = _local.packer = msgpack.Packer()
+    return packer
+
+
+class Serializer(object):
+    """ Compiled JSON and msgpack encoders for one model """
+
+    def __init__(self, model, fields=None):
+        self.model = model
+        columns = model_columns(model)
+        if fields is None:
+            fields = [a for a, c in columns]
+        kinds = dict([(a, _kind(c)) for a, c in columns])
+        for f in fields:
+            if f not in kinds:
+                raise ValueError('%s has no column attribute %s' %
+                                 (model.__name__, f))
+        self.fields = tuple(fields)
+        self.kinds = tuple([kinds[f] for f in fields])
+        self._json = self._compile_json()
+        self._msgpack = None
+
+    def _compile(self, source, name, namespace):
+        code = compile(source, '<gp10.serialize %s %s>' %
+                               (self.model.__name__, name), 'exec')
+        exec(code, namespace)
+        return namespace[name]
+
+    def _compile_json(self):
+        fmt = []
+        args = []
+        for i, (field, kind) in enumerate(zip(self.fields, self.kinds)):
+            fmt.append('%s:%%s' % json.dumps(field).replace('%', '%%'))
+            args.append('%s(obj.%s)' % (_JSON[kind], field))
+        source = ['def encode(obj):',
+                  '    return %r %% (%s,)' % ('{' + ','.join(fmt) + '}',
+                                              ', '.join(args))]
+        if not self.fields:
+            source[1] = "    return '{}'"
+        namespace = dict([(n, globals()[n]) for n in _JSON.values()])
+        return self._compile('\n'.join(source) + '\n', 'encode', namespace)
+
+    def _compile_msgpack(self):
+        if msgpack is None:
+            raise ImportError('msgpack serialization requires msgpack')
+        packer = msgpack.Packer()
+        parts = ['_header']
+        namespace = {'_header': packer.pack_map_header(len(self.fields)),
+                     '_packer': _packer}
+        for i, (field, kind) in enumerate(zip(self.fields, self.kinds)):
+            namespace['_k%d' % i] = packer.pack(field)
+            value = 'obj.%s' % field
+            if kind in _MSGPACK:
+                value = '%s(%s)' % (_MSGPACK[kind], value)
+                namespace[_MSGPACK[kind]] = globals()[_MSGPACK[kind]]
+            parts.append('_k%d' % i)
+            parts.append('pack(%s)' % value)
+        source = ['def encode(obj):',
+                  '    pack = _packer().pack',
+                  '    return b"".join([%s])' % ', '.join(parts)]
+        return self._compile('\n'.join(source) + '\n', 'encode', namespace)
+
+    def to_json(self, obj):
+        """ Return `obj` as a JSON object string """
+        return self._json(obj)
+
+    def to_msgpack(self, obj):
+        """ Return `obj` as msgpack bytes """
+        if self._msgpack is None:
+            self._msgpack = self._compile_msgpack()
+        return self._msgpack(obj)
+
+    def iter_json(self, objs, chunksize=500):
+        """ Yield a JSON array of `objs` in pieces of `chunksize` objects
+
+        `objs` may be any iterable, such as a Query with ``yield_per``, so
+        large result sets are never held in memory whole.
+        """
+        encode = self._json
+        chunk = []
+        first = True
+        for obj in objs:
+            chunk.append(encode(obj))
+            if len(chunk) >= chunksize:
+                yield (first and '[' or ',') + ','.join(chunk)
+                first = False
+                chunk = []
+        yield (first and '[' or (chunk and ',' or '')) + ','.join(chunk) + ']'
+
+    def dumps_json(self, objs):
+        return ''.join(self.iter_json(objs))
+
+    def iter_msgpack(self, objs):
+        """ Yield one msgpack message per object
+
+        The concatenated messages are read back with ``msgpack.Unpacker``.
+        """
+        if self._msgpack is None:
+            self._msgpack = self._compile_msgpack()
+        encode = self._msgpack
+        for obj in objs:
+            yield encode(obj)
+
+
+_serializers = {}
+_serializers_lock = threading.Lock()
+
+
+def serializer_for(model, fields=None):
+    """ Return the shared `Serializer` of `model` for `fields` """
+    if fields is not None:
+        fields = tuple(fields)
+    key = (model, fields)
+    ser = _serializers.get(key)
+    if ser is None:
+        _serializers_lock.acquire()
+        try:
+            ser = _serializers.get(key)
+            if ser is None:
+                ser = _serializers[key] = Serializer(model, fields)
+        finally:
+            _serializers_lock.release()
+    return ser
@@ -0,0 +1,331 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2009 John Hampton <pacopablo@pacopablo.com>
+# All rights reserved.
+#
+# This software is licensed as described in the file COPYING, which
+# you should have received as part of this distribution.
+#
+# Author: John Hampton <pacopablo@pacopablo.com>
+
+"""
+What-if simulation of manufacture order release and allocation.
+
+`ReleaseSimulation.load` reads, once, everything a release of a set of MOs
+touches: the orders (WO010032), their picklists (PK010033), routings
+(WR010130), the site quantities (IV00102) and the on-hand lots (IV00300)
+of the picklist items.  `run` then releases the orders in memory and
+returns an `Outcome`; the database is never written and no locks are
+held, so any number of variants (which MOs, in what order, at what
+quantity, against what work center capacity) can be evaluated against
+the same snapshot.
+
+Allocation follows the rules of `gp10.counters`: a picklist line is
+allocated against the IV00102 available quantity of its site and, for
+lot and serial tracked items, against IV00300 lots in receipt order.  A
+line is allocated whole or not at all; a line that cannot be covered is
+reported as a `Shortage` carrying the `InsufficientLotQuantity` (or
+`InvalidSite`) the live allocation would raise.
+
+Work center load is the MO start quantity spread evenly over the
+scheduled days of each routing step.
+"""
+
+# Standard library imports
+from datetime import datetime, timedelta
+from decimal import Decimal
+
+# Third Party imports
+from sqlalchemy.sql import select, and_
+
+# Local imports
+from gp10 import get_session
+from gp10.errors import InsufficientLotQuantity, InvalidSite
+from gp10.inventory import IV_Item_MSTR, IV_Item_MSTR_QTYS, IV_Lot_MSTR
+from gp10.manufacturing import MOP_Order_MSTR, MOP_Item_MSTR
+from gp10.manufacturing import MOP_Routing_Line
+
+__all__ = [
+    'Allocation',
+    'Shortage',
+    'Overload',
+    'Outcome',
+    'ReleaseSimulation',
+]
+
+_ZERO = Decimal(0)
+_ONE = Decimal(1)
+
+_TRACKED = (2, 3)
+
+_CHUNK = 1000
+
+
+def _chunks(seq, size):
+    for i in range(0, len(seq), size):
+        yield seq[i:i + size]
+
+
+def _day(when):
+    return datetime(when.year, when.month, when.day)
+
+
+class Allocation(object):
+    """ A picklist line the release would allocate """
+    __slots__ = ('mo', 'seq', 'item', 'location', 'qty', 'lots')
+
+    def __init__(self, mo, seq, item, location, qty, lots):
+        self.mo = mo
+        self.seq = seq
+        self.item = item
+        self.location = location
+        self.qty = qty
+        self.lots = lots
+
+    def __repr__(self):
+        return 'Allocation(%s, %s, %s, %s, qty=%s)' % \
+               (self.mo, self.seq, self.item, self.location, self.qty)
+
+
+class Shortage(object):
+    """ A picklist line the release would fail to allocate """
+    __slots__ = ('mo', 'seq', 'item', 'location', 'qty', 'error')
+
+    def __init__(self, mo, seq, item, location, qty, error):
+        self.mo = mo
+        self.seq = seq
+        self.item = item
+        self.location = location
+        self.qty = qty
+        self.error = error
+
+    def __repr__(self):
+        return 'Shortage(%s, %s, %s, %s, qty=%s, error=%r)' % \
+               (self.mo, self.seq, self.item, self.location, self.qty,
+                self.error)
+
+
+class Overload(object):
+    """ A work center day loaded beyond its capacity """
+    __slots__ = ('wc', 'day', 'load', 'capacity')
+
+    def __init__(self, wc, day, load, capacity):
+        self.wc = wc
+        self.day = day
+        self.load = load
+        self.capacity = capacity
+
+    def __repr__(self):
+        return 'Overload(%s, %s, load=%s, capacity=%s)' % \
+               (self.wc, self.day.strftime('%Y-%m-%d'), self.load,
+                self.capacity)
+
+
+class Outcome(object):
+    """ The result of one simulated release """
+
+    def __init__(self, released, allocations, shortages, load, overloads):
+        self.released = released
+        self.allocations = allocations
+        self.shortages = shortages
+        self.load = load
+        self.overloads = overloads
+
+    def _ok(self):
+        return not self.shortages and not self.overloads
+    ok = property(_ok)
+
+    def _failed_orders(self):
+        seen = []
+        for s in self.shortages:
+            if s.mo not in seen:
+                seen.append(s.mo)
+        return seen
+    failed_orders = property(_failed_orders)
+
+    def __repr__(self):
+        return 'Outcome(released=%d, allocations=%d, shortages=%d, ' \
+               'overloads=%d)' % (len(self.released), len(self.allocations),
+                                  len(self.shortages), len(self.overloads))
+
+
+class ReleaseSimulation(object):
+    """ A read-only snapshot of the state a release of MOs depends on """
+
+    def __init__(self):
+        # mo -> (priority, startdate, startqty)
+        self.orders = {}
+        # mo -> [(seq, item, location, reqqty, issued + allocated, qtybsuom)]
+        self.lines = {}
+        # mo -> [(wc, day, share of the start quantity)]
+        self.steps = {}
+        # (item, location) -> available base qty
+        self.sites = {}
+        # (item, location) -> [(lot, (received, dateseq), available)]
+        self.lots = {}
+        self.tracked = set()
+
+    @classmethod
+    def load(cls, mos, s=None):
+        """ Snapshot the orders `mos` and the stock their picklists use
+
+        Issues one query per table (per chunk of keys).  Nothing is locked.
+        """
+        s = s and s or get_session()
+        sim = cls()
+        mos = list(mos)
+        o = MOP_Order_MSTR.__table__.c
+        p = MOP_Item_MSTR.__table__.c
+        r = MOP_Routing_Line.__table__.c
+        for chunk in _chunks(mos, _CHUNK):
+            q = select([o.MANUFACTUREORDER_I, o.MANUFACTUREORDPRI_I,
+                        o.STRTDATE, o.STARTQTY_I],
+                       o.MANUFACTUREORDER_I.in_(chunk))
+            for mo, priority, start, qty in s.execute(q):
+                sim.orders[mo] = (priority, start, qty)
+            q = select([p.MANUFACTUREORDER_I, p.SEQ_I, p.ITEMNMBR, p.LOCNCODE,
+                        p.SUGGESTEDQTY_I, p.QTY_ISSUED_I, p.ATYALLOC,
+                        p.QTYBSUOM],
+                       p.MANUFACTUREORDER_I.in_(chunk),
+                       order_by=[p.MANUFACTUREORDER_I, p.SEQ_I])
+            for mo, seq, item, location, req, issued, alloc, qtybsuom in s.execute(q):
+                sim.lines.setdefault(mo, []).append(
+                    (seq, item, location, req, issued + alloc, qtybsuom))
+            q = select([r.MANUFACTUREORDER_I, r.WCID_I,
+                        r.SCHEDULESTARTDATE_I, r.SCHEDULEFINISHDATE_I],
+                       r.MANUFACTUREORDER_I.in_(chunk),
+                       order_by=[r.MANUFACTUREORDER_I, r.RTSEQNUM_I])
+            for mo, wc, start, finish in s.execute(q):
+                start = _day(start)
+                days = max((_day(finish) - start).days + 1, 1)
+                share = _ONE / days
+                steps = sim.steps.setdefault(mo, [])
+                for i in range(days):
+                    steps.append((wc, start + timedelta(days=i), share))
+        items = sorted(set([l[1] for ls in sim.lines.values() for l in ls]))
+        sim._load_stock(s, items)
+        return sim
+
+    def _load_stock(self, s, items):
+        i = IV_Item_MSTR.__table__.c
+        q = IV_Item_MSTR_QTYS.__table__.c
+        l = IV_Lot_MSTR.__table__.c
+        for chunk in _chunks(items, _CHUNK):
+            for item, in s.execute(select([i.ITEMNMBR],
+                                          and_(i.ITEMNMBR.in_(chunk),
+                                               i.ITMTRKOP.in_(_TRACKED)))):
+                self.tracked.add(item)
+            stmt = select([q.ITEMNMBR, q.LOCNCODE, q.QTYONHND, q.ATYALLOC],
+                          and_(q.ITEMNMBR.in_(chunk), q.RCRDTYPE == 2))
+            # On hand is already net of sold stock
+            for item, location, onhand, alloc in s.execute(stmt):
+                self.sites[(item, location)] = \
+                    onhand - (alloc >= 0 and alloc or 0)
+            stmt = select([l.ITEMNMBR, l.LOCNCODE, l.LOTNUMBR, l.DATERECD,
+                           l.DTSEQNUM, l.QTYRECVD, l.ATYALLOC, l.QTYSOLD],
+                          and_(l.ITEMNMBR.in_(chunk), l.QTYTYPE == 1),
+                          order_by=[l.ITEMNMBR, l.LOCNCODE, l.DATERECD,
+                                    l.DTSEQNUM])
+            for item, location, lot, received, dateseq, recvd, alloc, sold in s.execute(stmt):
+                available = recvd - (alloc >= 0 and alloc or 0) - sold
+                if available > 0:
+                    self.lots.setdefault((item, location), []).append(
+                        (lot, (received, dateseq), available))
+
+    def release_order(self, mos=None):
+        """ Return `mos` (default every loaded MO) in release order:
+        priority, then start date
+        """
+        if mos is None:
+            mos = self.orders.keys()
+        return sorted([m for m in mos if m in self.orders],
+                      key=lambda m: (self.orders[m][0], self.orders[m][1], m))
+
+    def run(self, mos=None, quantities=None, capacity=None, ordered=False):
+        """ Release `mos` in memory and return the `Outcome`
+
+        `mos` are released in `release_order` unless `ordered` is True, in
+        which case they are released in the order given.  `quantities`
+        maps an MO to a new start quantity; its picklist requirements and
+        work center load scale with it.  `capacity` maps a work center to
+        the quantity it can take per day; work centers not in it are not
+        checked.  The snapshot itself is left unchanged.
+        """
+        if mos is None or not ordered:
+            mos = self.release_order(mos)
+        quantities = quantities or {}
+        capacity = capacity or {}
+        used_sites = {}
+        used_lots = {}
+        allocations = []
+        shortages = []
+        load = {}
+        released = []
+        for mo in mos:
+            if mo not in self.orders:
+                continue
+            released.append(mo)
+            startqty = self.orders[mo][2]
+            newqty = quantities.get(mo)
+            factor = _ONE
+            if newqty is not None and startqty:
+                factor = Decimal(newqty) / startqty
+                startqty = Decimal(newqty)
+            for line in self.lines.get(mo, ()):
+                result = self._allocate(mo, line, factor, used_sites, used_lots)
+                if isinstance(result, Shortage):
+                    shortages.append(result)
+                elif result is not None:
+                    allocations.append(result)
+            for wc, day, share in self.steps.get(mo, ()):
+                key = (wc, day)
+                load[key] = load.get(key, _ZERO) + startqty * share
+        overloads = []
+        for (wc, day), qty in sorted(load.items()):
+            limit = capacity.get(wc)
+            if limit is not None and qty > limit:
+                overloads.append(Overload(wc, day, qty, limit))
+        return Outcome(released, allocations, shortages, load, overloads)
+
+    def run_many(self, scenarios):
+        """ Yield ``(scenario, outcome)`` for every dict of `run` keyword
+        arguments in `scenarios`
+        """
+        for scenario in scenarios:
+            yield scenario, self.run(**scenario)
+
+    def _allocate(self, mo, line, factor, used_sites, used_lots):
+        seq, item, location, req, committed, qtybsuom = line
+        qty = (req * factor - committed) * qtybsuom
+        if qty <= 0:
+            return None
+        key = (item, location)
+        available = self.sites.get(key)
+        if available is None:
+            return Shortage(mo, seq, item, location, qty,
+                            InvalidSite(item, location))
+        available -= used_sites.get(key, _ZERO)
+        if qty > available:
+            return Shortage(mo, seq, item, location, qty,
+                            InsufficientLotQuantity(key, qty, available))
+        picks = []
+        if item in self.tracked:
+            remaining = qty
+            for lot, lotkey, lotqty in self.lots.get(key, ()):
+                k = (item, location, lotkey)
+                take = min(lotqty - used_lots.get(k, _ZERO), remaining)
+                if take <= 0:
+                    continue
+                picks.append((lot, k, take))
+                remaining -= take
+                if not remaining:
+                    break
+            if remaining > 0:
+                return Shortage(mo, seq, item, location, qty,
+                                InsufficientLotQuantity(key, qty,
+                                                        qty - remaining))
+            for lot, k, take in picks:
+                used_lots[k] = used_lots.get(k, _ZERO) + take
+        used_sites[key] = used_sites.get(key, _ZERO) + qty
+        return Allocation(mo, seq, item, location, qty,
+                          [(lot, take) for lot, k, take in picks])
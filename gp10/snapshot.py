@@ -0,0 +1,310 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2009 John Hampton <pacopablo@pacopablo.com>
+# All rights reserved.
+#
+# This software is licensed as described in the file COPYING, which
+# you should have received as part of this distribution.
+#
+# Author: John Hampton <pacopablo@pacopablo.com>
+
+"""
+Read-only, memory-mapped snapshot of the item master and quantities.
+
+`build_snapshot` reads IV00101, IV00102 and IV40700 once and writes them to
+a single file.  Worker processes open it with `Snapshot`, which maps the
+file instead of reading it, so every worker shares the same pages and
+nothing is decoded until a record is asked for.
+
+File layout, all integers little endian:
+
+  * an 8 byte magic, a 4 byte header length and a pickled header holding
+    the section offsets and record layouts;
+  * a string pool: uint32 offsets followed by the UTF-8 bytes of every
+    distinct string;
+  * per table, fixed width records.  Strings are stored as uint32 pool
+    ids, integers as int32, numerics as int64 scaled by 10^5 (see
+    `gp10.types.to_scaled`) and dates as int64 seconds from the GP epoch;
+  * per table, an open addressing hash index of uint32 record numbers on
+    the primary key (ITEMNMBR, (ITEMNMBR, LOCNCODE) and LOCNCODE).
+"""
+
+# Standard library imports
+import mmap
+import os
+import struct
+import zlib
+from collections import namedtuple
+from datetime import datetime, timedelta
+try:
+    import cPickle as pickle
+except ImportError:
+    import pickle
+
+# Third Party imports
+from sqlalchemy.sql import select
+from sqlalchemy.types import Integer, Numeric, DateTime, Boolean
+
+# Local imports
+from gp10 import get_session
+from gp10.inventory import IV_Item_MSTR, IV_Item_MSTR_QTYS, IV_Location_SETP
+from gp10.types import to_scaled, from_scaled
+from gp10.upsert import model_columns
+from gp10.util import gp_epoch_start
+
+__all__ = [
+    'SNAPSHOT_TABLES',
+    'Snapshot',
+    'SnapshotTable',
+    'build_snapshot',
+]
+
+_MAGIC = b'GP10SNP1'
+_EMPTY = 0xFFFFFFFF
+_EPOCH = gp_epoch_start()
+
+# Snapshot table name, model and the attributes of its index key
+SNAPSHOT_TABLES = (
+    ('items', IV_Item_MSTR, ('item',)),
+    ('quantities', IV_Item_MSTR_QTYS, ('item', 'location')),
+    ('locations', IV_Location_SETP, ('location',)),
+)
+
+
+def _code(column):
+    """ Return the struct code used for `column` """
+    if isinstance(column.type, Numeric):
+        return 'n'
+    if isinstance(column.type, DateTime):
+        return 'd'
+    if isinstance(column.type, (Integer, Boolean)):
+        return 'i'
+    return 's'
+
+_FORMATS = {'n': 'q', 'd': 'q', 'i': 'i', 's': 'I'}
+# Stand-ins for NULL; strings store NULL as ''
+_NULLS = {'n': -(2 ** 63), 'd': -(2 ** 63), 'i': -(2 ** 31)}
+
+
+def _key_bytes(values):
+    return b'\x00'.join([(v or u'').encode('utf-8') for v in values])
+
+
+def _slot(key, mask):
+    return zlib.crc32(key) & 0xffffffff & mask
+
+
+class _StringPool(object):
+
+    def __init__(self):
+        self.ids = {}
+        self.strings = []
+
+    def add(self, value):
+        value = value or u''
+        if not isinstance(value, type(u'')):
+            value = value.decode('utf-8')
+        i = self.ids.get(value)
+        if i is None:
+            i = self.ids[value] = len(self.strings)
+            self.strings.append(value)
+        return i
+
+    def data(self):
+        encoded = [v.encode('utf-8') for v in self.strings]
+        offsets = [0]
+        for v in encoded:
+            offsets.append(offsets[-1] + len(v))
+        return struct.pack('<%dI' % len(offsets), *offsets) + b''.join(encoded)
+
+
+def _encode(code, value, pool):
+    if code == 's':
+        return pool.add(value)
+    if value is None:
+        return _NULLS[code]
+    if code == 'n':
+        return to_scaled(value)
+    if code == 'd':
+        if not isinstance(value, datetime):
+            value = datetime(value.year, value.month, value.day)
+        delta = value - _EPOCH
+        return delta.days * 86400 + delta.seconds
+    return int(value)
+
+
+def build_snapshot(path, s=None):
+    """ Write a snapshot of the `SNAPSHOT_TABLES` to `path`
+
+    The file is written next to `path` and renamed into place, so workers
+    never see a partial snapshot and can keep using an older one they
+    already have open.
+    """
+    s = s and s or get_session()
+    pool = _StringPool()
+    header = {'tables': {}}
+    sections = []
+    for name, model, keyattrs in SNAPSHOT_TABLES:
+        columns = model_columns(model)
+        attrs = [a for a, c in columns]
+        codes = ''.join([_code(c) for a, c in columns])
+        fmt = '<' + ''.join([_FORMATS[c] for c in codes])
+        keypos = [attrs.index(k) for k in keyattrs]
+        records = []
+        keys = []
+        q = select([c for a, c in columns])
+        for row in s.execute(q):
+            records.append(struct.pack(fmt, *[_encode(code, v, pool)
+                                              for code, v in zip(codes, row)]))
+            keys.append(_key_bytes([row[p] for p in keypos]))
+        size = 1
+        while size < 2 * len(records):
+            size *= 2
+        slots = [_EMPTY] * size
+        for i, key in enumerate(keys):
+            slot = _slot(key, size - 1)
+            while slots[slot] != _EMPTY:
+                slot = (slot + 1) & (size - 1)
+            slots[slot] = i
+        header['tables'][name] = {'attrs': attrs, 'codes': codes, 'format': fmt,
+                                  'keypos': keypos, 'count': len(records),
+                                  'slots': size}
+        sections.append((name, b''.join(records),
+                         struct.pack('<%dI' % size, *slots)))
+
+    # Offsets are relative to the end of the header, so the header can be
+    # pickled before they are known to the reader.
+    header['strings'] = (0, len(pool.strings))
+    offset = len(pool.data())
+    for name, records, index in sections:
+        header['tables'][name]['records'] = offset
+        offset += len(records)
+        header['tables'][name]['index'] = offset
+        offset += len(index)
+    head = pickle.dumps(header, 2)
+
+    tmp = '%s.%d.tmp' % (path, os.getpid())
+    f = open(tmp, 'wb')
+    try:
+        f.write(_MAGIC)
+        f.write(struct.pack('<I', len(head)))
+        f.write(head)
+        f.write(pool.data())
+        for name, records, index in sections:
+            f.write(records)
+            f.write(index)
+        f.flush()
+        os.fsync(f.fileno())
+    finally:
+        f.close()
+    os.rename(tmp, path)
+    return path
+
+
+class SnapshotTable(object):
+    """ One table of a `Snapshot` """
+
+    def __init__(self, snapshot, name, info, base):
+        self.snapshot = snapshot
+        self.name = name
+        self.attrs = info['attrs']
+        self.codes = info['codes']
+        self.keypos = info['keypos']
+        self.count = info['count']
+        self.record = namedtuple('%s_record' % name, self.attrs)
+        self._struct = struct.Struct(info['format'])
+        self._records = base + info['records']
+        self._index = base + info['index']
+        self._mask = info['slots'] - 1
+
+    def __len__(self):
+        return self.count
+
+    def _decode(self, raw):
+        string = self.snapshot.string
+        values = []
+        for code, v in zip(self.codes, raw):
+            if code == 's':
+                values.append(string(v))
+            elif v == _NULLS[code]:
+                values.append(None)
+            elif code == 'n':
+                values.append(from_scaled(v))
+            elif code == 'd':
+                values.append(_EPOCH + timedelta(seconds=v))
+            else:
+                values.append(v)
+        return self.record(*values)
+
+    def _raw(self, i):
+        return self._struct.unpack_from(self.snapshot.map,
+                                        self._records + i * self._struct.size)
+
+    def __getitem__(self, i):
+        if i < 0:
+            i += self.count
+        if not 0 <= i < self.count:
+            raise IndexError(i)
+        return self._decode(self._raw(i))
+
+    def __iter__(self):
+        for i in range(self.count):
+            yield self._decode(self._raw(i))
+
+    def get(self, *key):
+        """ Return the record with index key `key`, or None """
+        string = self.snapshot.string
+        slot = _slot(_key_bytes(key), self._mask)
+        while True:
+            i = struct.unpack_from('<I', self.snapshot.map,
+                                   self._index + slot * 4)[0]
+            if i == _EMPTY:
+                return None
+            raw = self._raw(i)
+            if tuple([string(raw[p]) for p in self.keypos]) == key:
+                return self._decode(raw)
+            slot = (slot + 1) & self._mask
+
+    def __contains__(self, key):
+        if not isinstance(key, tuple):
+            key = (key,)
+        return self.get(*key) is not None
+
+
+class Snapshot(object):
+    """ A snapshot file mapped read-only into memory
+
+    Tables are available as attributes named after `SNAPSHOT_TABLES`:
+    ``snap.items.get('ITEM')``, ``snap.quantities.get('ITEM', 'SITE')``.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        f = open(path, 'rb')
+        try:
+            self.map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        finally:
+            f.close()
+        if self.map[:len(_MAGIC)] != _MAGIC:
+            self.map.close()
+            raise ValueError('%s is not a gp10 snapshot' % path)
+        pos = len(_MAGIC)
+        headlen = struct.unpack_from('<I', self.map, pos)[0]
+        pos += 4
+        header = pickle.loads(self.map[pos:pos + headlen])
+        base = pos + headlen
+        self._nstrings = header['strings'][1]
+        self._offsets = base
+        self._strings = base + 4 * (self._nstrings + 1)
+        self.tables = {}
+        for name, info in header['tables'].items():
+            table = SnapshotTable(self, name, info, base)
+            self.tables[name] = table
+            setattr(self, name, table)
+
+    def string(self, i):
+        start, end = struct.unpack_from('<II', self.map, self._offsets + 4 * i)
+        return self.map[self._strings + start:self._strings + end].decode('utf-8')
+
+    def close(self):
+        self.map.close()
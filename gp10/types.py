@@ -9,9 +9,11 @@
 # Author: John Hampton <pacopablo@pacopablo.com>
 
 # Standard library imports
+from decimal import Decimal, ROUND_HALF_UP
 
 # Third Party imports
 import sqlalchemy.types as saTypes
+from sqlalchemy.sql import cast, func, literal_column, type_coerce
 
 # Local imports
 from gp10.util import to_ord, from_ord
@@ -19,8 +21,27 @@ from gp10.util import to_ord, from_ord
 __all__ = [
     'StripString',
     'Ordinal',
+    'SCALE',
+    'SCALE_PLACES',
+    'ScaledNumeric',
+    'to_scaled',
+    'from_scaled',
+    'format_scaled',
+    'scaled_mul',
+    'scaled_div',
+    'scaled_extend',
+    'scaled_column',
+    'scaled',
 ]
 
+SCALE_PLACES = 5
+SCALE = 10 ** SCALE_PLACES
+
+try:
+    _integer_types = (int, long)
+except NameError:
+    _integer_types = (int,)
+
 class StripString(saTypes.TypeDecorator):
     impl = saTypes.String
 
@@ -39,3 +60,118 @@ class Ordinal(saTypes.TypeDecorator):
 
     def process_bind_param(self, value, dialect):
         return to_ord(value)
+
+
+def to_scaled(value):
+    """ Convert a Decimal, string or number to an integer scaled by 10^5
+
+    Values with more than five decimal places are rounded half-up.
+    """
+    if isinstance(value, float):
+        value = repr(value)
+    return int(Decimal(value).scaleb(SCALE_PLACES).to_integral_value(ROUND_HALF_UP))
+
+
+def from_scaled(value):
+    """ Convert an integer scaled by 10^5 back to a five place Decimal """
+    return Decimal(value).scaleb(-SCALE_PLACES)
+
+
+def format_scaled(value, places=SCALE_PLACES):
+    """ Format a scaled integer with `places` decimals, rounded half-up """
+    exp = Decimal(1).scaleb(-places)
+    return str(from_scaled(value).quantize(exp, ROUND_HALF_UP))
+
+
+def _div_half_up(num, den):
+    q, r = divmod(abs(num), abs(den))
+    if 2 * r >= abs(den):
+        q += 1
+    if (num < 0) != (den < 0):
+        return -q
+    return q
+
+
+def scaled_mul(a, b):
+    """ Multiply two scaled integers, rounding the result half-up """
+    return _div_half_up(a * b, SCALE)
+
+
+def scaled_div(a, b):
+    """ Divide two scaled integers, rounding the result half-up """
+    return _div_half_up(a * SCALE, b)
+
+
+def scaled_extend(qty, cost):
+    """ Multiply two numpy int64 arrays of scaled values exactly
+
+    Returns a (whole, rem) pair of int64 arrays such that the product at
+    10^10 scale is ``whole * SCALE + rem``.  The cost is split into its
+    whole units and fractional part so that neither partial product can
+    overflow for any realistic quantity and cost.
+    """
+    hi = cost // SCALE
+    lo = cost % SCALE
+    if len(qty):
+        bound = abs(qty.astype('float64')) * abs(hi.astype('float64'))
+        if bound.max() >= 2.0 ** 62:
+            raise OverflowError('extended value exceeds the int64 range')
+    low = qty * lo
+    return qty * hi + low // SCALE, low % SCALE
+
+
+def scaled_column(col):
+    """ Return `col` cast to a BIGINT scaled by 10^5 on the database side
+
+    The product is rounded before the cast, which would otherwise truncate
+    values such as 0.29 that are not exact in binary floating point.
+    Selecting this instead of the Numeric column makes the driver hand back
+    plain integers, which skips Decimal construction entirely.
+    """
+    return cast(func.round(col * literal_column(str(SCALE)), 0),
+                saTypes.BigInteger)
+
+
+class ScaledNumeric(saTypes.TypeDecorator):
+    """ Numeric column represented in Python as an int scaled by 10^5
+
+    Integers bound to the column are taken to be scaled values; Decimals
+    and floats are passed through unchanged.  Results are always scaled
+    integers.  The gp10 models keep their Numeric types; apply this one per
+    query with `scaled`, or use it in a separate mapping of the tables.
+    """
+    impl = saTypes.Numeric
+
+    def process_bind_param(self, value, dialect):
+        if isinstance(value, _integer_types) and not isinstance(value, bool):
+            return from_scaled(value)
+        return value
+
+    def process_result_value(self, value, dialect):
+        if value is None or isinstance(value, _integer_types):
+            return value
+        return to_scaled(value)
+
+    def result_processor(self, dialect, coltype):
+        # Bypass the Numeric result processor: the selected expression is
+        # already a BIGINT, so no Decimal is built on the way out
+        def process(value):
+            return self.process_result_value(value, dialect)
+        return process
+
+    def column_expression(self, col):
+        return scaled_column(col)
+
+    def copy(self):
+        return ScaledNumeric(self.impl.precision, self.impl.scale)
+
+
+def scaled(col):
+    """ Return `col` typed as `ScaledNumeric` for use in one query
+
+    ``select([scaled(c.QTYRECVD)])`` and ``func.sum(scaled(c.QTYRECVD))``
+    come back as ints scaled by 10^5, and in ``scaled(c.QTYRECVD) > 500000``
+    the int is taken as a scaled value.  The column itself, and every other
+    query on it, still use Decimals.
+    """
+    return type_coerce(col, ScaledNumeric(col.type.precision, col.type.scale))
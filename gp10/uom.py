@@ -0,0 +1,176 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2009 John Hampton <pacopablo@pacopablo.com>
+# All rights reserved.
+#
+# This software is licensed as described in the file COPYING, which
+# you should have received as part of this distribution.
+#
+# Author: John Hampton <pacopablo@pacopablo.com>
+
+"""
+Unit of measure conversion cache.
+
+The U of M schedules (IV40201/IV40202) and the item schedule assignments
+(IV00101) are read once into a dense ``schedule x uom`` table of scaled
+integer factors.  Whole arrays of (item, uom, qty) can then be converted to
+base units without a lookup query per line, rounded half-up to the item's
+quantity decimal places.
+"""
+
+# Standard library imports
+from decimal import Decimal, ROUND_HALF_UP
+
+# Third Party imports
+from sqlalchemy.sql import select
+
+# Local imports
+from gp10 import get_session
+from gp10.errors import InvalidUofM
+from gp10.inventory import IV_Item_MSTR, IV_UofM_SETP_HDR, IV_UofM_SETP_DTL
+from gp10.types import SCALE, SCALE_PLACES, to_scaled, scaled_extend
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+__all__ = [
+    'UofMTable',
+]
+
+def _qty_places(decplqty):
+    """ DECPLQTY stores the number of decimal places plus one """
+    return min(max(int(decplqty) - 1, 0), SCALE_PLACES)
+
+
+def _round_half_up(whole, rem, places):
+    """ Round exact (whole, rem) products to `places` decimals
+
+    `whole` and `rem` are as returned by `gp10.types.scaled_extend`;
+    `places` is an array of decimal places per element.  Returns the
+    rounded values scaled by 10^5.  Halves are rounded away from zero, as
+    GP does.
+    """
+    unit = 10 ** (SCALE_PLACES - places)
+    neg = whole < 0
+    carry = neg & (rem > 0)
+    aw = numpy.where(neg, numpy.where(carry, -whole - 1, -whole), whole)
+    ar = numpy.where(carry, SCALE - rem, rem)
+    q = aw // unit
+    r = (aw % unit) * SCALE + ar
+    q = q + (2 * r >= unit * SCALE)
+    return numpy.where(neg, -q, q) * unit
+
+
+class UofMTable(object):
+    """ Dense lookup table of U of M conversion factors """
+
+    def __init__(self, schedules, details, items):
+        """ Build the table from plain data
+
+        `schedules` maps a schedule id to its base U of M, `details` is a
+        sequence of ``(schedule, uom, qtybsuom)`` and `items` maps an item
+        number to ``(schedule, decplqty)``.
+        """
+        self.schedules = dict(schedules)
+        self.items = dict(items)
+        sched_ids = sorted(self.schedules)
+        self._sched_ids = dict([(s, i) for i, s in enumerate(sched_ids)])
+        uoms = set([d[1] for d in details]) | set(self.schedules.values())
+        self._uom_ids = dict([(u, i) for i, u in enumerate(sorted(uoms))])
+        self._factors = {}
+        for schedule, uom, qtybsuom in details:
+            self._factors[(schedule, uom)] = Decimal(qtybsuom)
+        # A schedule's base U of M always converts at 1
+        for schedule, base in self.schedules.items():
+            self._factors.setdefault((schedule, base), Decimal(1))
+        self._dense = None
+
+    @classmethod
+    def load(cls, s=None):
+        """ Read the schedules, their details and the item assignments """
+        s = s and s or get_session()
+        hdr = IV_UofM_SETP_HDR.__table__.c
+        dtl = IV_UofM_SETP_DTL.__table__.c
+        itm = IV_Item_MSTR.__table__.c
+        schedules = s.execute(select([hdr.UOMSCHDL, hdr.BASEUOFM])).fetchall()
+        details = s.execute(select([dtl.UOMSCHDL, dtl.UOFM, dtl.QTYBSUOM])).fetchall()
+        items = [(i, (sc, d)) for i, sc, d in
+                 s.execute(select([itm.ITEMNMBR, itm.UOMSCHDL, itm.DECPLQTY]))]
+        return cls(schedules, details, items)
+
+    def factor(self, item, uom):
+        """ Return the base unit quantity of one `uom` of `item` """
+        try:
+            schedule = self.items[item][0]
+            return self._factors[(schedule, uom)]
+        except KeyError:
+            raise InvalidUofM(item, uom)
+
+    def to_base(self, item, uom, qty):
+        """ Convert a single quantity to base units """
+        places = 0
+        if item in self.items:
+            places = _qty_places(self.items[item][1])
+        exp = Decimal(1).scaleb(-places)
+        return (Decimal(qty) * self.factor(item, uom)).quantize(exp, ROUND_HALF_UP)
+
+    def _build_dense(self):
+        if numpy is None:
+            raise ImportError('UofMTable.convert requires numpy')
+        dense = numpy.full((len(self._sched_ids), len(self._uom_ids)), -1,
+                           dtype=numpy.int64)
+        for (schedule, uom), factor in self._factors.items():
+            if schedule in self._sched_ids and uom in self._uom_ids:
+                dense[self._sched_ids[schedule], self._uom_ids[uom]] = \
+                    to_scaled(factor)
+        item_ids = {}
+        sched = []
+        places = []
+        for i, (item, (schedule, decplqty)) in enumerate(sorted(self.items.items())):
+            item_ids[item] = i
+            sched.append(self._sched_ids.get(schedule, -1))
+            places.append(_qty_places(decplqty))
+        self._dense = (dense, item_ids,
+                       numpy.array(sched, dtype=numpy.int64),
+                       numpy.array(places, dtype=numpy.int64))
+        return self._dense
+
+    def convert(self, items, uoms, qtys, scaled=False):
+        """ Convert parallel sequences of items, U of Ms and quantities
+
+        Returns the base unit quantities, rounded half-up to each item's
+        DECPLQTY.  When `scaled` is True `qtys` is an int64 array scaled by
+        10^5 and the result is returned the same way; otherwise Decimals go
+        in and come out.  Raises `InvalidUofM` for the first line whose item
+        or U of M is unknown.
+        """
+        dense, item_ids, sched, places = self._dense or self._build_dense()
+        n = len(items)
+        if not n:
+            if scaled:
+                return numpy.zeros(0, dtype=numpy.int64)
+            return []
+        if not len(sched) or not dense.size:
+            # Nothing can convert; indexing the empty tables would fail
+            raise InvalidUofM(items[0], uoms[0])
+        idx = numpy.fromiter((item_ids.get(i, -1) for i in items),
+                             dtype=numpy.int64, count=n)
+        uidx = numpy.fromiter((self._uom_ids.get(u, -1) for u in uoms),
+                              dtype=numpy.int64, count=n)
+        sidx = numpy.where(idx >= 0, sched[idx], -1)
+        ok = (sidx >= 0) & (uidx >= 0)
+        factors = numpy.where(ok, dense[sidx, uidx], -1)
+        bad = numpy.flatnonzero(factors < 0)
+        if len(bad):
+            raise InvalidUofM(items[bad[0]], uoms[bad[0]])
+        if scaled:
+            qty = numpy.asarray(qtys, dtype=numpy.int64)
+        else:
+            qty = numpy.array([to_scaled(q) for q in qtys], dtype=numpy.int64)
+        whole, rem = scaled_extend(qty, factors)
+        result = _round_half_up(whole, rem, places[idx])
+        if scaled:
+            return result
+        return [Decimal(int(v)).scaleb(-SCALE_PLACES) for v in result]
@@ -0,0 +1,230 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2009 John Hampton <pacopablo@pacopablo.com>
+# All rights reserved.
+#
+# This software is licensed as described in the file COPYING, which
+# you should have received as part of this distribution.
+#
+# Author: John Hampton <pacopablo@pacopablo.com>
+
+"""
+Diff based bulk upsert for master tables such as IV00101 and IV00102.
+
+The current table is scanned once for its primary keys and a digest of the
+columns being synchronised.  The incoming feed is compared against those
+digests in memory, and only the rows that are new or different are written,
+as chunked executemany inserts and updates.
+"""
+
+# Standard library imports
+import time
+from datetime import datetime, date, time as dtime
+from decimal import Decimal
+try:
+    from hashlib import md5
+except ImportError:
+    from md5 import new as md5
+
+# Third Party imports
+from sqlalchemy.orm import class_mapper
+from sqlalchemy.orm.properties import ColumnProperty
+from sqlalchemy.sql import select, and_, bindparam
+from sqlalchemy.types import Numeric, Date, DateTime
+
+# Local imports
+from gp10 import get_session
+
+__all__ = [
+    'UpsertResult',
+    'model_columns',
+    'bulk_upsert',
+]
+
+# Columns set from another column of the same row when an insert leaves
+# them out, as the model constructors do (IV_Item_MSTR: curcost = stdcost)
+_INSERT_COPIES = {
+    'IV00101': (('CURRCOST', 'STNDCOST'),),
+}
+
+
+class UpsertResult(object):
+    """ Counts and per-phase timings of a `bulk_upsert` run """
+
+    def __init__(self, model):
+        self.model = model
+        self.scanned = 0
+        self.received = 0
+        self.inserted = 0
+        self.updated = 0
+        self.unchanged = 0
+        self.timings = {}
+
+    def _changed(self):
+        return self.inserted + self.updated
+    changed = property(_changed)
+
+    def __repr__(self):
+        return 'UpsertResult(%s, scanned=%d, received=%d, inserted=%d, ' \
+               'updated=%d, unchanged=%d, timings=%r)' % \
+               (self.model.__name__, self.scanned, self.received,
+                self.inserted, self.updated, self.unchanged, self.timings)
+
+
+def model_columns(model):
+    """ Return a list of (attribute, Column) pairs for a mapped class """
+    cols = []
+    for prop in class_mapper(model).iterate_properties:
+        if isinstance(prop, ColumnProperty):
+            cols.append((prop.key, prop.columns[0]))
+    return cols
+
+
+def _normalizer(column):
+    """ Return a function turning a value into its canonical string
+
+    The canonical form must be identical for a value read from the database
+    and the same value supplied by the feed, so numerics are quantized to
+    the column scale, dates and datetimes are converted to the column type
+    and strings are stripped like StripString does.
+    """
+    scale = None
+    if isinstance(column.type, Numeric) and column.type.scale is not None:
+        scale = Decimal(1).scaleb(-column.type.scale)
+    ctype = getattr(column.type, 'impl', column.type)
+    if isinstance(ctype, DateTime):
+        ctype = DateTime
+    elif isinstance(ctype, Date):
+        ctype = Date
+
+    def normalize(value):
+        if value is None:
+            return u'\x00'
+        if scale is not None and not isinstance(value, bool):
+            return str(Decimal(str(value)).quantize(scale))
+        if isinstance(value, (datetime, date)):
+            if ctype is DateTime and not isinstance(value, datetime):
+                value = datetime.combine(value, dtime())
+            elif ctype is Date and isinstance(value, datetime):
+                value = value.date()
+            return value.isoformat()
+        if hasattr(value, 'strip'):
+            return value.strip()
+        return str(value)
+    return normalize
+
+
+def _digest(normalizers, values):
+    h = md5()
+    for normalize, value in zip(normalizers, values):
+        h.update(normalize(value).encode('utf-8'))
+        h.update(b'\x1f')
+    return h.digest()
+
+
+def _chunks(seq, size):
+    for i in range(0, len(seq), size):
+        yield seq[i:i + size]
+
+
+def bulk_upsert(model, rows, s=None, columns=None, chunksize=1000,
+                insert=True, update=True):
+    """ Synchronise `rows` into the table of `model`
+
+    `rows` is an iterable of dicts keyed by model attribute name (e.g.
+    ``item``, ``itemdesc``).  Every row must carry the primary key
+    attributes and the same set of synced attributes.  `columns` restricts
+    the compared and updated attributes; by default every non key attribute
+    present in the first row is used.  Rows missing from the feed are left
+    alone.  Inserted IV00101 rows without a current cost get the standard
+    cost, as `IV_Item_MSTR` does.
+
+    Returns an `UpsertResult`.  The caller owns the transaction.
+    """
+    s = s and s or get_session()
+    result = UpsertResult(model)
+    table = model.__table__
+    allcols = model_columns(model)
+    bycol = dict(allcols)
+    keys = [a for a, c in allcols if c.primary_key]
+
+    t0 = time.time()
+    rows = list(rows)
+    result.received = len(rows)
+    if not rows:
+        return result
+    if columns is None:
+        columns = [a for a, c in allcols
+                   if not c.primary_key and a in rows[0]]
+    else:
+        columns = [a for a in columns if a not in keys]
+    keycols = [bycol[a] for a in keys]
+    datacols = [bycol[a] for a in columns]
+    normalizers = [_normalizer(c) for c in datacols]
+    keynorm = [_normalizer(c) for c in keycols]
+
+    def rowkey(values):
+        return tuple([n(v) for n, v in zip(keynorm, values)])
+
+    # Phase 1: one scan of the keys and the digest of the synced columns
+    current = {}
+    for row in s.execute(select(keycols + datacols)):
+        current[rowkey(row[:len(keys)])] = _digest(normalizers,
+                                                   row[len(keys):])
+    result.scanned = len(current)
+    t1 = time.time()
+    result.timings['scan'] = t1 - t0
+
+    # Phase 2: diff the feed in memory
+    inserts = []
+    updates = []
+    for row in rows:
+        key = rowkey([row[a] for a in keys])
+        digest = _digest(normalizers, [row[a] for a in columns])
+        existing = current.get(key)
+        if existing is None:
+            if insert:
+                inserts.append(row)
+                current[key] = digest
+        elif existing != digest:
+            if update:
+                updates.append(row)
+                current[key] = digest
+        else:
+            result.unchanged += 1
+    t2 = time.time()
+    result.timings['diff'] = t2 - t1
+
+    # Phase 3: batched writes
+    if inserts:
+        params = [dict([(bycol[a].name, v) for a, v in row.items()
+                        if a in bycol])
+                  for row in inserts]
+        for p in params:
+            for target, source in _INSERT_COPIES.get(table.name, ()):
+                if p.get(target) is None and source in p:
+                    p[target] = p[source]
+        # executemany needs a uniform parameter set per statement
+        groups = {}
+        for p in params:
+            groups.setdefault(tuple(sorted(p)), []).append(p)
+        for group in groups.values():
+            for chunk in _chunks(group, chunksize):
+                s.execute(table.insert(), chunk)
+        result.inserted = len(inserts)
+    if updates:
+        stmt = table.update().where(and_(*[c == bindparam('k_' + c.name)
+                                           for c in keycols])) \
+                    .values(dict([(c.name, bindparam('v_' + c.name))
+                                  for c in datacols]))
+        params = []
+        for row in updates:
+            p = dict([('k_' + c.name, row[a]) for a, c in zip(keys, keycols)])
+            p.update([('v_' + c.name, row[a])
+                      for a, c in zip(columns, datacols)])
+            params.append(p)
+        for chunk in _chunks(params, chunksize):
+            s.execute(stmt, chunk)
+        result.updated = len(updates)
+    result.timings['write'] = time.time() - t2
+    return result
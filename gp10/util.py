@@ -30,6 +30,7 @@ __all__ = [
     'gp_cur_time',
     'gp_epoch_start',
     'get_next_note_index',
+    'get_next_note_indexes',
 ]
 
 def to_ord(num, base=16384):
@@ -86,3 +87,49 @@ def get_next_note_index(s=None):
     s.commit()
     return r[0][0]
 
+def get_next_note_indexes(count, s=None):
+    """ Reserve `count` note indexes and return them as a list
+
+    Calls the `smGetNextNoteIndex` stored procedure `count` times in a
+    single batch, so the indexes cost one round trip rather than one per
+    index.  They are not necessarily consecutive.
+
+    The indexes are reserved and committed on a connection of their own,
+    taken from the engine `s` is bound to, so the company master row is
+    locked only for the reservation and not for the caller's transaction.
+    The session itself is neither used nor committed.
+    """
+    if count <= 0:
+        return []
+    txt = """
+        SET NOCOUNT ON;
+        DECLARE @db AS CHAR(5), @id AS SMALLINT, @noteidx AS NUMERIC(19,5),
+                @err AS INT, @i AS INT;
+        DECLARE @notes TABLE (SEQ INT IDENTITY(1,1), NOTEINDX NUMERIC(19,5));
+        SELECT @db=CMPANYID
+          FROM DYNAMICS.[dbo].[SY01500]
+         WHERE INTERID = DB_Name();
+        SELECT @id=@@SPID, @i=0;
+        WHILE @i < :count
+        BEGIN
+            EXEC DYNAMICS.[dbo].[smGetNextNoteIndex] @db, @id,
+                                                     @noteidx OUTPUT,
+                                                     @err OUTPUT;
+            INSERT INTO @notes (NOTEINDX) VALUES (@noteidx);
+            SET @i = @i + 1;
+        END;
+        SELECT NOTEINDX FROM @notes ORDER BY SEQ;
+        SET NOCOUNT OFF;"""[1:]
+    s = s and s or get_session()
+    conn = s.get_bind().engine.connect()
+    try:
+        trans = conn.begin()
+        try:
+            r = conn.execute(text(txt), {'count': count}).fetchall()
+            trans.commit()
+        except Exception:
+            trans.rollback()
+            raise
+    finally:
+        conn.close()
+    return [row[0] for row in r]
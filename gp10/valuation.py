@@ -0,0 +1,251 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2009 John Hampton <pacopablo@pacopablo.com>
+# All rights reserved.
+#
+# This software is licensed as described in the file COPYING, which
+# you should have received as part of this distribution.
+#
+# Author: John Hampton <pacopablo@pacopablo.com>
+
+"""
+Vectorized inventory valuation over the IV00300 lot layers.
+
+Every Numeric(19,5) column is loaded as an int64 scaled by 10^5 so that
+the arithmetic stays exact.  Extended values (qty * cost) carry 10 decimal
+places and are accumulated as a (whole, remainder) pair so the int64 range
+is never exceeded by the intermediate product.
+"""
+
+# Standard library imports
+from decimal import Decimal
+
+# Third Party imports
+from sqlalchemy.sql import select, and_
+
+# Local imports
+from gp10 import get_session
+from gp10.inventory import IV_Item_MSTR, IV_Lot_MSTR
+from gp10.types import SCALE, SCALE_PLACES, to_scaled, scaled_column
+from gp10.types import scaled_extend
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+__all__ = [
+    'DIMENSIONS',
+    'ValuationRow',
+    'InventoryValuation',
+]
+
+DIMENSIONS = (
+    'item',
+    'location',
+    'itemclass',
+    'usercategory1',
+    'usercategory2',
+    'usercategory3',
+    'usercategory4',
+    'usercategory5',
+    'usercategory6',
+)
+
+_AMOUNTS = ('qtyreceived', 'qtyallocated', 'qtysold', 'cost', 'stdcost', 'curcost')
+
+
+def _require_numpy():
+    if numpy is None:
+        raise ImportError('gp10.valuation requires numpy')
+
+
+def _extended_decimal(whole, rem):
+    """ Turn a summed (whole, rem) pair back into an exact Decimal """
+    return Decimal(int(whole) * SCALE + int(rem)).scaleb(-2 * SCALE_PLACES)
+
+
+class ValuationRow(object):
+    """ Valuation totals for a single rollup key """
+    __slots__ = ('key', 'lots', 'qty', 'value', 'std_value', 'cur_value')
+
+    def __init__(self, key, lots, qty, value, std_value, cur_value):
+        self.key = key
+        self.lots = lots
+        self.qty = qty
+        self.value = value
+        self.std_value = std_value
+        self.cur_value = cur_value
+
+    def _std_variance(self):
+        return self.value - self.std_value
+    std_variance = property(_std_variance)
+
+    def _cur_variance(self):
+        return self.value - self.cur_value
+    cur_variance = property(_cur_variance)
+
+    def __repr__(self):
+        return 'ValuationRow(%r, qty=%s, value=%s, std_value=%s, ' \
+               'cur_value=%s)' % (self.key, self.qty, self.value,
+                                  self.std_value, self.cur_value)
+
+
+class InventoryValuation(object):
+    """ Columnar snapshot of the lot layers joined to the item master
+
+    Each lot is a FIFO layer valued at its own `UNITCOST`.  The same
+    available quantity is also valued at the item's `STNDCOST` and
+    `CURRCOST` so variances fall out of a single pass.
+    """
+
+    def __init__(self, columns):
+        _require_numpy()
+        self.columns = columns
+        received = columns['qtyreceived']
+        allocated = columns['qtyallocated']
+        self.available = received - numpy.where(allocated >= 0, allocated, 0) \
+                         - columns['qtysold']
+        self._layer = scaled_extend(self.available, columns['cost'])
+        self._std = scaled_extend(self.available, columns['stdcost'])
+        self._cur = scaled_extend(self.available, columns['curcost'])
+
+    def __len__(self):
+        return len(self.available)
+
+    @classmethod
+    def load(cls, s=None, qtytype=1, items=None, chunksize=50000):
+        """ Bulk load the lot layers and build a valuation
+
+        Quantities and costs are scaled on the database side so the driver
+        hands back integers instead of Decimal objects.  Only lots with the
+        given `QTYTYPE` are loaded; pass None to load every quantity type.
+        """
+        _require_numpy()
+        s = s and s or get_session()
+        lot = IV_Lot_MSTR.__table__.c
+        itm = IV_Item_MSTR.__table__.c
+        cols = [
+            lot.ITEMNMBR, lot.LOCNCODE, itm.ITMCLSCD,
+            itm.USCATVLS_1, itm.USCATVLS_2, itm.USCATVLS_3,
+            itm.USCATVLS_4, itm.USCATVLS_5, itm.USCATVLS_6,
+            scaled_column(lot.QTYRECVD), scaled_column(lot.ATYALLOC),
+            scaled_column(lot.QTYSOLD), scaled_column(lot.UNITCOST),
+            scaled_column(itm.STNDCOST), scaled_column(itm.CURRCOST),
+        ]
+        crit = [lot.ITEMNMBR == itm.ITEMNMBR]
+        if qtytype is not None:
+            crit.append(lot.QTYTYPE == qtytype)
+        if items is not None:
+            crit.append(lot.ITEMNMBR.in_(list(items)))
+        q = select(cols, and_(*crit))
+        result = s.execute(q)
+        return cls.from_rows(_iter_chunks(result, chunksize), scaled=True)
+
+    @classmethod
+    def from_rows(cls, rows, scaled=False):
+        """ Build a valuation from (dimensions..., amounts...) tuples
+
+        Rows are laid out as `DIMENSIONS` followed by `_AMOUNTS`.  When
+        `scaled` is False the amounts are Decimals and are converted here.
+        """
+        _require_numpy()
+        names = DIMENSIONS + _AMOUNTS
+        buffers = [[] for n in names]
+        for row in rows:
+            for buf, value in zip(buffers, row):
+                buf.append(value)
+        columns = {}
+        ndims = len(DIMENSIONS)
+        for i, name in enumerate(names):
+            buf = buffers[i]
+            if i < ndims:
+                columns[name] = numpy.array([(v or '').strip() for v in buf],
+                                            dtype=object)
+            else:
+                if not scaled:
+                    buf = [to_scaled(v) for v in buf]
+                columns[name] = numpy.array(buf, dtype=numpy.int64)
+        return cls(columns)
+
+    def _group(self, keys):
+        """ Return (labels, order, starts) for grouping on `keys` """
+        uniques = []
+        inverses = []
+        for key in keys:
+            if key not in DIMENSIONS:
+                raise ValueError('Unknown valuation dimension: %s' % key)
+            labels, inverse = numpy.unique(self.columns[key],
+                                           return_inverse=True)
+            uniques.append(labels)
+            inverses.append(inverse.ravel())
+        # Group on the rows of per-dimension codes rather than one combined
+        # integer, which could overflow int64 with several wide dimensions
+        stacked = numpy.column_stack(inverses).astype(numpy.int64)
+        groups, codes = numpy.unique(stacked, axis=0, return_inverse=True)
+        codes = codes.ravel()
+        order = numpy.argsort(codes, kind='mergesort')
+        codes = codes[order]
+        if len(codes):
+            starts = numpy.concatenate(([0], numpy.flatnonzero(numpy.diff(codes)) + 1))
+        else:
+            starts = numpy.array([], dtype=numpy.int64)
+        labels = []
+        for code in codes[starts]:
+            parts = [u[idx] for u, idx in zip(uniques, groups[code])]
+            if len(parts) == 1:
+                labels.append(parts[0])
+            else:
+                labels.append(tuple(parts))
+        return labels, order, starts
+
+    def _sum(self, array, order, starts):
+        if not len(starts):
+            return array[:0]
+        return numpy.add.reduceat(array[order], starts)
+
+    def _extended_sum(self, pair, order, starts):
+        whole, rem = pair
+        return self._sum(whole, order, starts), self._sum(rem, order, starts)
+
+    def rollup(self, *keys):
+        """ Return a list of `ValuationRow` objects grouped by `keys`
+
+        `keys` are names from `DIMENSIONS`, e.g. ``rollup('item',
+        'location')`` or ``rollup('itemclass')``.  Rows come back ordered by
+        key.
+        """
+        if not keys:
+            keys = ('item',)
+        labels, order, starts = self._group(keys)
+        counts = numpy.diff(numpy.append(starts, len(self)))
+        qty = self._sum(self.available, order, starts)
+        value = self._extended_sum(self._layer, order, starts)
+        std = self._extended_sum(self._std, order, starts)
+        cur = self._extended_sum(self._cur, order, starts)
+        rows = []
+        for i, label in enumerate(labels):
+            rows.append(ValuationRow(label, int(counts[i]),
+                                     Decimal(int(qty[i])).scaleb(-SCALE_PLACES),
+                                     _extended_decimal(value[0][i], value[1][i]),
+                                     _extended_decimal(std[0][i], std[1][i]),
+                                     _extended_decimal(cur[0][i], cur[1][i])))
+        return rows
+
+    def total(self):
+        """ Return a single `ValuationRow` covering every loaded lot """
+        def _total(pair):
+            return _extended_decimal(pair[0].sum(), pair[1].sum())
+        return ValuationRow(None, len(self),
+                            Decimal(int(self.available.sum())).scaleb(-SCALE_PLACES),
+                            _total(self._layer), _total(self._std),
+                            _total(self._cur))
+
+
+def _iter_chunks(result, chunksize):
+    while True:
+        rows = result.fetchmany(chunksize)
+        if not rows:
+            break
+        for row in rows:
+            yield row
@@ -0,0 +1,225 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2009 John Hampton <pacopablo@pacopablo.com>
+# All rights reserved.
+#
+# This software is licensed as described in the file COPYING, which
+# you should have received as part of this distribution.
+#
+# Author: John Hampton <pacopablo@pacopablo.com>
+
+"""
+FIFO consumption of the manufacture order WIP stack (MOP1000).
+
+A `WIPStack` is loaded with a single query per MO, consumed in memory and
+written back with one executemany update covering only the layers that
+changed.  `close_orders` runs many MOs on a pool of threads, each MO in
+its own short transaction, so that no two workers ever hold locks on the
+same stack.
+"""
+
+# Standard library imports
+from decimal import Decimal
+
+# Third Party imports
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.sql import select, and_, bindparam
+
+# Local imports
+from gp10 import Base, UnboundMetadataError
+from gp10.chunked import run_in_transaction, run_workers
+from gp10.errors import InsufficientLotQuantity
+from gp10.manufacturing import MOP_WIP_Stack, MOP_Lot_Issue
+
+__all__ = [
+    'WIPLayer',
+    'WIPStack',
+    'close_orders',
+]
+
+_ZERO = Decimal(0)
+
+_LAYER_COLUMNS = ('MANUFACTUREORDER_I', 'ITEMNMBR', 'TO_SITE_I', 'DATERECD',
+                  'WIPSEQNMBR', 'QTYRECVD', 'QTYSOLD', 'ITEM_COSTS_ARRAY_I_1')
+
+
+class WIPLayer(object):
+    """ A single MOP1000 layer held in memory """
+    __slots__ = ('mo', 'item', 'tosite', 'recvdate', 'wipseq', 'qtyreceived',
+                 'qtysold', 'cost', 'consumed', 'issues')
+
+    def __init__(self, mo, item, tosite, recvdate, wipseq, qtyreceived,
+                 qtysold, cost):
+        self.mo = mo
+        self.item = item
+        self.tosite = tosite
+        self.recvdate = recvdate
+        self.wipseq = wipseq
+        self.qtyreceived = qtyreceived
+        self.qtysold = qtysold
+        self.cost = cost
+        self.consumed = _ZERO
+        self.issues = []
+
+    def _available(self):
+        return self.qtyreceived - self.qtysold
+    available = property(_available)
+
+    def __repr__(self):
+        return 'WIPLayer(%s, %s, %s, %s, available=%s)' % \
+               (self.mo, self.item, self.recvdate, self.wipseq, self.available)
+
+
+class WIPStack(object):
+    """ The WIP layers of one manufacture order, in FIFO order """
+
+    def __init__(self, mo, layers):
+        self.mo = mo
+        self.layers = layers
+
+    @classmethod
+    def load(cls, s, mo, issues=False):
+        """ Load the whole stack for `mo` in one query
+
+        The rows are read with an update lock, in primary key order, so a
+        concurrent close of the same MO waits instead of deadlocking.  When
+        `issues` is True the WO010302 lot issues are attached to the layer
+        they were issued against.
+        """
+        c = MOP_WIP_Stack.__table__.c
+        q = select([c[n] for n in _LAYER_COLUMNS], c.MANUFACTUREORDER_I == mo,
+                   order_by=[c.ITEMNMBR, c.TO_SITE_I, c.DATERECD, c.WIPSEQNMBR],
+                   for_update=True)
+        layers = [WIPLayer(*row) for row in s.execute(q)]
+        stack = cls(mo, layers)
+        if issues and layers:
+            # WIP sequence numbers are only unique within an item
+            bywip = dict([((l.item, l.wipseq), l) for l in layers])
+            ic = MOP_Lot_Issue.__table__.c
+            for row in s.execute(select([ic.ITEMNMBR, ic.WIPSEQNMBR,
+                                         ic.LOTNUMBR, ic.SERLTQTY],
+                                        ic.MANUFACTUREORDER_I == mo)):
+                layer = bywip.get((row[0], row[1]))
+                if layer is not None:
+                    layer.issues.append((row[2], row[3]))
+        return stack
+
+    def available(self, item, tosite=None):
+        return sum([l.available for l in self._layers_for(item, tosite)], _ZERO)
+
+    def _layers_for(self, item, tosite=None):
+        return [l for l in self.layers if l.item == item and
+                (tosite is None or l.tosite == tosite)]
+
+    def consume(self, item, qty, tosite=None):
+        """ Consume `qty` of `item` from the oldest layers first
+
+        Returns a list of ``(layer, qty, cost)`` tuples describing the cost
+        flow.  Raises `InsufficientLotQuantity` without touching any layer
+        if the stack cannot cover the request.
+        """
+        qty = Decimal(qty)
+        layers = self._layers_for(item, tosite)
+        available = sum([l.available for l in layers], _ZERO)
+        if qty > available:
+            raise InsufficientLotQuantity(self.mo, qty, available)
+        flow = []
+        remaining = qty
+        for layer in layers:
+            if remaining <= 0:
+                break
+            take = min(layer.available, remaining)
+            if take <= 0:
+                continue
+            layer.qtysold += take
+            layer.consumed += take
+            remaining -= take
+            flow.append((layer, take, take * layer.cost))
+        return flow
+
+    def consume_all(self, requests):
+        """ Consume a mapping or sequence of ``(item, qty)`` requests
+
+        Returns the combined cost flow.  Either every request is applied or,
+        on `InsufficientLotQuantity`, none of them are.
+        """
+        if hasattr(requests, 'items'):
+            requests = requests.items()
+        saved = [(l, l.qtysold, l.consumed) for l in self.layers]
+        flow = []
+        try:
+            for item, qty in requests:
+                flow.extend(self.consume(item, qty))
+        except InsufficientLotQuantity:
+            for layer, qtysold, consumed in saved:
+                layer.qtysold = qtysold
+                layer.consumed = consumed
+            raise
+        return flow
+
+    def changed(self):
+        return [l for l in self.layers if l.consumed]
+
+    def save(self, s):
+        """ Write every changed layer back with one batched update
+
+        QTYSOLD is set to the layer's new total and WIPQTYSOLD is raised by
+        what was consumed since the last save.  Returns the number of
+        layers written.
+        """
+        changed = self.changed()
+        if not changed:
+            return 0
+        tbl = MOP_WIP_Stack.__table__
+        c = tbl.c
+        stmt = tbl.update().where(and_(
+                    c.MANUFACTUREORDER_I == bindparam('b_mo'),
+                    c.ITEMNMBR == bindparam('b_item'),
+                    c.TO_SITE_I == bindparam('b_tosite'),
+                    c.DATERECD == bindparam('b_recvdate'),
+                    c.WIPSEQNMBR == bindparam('b_wipseq'))) \
+                .values(QTYSOLD=bindparam('b_qtysold'),
+                        WIPQTYSOLD=c.WIPQTYSOLD +
+                                   bindparam('b_consumed', type_=c.QTYSOLD.type))
+        s.execute(stmt, [{'b_mo': l.mo, 'b_item': l.item, 'b_tosite': l.tosite,
+                          'b_recvdate': l.recvdate, 'b_wipseq': l.wipseq,
+                          'b_qtysold': l.qtysold, 'b_consumed': l.consumed}
+                         for l in changed])
+        for layer in changed:
+            layer.consumed = _ZERO
+        return len(changed)
+
+
+def _close_one(s, mo, requests, issues):
+    stack = WIPStack.load(s, mo, issues=issues)
+    flow = stack.consume_all(requests)
+    stack.save(s)
+    return flow
+
+
+def close_orders(orders, sm=None, workers=4, retries=3, issues=False):
+    """ Consume the WIP stacks of many MOs in parallel
+
+    `orders` maps a manufacture order number to its consumption requests
+    (anything `WIPStack.consume_all` accepts).  Each MO is handled in its
+    own session and transaction by one of `workers` threads; MOs are
+    dispatched in sorted order so that locks are always taken in the same
+    order.  Deadlock victims are retried up to `retries` times.
+
+    Returns a pair of dicts: ``(flows, errors)`` keyed by MO.
+    """
+    if sm is None:
+        if not Base.metadata.bind:
+            raise UnboundMetadataError
+        sm = sessionmaker(bind=Base.metadata.bind)
+    if hasattr(orders, 'items'):
+        orders = orders.items()
+
+    def close(order):
+        mo, requests = order
+        return run_in_transaction(sm,
+                lambda s: _close_one(s, mo, requests, issues),
+                retries=retries)
+
+    return run_workers(sorted(orders), close, key=lambda order: order[0],
+                       workers=workers)
@@ -20,6 +20,9 @@ setup(
     url='http://pacopablo.github.com/gp10/',
     license='MIT',
     zip_safe=False,
-    install_requires = ['SQLAlchemy>=0.5.0rc2'],
+    install_requires = ['SQLAlchemy>=0.9'],
+    extras_require = {
+        'numpy': ['numpy'],
+    },
 )
 
@@ -0,0 +1,82 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2009 John Hampton <pacopablo@pacopablo.com>
+# All rights reserved.
+#
+# This software is licensed as described in the file COPYING, which
+# you should have received as part of this distribution.
+#
+# Author: John Hampton <pacopablo@pacopablo.com>
+
+"""
+Helpers shared by the tests: SQLite databases holding a few gp10 tables
+and rows filled out with placeholder values.
+"""
+
+# Standard library imports
+import warnings
+from datetime import datetime
+from decimal import Decimal
+
+# Third Party imports
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.types import String, DateTime, Boolean, Numeric
+
+# Local imports
+from gp10 import Base
+# Imported for the foreign keys the other modules' tables point at
+import gp10.inventory
+import gp10.manufacturing
+
+__all__ = [
+    'engine',
+    'session',
+    'fill',
+    'insert',
+]
+
+# SQLite has no native Decimal; the rounding it warns about is expected
+warnings.filterwarnings('ignore', r'.*Dialect sqlite\+pysqlite does \*not\* '
+                        r'support Decimal objects natively.*')
+
+
+def engine(tables, url='sqlite://'):
+    """ Return an engine on `url` with the gp10 `tables` (names) created """
+    e = create_engine(url)
+    Base.metadata.create_all(e, tables=[Base.metadata.tables[t]
+                                        for t in tables])
+    return e
+
+
+def session(tables, url='sqlite://'):
+    return sessionmaker(bind=engine(tables, url))()
+
+
+def fill(table, **values):
+    """ Return a row for `table` with `values` and a placeholder in every
+    other column
+    """
+    row = {}
+    for col in table.columns:
+        if col.name in values:
+            row[col.name] = values[col.name]
+            continue
+        ctype = getattr(col.type, 'impl', col.type)
+        if isinstance(ctype, String):
+            row[col.name] = ''
+        elif isinstance(ctype, DateTime):
+            row[col.name] = datetime(1900, 1, 1)
+        elif isinstance(ctype, Boolean):
+            row[col.name] = False
+        elif isinstance(ctype, Numeric):
+            row[col.name] = Decimal(0)
+        else:
+            row[col.name] = 0
+    return row
+
+
+def insert(bind, model, *rows):
+    """ Insert `rows`, dicts of column name to value, into `model` """
+    table = getattr(model, '__table__', model)
+    bind.execute(table.insert(), [fill(table, **r) for r in rows])
@@ -0,0 +1,93 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2009 John Hampton <pacopablo@pacopablo.com>
+# All rights reserved.
+#
+# This software is licensed as described in the file COPYING, which
+# you should have received as part of this distribution.
+#
+# Author: John Hampton <pacopablo@pacopablo.com>
+
+# Standard library imports
+import shutil
+import tempfile
+import unittest
+from datetime import datetime
+
+# Third Party imports
+from sqlalchemy.sql import select
+
+# Local imports
+from gp10.archive import ArchiveStore
+from gp10.inventory import IV_TRX_HIST_LINE
+from tests.fixtures import insert, session
+
+_OLD = datetime(2005, 6, 1)
+_NEW = datetime(2009, 6, 1)
+_CUTOFF = datetime(2008, 1, 1)
+
+_HIST = IV_TRX_HIST_LINE.__table__
+
+
+class ArchiveStoreTest(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.store = ArchiveStore(self.dir)
+        self.s = session(('IV30300',))
+        rows = []
+        for i in range(10):
+            rows.append({'DOCTYPE': 1, 'DOCNUMBR': 'DOC%02d' % i,
+                         'LNSEQNBR': 16384, 'DOCDATE': _OLD,
+                         'ITEMNMBR': 'ITEM%d' % i})
+        # Keys the database orders differently from the archive's case
+        # insensitive form
+        rows.append({'DOCTYPE': 1, 'DOCNUMBR': 'doc00a', 'LNSEQNBR': 16384,
+                     'DOCDATE': _OLD, 'ITEMNMBR': 'LOWER'})
+        rows.append({'DOCTYPE': 1, 'DOCNUMBR': 'NEW', 'LNSEQNBR': 16384,
+                     'DOCDATE': _NEW, 'ITEMNMBR': 'NEW'})
+        insert(self.s.get_bind(), IV_TRX_HIST_LINE, *rows)
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def _archive(self):
+        return self.store.archive(self.s, IV_TRX_HIST_LINE,
+                                  _HIST.c.DOCDATE < _CUTOFF, batch=4,
+                                  blocksize=2)
+
+    def test_one_segment_per_chunk(self):
+        result = self._archive()
+        self.assertEqual((result.archived, result.deleted), (11, 11))
+        self.assertEqual(len(result.segments), 3)
+        segments = self.store.segments(IV_TRX_HIST_LINE)
+        self.assertEqual([len(seg) for seg in segments], [4, 4, 3])
+        left = [r[0] for r in self.s.execute(select([_HIST.c.DOCNUMBR]))]
+        self.assertEqual(left, ['NEW'])
+
+    def test_segments_are_sorted_on_the_folded_key(self):
+        self._archive()
+        for seg in self.store.segments(IV_TRX_HIST_LINE):
+            pos = seg.columns.index('DOCNUMBR')
+            keys = [r[pos].lower() for r in seg.scan()]
+            self.assertEqual(keys, sorted(keys))
+            self.assertTrue(seg.first_key <= seg.last_key)
+
+    def test_lookup_finds_rows_in_any_segment(self):
+        self._archive()
+        for docnum in ('DOC00', 'DOC05', 'DOC09', 'doc00a'):
+            obj = self.store.lookup(self.s, IV_TRX_HIST_LINE,
+                                    (1, docnum, 16384))
+            self.assertEqual(obj.docnum, docnum)
+        # Compared like the database collation: blanks and case ignored
+        self.assertEqual(self.store.get(IV_TRX_HIST_LINE,
+                                        (1, 'Doc00A ', 16384))['item'],
+                         'LOWER')
+        self.assertEqual(self.store.lookup(self.s, IV_TRX_HIST_LINE,
+                                           (1, 'NEW', 16384)).item, 'NEW')
+        self.assertEqual(self.store.get(IV_TRX_HIST_LINE, (1, 'X', 1)),
+                         None)
+
+
+if __name__ == '__main__':
+    unittest.main()
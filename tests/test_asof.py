@@ -0,0 +1,103 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2009 John Hampton <pacopablo@pacopablo.com>
+# All rights reserved.
+#
+# This software is licensed as described in the file COPYING, which
+# you should have received as part of this distribution.
+#
+# Author: John Hampton <pacopablo@pacopablo.com>
+
+# Standard library imports
+import os
+import shutil
+import tempfile
+import unittest
+from datetime import datetime
+from decimal import Decimal
+
+# Local imports
+from gp10.asof import CheckpointStore, build_checkpoints, as_of
+from gp10.inventory import IV_TRX_HIST_LINE, IV_TRX_HIST_Serial_Lot
+from tests.fixtures import insert, session
+
+_D = Decimal
+
+
+def _line(docnum, day, qty, extcost, location='MAIN', to_location='',
+          qtybsuom=1):
+    return {'TRXSORCE': 'IVTRX1', 'DOCNUMBR': docnum, 'LNSEQNBR': 16384,
+            'DOCDATE': day, 'ITEMNMBR': 'A', 'TRXQTY': _D(qty),
+            'EXTDCOST': _D(extcost), 'TRXLOCTN': location,
+            'TRNSTLOC': to_location, 'QTYBSUOM': _D(qtybsuom)}
+
+
+def _lot(docnum, qty):
+    return {'TRXSORCE': 'IVTRX1', 'DOCNUMBR': docnum, 'LNSEQNBR': 16384,
+            'SLTSQNUM': 1, 'ITEMNMBR': 'A', 'SERLTNUM': 'L1',
+            'SERLTQTY': _D(qty)}
+
+
+class AsOfTest(unittest.TestCase):
+
+    def setUp(self):
+        self.s = session(('IV30300', 'IV30400'))
+        bind = self.s.get_bind()
+        insert(bind, IV_TRX_HIST_LINE,
+               _line('D1', datetime(2009, 1, 10), 10, 25),
+               # Issues may carry a positive extended cost
+               _line('D2', datetime(2009, 2, 5), -4, 10),
+               _line('D3', datetime(2009, 2, 20), 3, '7.5',
+                     to_location='WEST'),
+               _line('D4', datetime(2009, 3, 15), 2, 24, qtybsuom=12))
+        insert(bind, IV_TRX_HIST_Serial_Lot,
+               _lot('D1', 10), _lot('D2', 4), _lot('D3', 3))
+        self.dir = tempfile.mkdtemp()
+        self.store = CheckpointStore(os.path.join(self.dir, 'ckpt'))
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def _on_hand(self, store, location, day):
+        oh = as_of(store, 'A', location, day, self.s)
+        return oh.qty, oh.value, oh.lots
+
+    def test_checkpoints_are_monthly(self):
+        written = build_checkpoints(self.store, self.s,
+                                    until=datetime(2009, 3, 10))
+        self.assertEqual([cp.date for cp in written],
+                         [datetime(2009, 2, 1), datetime(2009, 3, 1)])
+        self.assertEqual(written[-1].records('A'),
+                         [('A', 'MAIN', None, _D(3), _D('7.5')),
+                          ('A', 'MAIN', 'L1', _D(3), None),
+                          ('A', 'WEST', None, _D(3), _D('7.5')),
+                          ('A', 'WEST', 'L1', _D(3), None)])
+        self.assertEqual(written[-1].records('B'), [])
+        # A later run carries on from the last checkpoint
+        written = build_checkpoints(self.store, self.s,
+                                    until=datetime(2009, 4, 1))
+        self.assertEqual([cp.date for cp in written], [datetime(2009, 4, 1)])
+        self.assertEqual(len(self.store.checkpoints()), 3)
+
+    def test_as_of_matches_a_full_replay(self):
+        build_checkpoints(self.store, self.s, until=datetime(2009, 4, 1))
+        empty = CheckpointStore(os.path.join(self.dir, 'empty'))
+        for location, day, expected in (
+                ('MAIN', datetime(2009, 1, 9), (_D(0), _D(0), {})),
+                ('MAIN', datetime(2009, 1, 31), (_D(10), _D(25),
+                                                 {'L1': _D(10)})),
+                ('MAIN', datetime(2009, 2, 5), (_D(6), _D(15),
+                                                {'L1': _D(6)})),
+                ('WEST', datetime(2009, 2, 28), (_D(3), _D('7.5'),
+                                                 {'L1': _D(3)})),
+                ('MAIN', datetime(2009, 3, 31), (_D(27), _D('31.5'),
+                                                 {'L1': _D(3)})),
+                ('MAIN', datetime(2009, 6, 1), (_D(27), _D('31.5'),
+                                                {'L1': _D(3)}))):
+            self.assertEqual(self._on_hand(self.store, location, day),
+                             expected)
+            self.assertEqual(self._on_hand(empty, location, day), expected)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,74 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2009 John Hampton <pacopablo@pacopablo.com>
+# All rights reserved.
+#
+# This software is licensed as described in the file COPYING, which
+# you should have received as part of this distribution.
+#
+# Author: John Hampton <pacopablo@pacopablo.com>
+
+# Standard library imports
+import unittest
+from decimal import Decimal
+
+# Third Party imports
+from sqlalchemy.sql import select
+
+# Local imports
+from gp10.batch import BatchWriter
+from gp10.inventory import IV_UofM_SETP_HDR, IV_UofM_SETP_DTL
+from tests.fixtures import session
+
+
+class BatchWriterTest(unittest.TestCase):
+
+    def setUp(self):
+        self.s = session(('IV40201', 'IV40202'))
+        self.reserved = []
+
+    def _notes(self, count, s):
+        start = len(self.reserved) + 1
+        notes = [Decimal(n) for n in range(start, start + count)]
+        self.reserved.extend(notes)
+        return notes
+
+    def _schedule(self, name, **kwargs):
+        return IV_UofM_SETP_HDR(name, name + ' schedule', 'EACH', **kwargs)
+
+    def _detail(self, name, seq):
+        return IV_UofM_SETP_DTL(schedule=name, seq=seq, uom='BOX%d' % seq,
+                                equivuom='EACH', equivqty=seq * 10,
+                                qtybsuom=seq * 10)
+
+    def test_children_follow_parents_with_one_note_reservation(self):
+        w = BatchWriter(self.s, note_indexes=self._notes)
+        # Children first: the writer orders tables by foreign key
+        w.add_all([self._detail('A', 1), self._detail('A', 2)])
+        w.add_all([self._schedule('A'), self._schedule('B', noteidx=99)])
+        w.flush()
+        self.assertEqual(self.reserved, [1])
+        h = IV_UofM_SETP_HDR.__table__.c
+        rows = self.s.execute(select([h.UOMSCHDL, h.NOTEINDX, h.UMDPQTYS],
+                                     order_by=[h.UOMSCHDL])).fetchall()
+        self.assertEqual([tuple(r) for r in rows],
+                         [('A', 1, 1), ('B', 99, 1)])
+        self.assertEqual(w.rows, {'IV40201': 2, 'IV40202': 2})
+        d = IV_UofM_SETP_DTL.__table__.c
+        self.assertEqual([r[0] for r in self.s.execute(
+            select([d.UOFMLONGDESC]))], ['', ''])
+        self.assertEqual(len(w), 0)
+
+    def test_batchsize_flushes(self):
+        w = BatchWriter(self.s, batchsize=2, note_indexes=self._notes)
+        for name in 'ABC':
+            w.add(self._schedule(name))
+        self.assertEqual(len(w), 1)
+        self.assertEqual(self.reserved, [1, 2])
+        w.flush()
+        self.assertEqual(self.reserved, [1, 2, 3])
+        self.assertEqual(w.rows, {'IV40201': 3})
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,100 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2009 John Hampton <pacopablo@pacopablo.com>
+# All rights reserved.
+#
+# This software is licensed as described in the file COPYING, which
+# you should have received as part of this distribution.
+#
+# Author: John Hampton <pacopablo@pacopablo.com>
+
+# Standard library imports
+import unittest
+from decimal import Decimal
+
+# Third Party imports
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.sql import select
+
+# Local imports
+from gp10.batches import BatchSplitter, post_batches
+from gp10.company import Batch_Headers_DUP
+from tests.fixtures import insert, session
+
+_HEADERS = Batch_Headers_DUP.__table__
+
+
+class _Trx(object):
+
+    def __init__(self, lines, total):
+        self.lines = [None] * lines
+        self.total = Decimal(total)
+
+
+def _notes(count, s):
+    return [Decimal(n) for n in range(1, count + 1)]
+
+
+class BatchSplitterTest(unittest.TestCase):
+
+    def setUp(self):
+        self.s = session(('SY00500',))
+        insert(self.s.get_bind(), Batch_Headers_DUP,
+               {'BCHSOURC': 'IV_Trxent', 'BACHNUMB': 'NIGHT-0007'},
+               {'BCHSOURC': 'IV_Trxent', 'BACHNUMB': 'NIGHTLY'})
+
+    def _headers(self):
+        c = _HEADERS.c
+        return [tuple(r) for r in self.s.execute(
+            select([c.BACHNUMB, c.NUMOFTRX, c.BCHTOTAL],
+                   c.BACHNUMB != 'NIGHT-0007', order_by=[c.BACHNUMB]))]
+
+    def test_split_and_number(self):
+        splitter = BatchSplitter('IV_Trxent', 'NIGHT', maxlines=5,
+                                 s=self.s)
+        splitter.add_all([_Trx(3, 10), _Trx(2, 5), _Trx(4, 1), _Trx(9, 2)])
+        self.assertEqual([(b.batchnum, b.numtrx, b.lines)
+                          for b in splitter.batches],
+                         [('NIGHT-0008', 2, 5), ('NIGHT-0009', 1, 4),
+                          ('NIGHT-0010', 1, 9)])
+        self.assertEqual(splitter.save_headers(note_indexes=_notes), 3)
+        # Only what was dealt since the last save is added
+        splitter.add(_Trx(1, 4))
+        self.assertEqual(splitter.save_headers(note_indexes=_notes), 1)
+        self.assertEqual(self._headers(),
+                         [('NIGHT-0008', 2, 15), ('NIGHT-0009', 1, 1),
+                          ('NIGHT-0010', 1, 2), ('NIGHT-0011', 1, 4),
+                          ('NIGHTLY', 0, 0)])
+
+    def test_later_saves_add_to_the_header(self):
+        splitter = BatchSplitter('IV_Trxent', 'NIGHT', s=self.s)
+        splitter.add(_Trx(1, 3))
+        splitter.save_headers(note_indexes=_notes)
+        splitter.add(_Trx(1, 4))
+        splitter.save_headers(note_indexes=_notes)
+        self.assertEqual(self._headers()[0], ('NIGHT-0008', 2, 7))
+
+    def test_maxtrx_and_prefix_length(self):
+        splitter = BatchSplitter('IV_Trxent', 'NIGHT', maxtrx=1, s=self.s)
+        splitter.add_all([_Trx(1, 1), _Trx(1, 1)])
+        self.assertEqual(len(splitter.batches), 2)
+        self.assertRaises(ValueError, BatchSplitter, 'IV_Trxent',
+                          'A' * 11, s=self.s)
+
+    def test_post_batches_reports_errors_by_batch(self):
+        splitter = BatchSplitter('IV_Trxent', 'NIGHT', maxtrx=1, s=self.s)
+        splitter.add_all([_Trx(1, 1), _Trx(1, 1)])
+
+        def trxsrc(batch):
+            raise ValueError(batch.batchnum)
+
+        sm = sessionmaker(bind=self.s.get_bind())
+        results, errors = post_batches(trxsrc, splitter.batches, sm,
+                                       workers=2)
+        self.assertEqual(results, {})
+        self.assertEqual(sorted(errors), ['NIGHT-0008', 'NIGHT-0009'])
+        self.assertEqual(str(errors['NIGHT-0009']), 'NIGHT-0009')
+
+
+if __name__ == '__main__':
+    unittest.main()
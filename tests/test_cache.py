@@ -0,0 +1,99 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2009 John Hampton <pacopablo@pacopablo.com>
+# All rights reserved.
+#
+# This software is licensed as described in the file COPYING, which
+# you should have received as part of this distribution.
+#
+# Author: John Hampton <pacopablo@pacopablo.com>
+
+# Standard library imports
+import os
+import shutil
+import tempfile
+import unittest
+from decimal import Decimal
+
+# Third Party imports
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.sql import select
+
+# Local imports
+from gp10.cache import QueryCache
+from gp10.inventory import IV_Item_MSTR_QTYS
+from tests.fixtures import engine, insert
+
+
+class QueryCacheTest(unittest.TestCase):
+    """ Two sessions on one SQLite file, one writing and one reading """
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.engine = engine(('IV00101', 'IV00102'),
+                             'sqlite:///' + os.path.join(self.dir, 'c.db'))
+        insert(self.engine, IV_Item_MSTR_QTYS,
+               {'ITEMNMBR': 'A', 'LOCNCODE': 'WH', 'QTYONHND': 5},
+               {'ITEMNMBR': 'B', 'LOCNCODE': 'WH', 'QTYONHND': 7})
+        self.cache = QueryCache()
+        self.sm = sessionmaker(bind=self.engine)
+        self.cache.attach(self.sm)
+
+    def tearDown(self):
+        self.engine.dispose()
+        shutil.rmtree(self.dir)
+
+    def _onhand(self, s, item):
+        c = IV_Item_MSTR_QTYS.__table__.c
+        rows = self.cache.execute(
+            select([c.QTYONHND]).where(c.ITEMNMBR == item), s)
+        s.commit()
+        return rows[0][0]
+
+    def _write(self, s, item, qty):
+        q = s.query(IV_Item_MSTR_QTYS).filter_by(item=item).one()
+        q.qtyonhand = qty
+        s.flush()
+
+    def test_flush_drops_only_matching_entries(self):
+        reader = self.sm()
+        self.assertEqual(self._onhand(reader, 'A'), 5)
+        self.assertEqual(self._onhand(reader, 'B'), 7)
+        writer = self.sm()
+        self._write(writer, 'A', 6)
+        self.assertEqual(self.cache.invalidations, 1)
+        self._onhand(reader, 'B')
+        self.assertEqual(self.cache.hits, 1)
+
+    def test_rows_cached_before_the_commit_are_dropped_by_it(self):
+        reader, writer = self.sm(), self.sm()
+        self._write(writer, 'A', 6)
+        # Read after the flush but before the commit: the old row
+        self.assertEqual(self._onhand(reader, 'A'), 5)
+        writer.commit()
+        self.assertEqual(self._onhand(reader, 'A'), Decimal(6))
+
+    def test_rows_cached_before_a_rollback_are_dropped_by_it(self):
+        writer = self.sm()
+        self._write(writer, 'A', 6)
+        c = IV_Item_MSTR_QTYS.__table__.c
+        stmt = select([c.QTYONHND]).where(c.ITEMNMBR == 'A')
+        self.assertEqual(self.cache.execute(stmt, writer)[0][0], 6)
+        writer.rollback()
+        self.assertEqual(self._onhand(self.sm(), 'A'), 5)
+
+    def test_committed_sessions_forget_their_rows(self):
+        writer = self.sm()
+        self._write(writer, 'A', 6)
+        writer.commit()
+        invalidations = self.cache.invalidations
+        reader = self.sm()
+        self._onhand(reader, 'A')
+        writer.commit()
+        self._onhand(reader, 'A')
+        self.assertEqual(self.cache.invalidations, invalidations)
+        self.assertEqual(self.cache.hits, 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
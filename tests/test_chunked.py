@@ -0,0 +1,145 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2009 John Hampton <pacopablo@pacopablo.com>
+# All rights reserved.
+#
+# This software is licensed as described in the file COPYING, which
+# you should have received as part of this distribution.
+#
+# Author: John Hampton <pacopablo@pacopablo.com>
+
+# Standard library imports
+import unittest
+
+# Third Party imports
+from sqlalchemy.exc import DBAPIError, IntegrityError, OperationalError
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.sql import select
+
+# Local imports
+from gp10.chunked import ChunkedWriter, Checkpoint, is_retryable
+from gp10.chunked import run_in_transaction
+from gp10.inventory import IV_Item_MSTR_QTYS
+from tests.fixtures import engine, fill
+
+_QTYS = IV_Item_MSTR_QTYS.__table__
+
+_DEADLOCK = ('40001', '[40001] [Microsoft][ODBC Driver 17 for SQL Server]'
+             '[SQL Server]Transaction (Process ID 52) was deadlocked on lock '
+             'resources with another process and has been chosen as the '
+             'deadlock victim. Rerun the transaction. (1205) (SQLExecDirectW)')
+
+
+def _error(cls, *args):
+    return cls('INSERT', {}, Exception(*args))
+
+
+class IsRetryableTest(unittest.TestCase):
+
+    def test_native_codes(self):
+        self.assertTrue(is_retryable(_error(OperationalError, *_DEADLOCK)))
+        self.assertTrue(is_retryable(_error(OperationalError, 1205,
+                                            b'Transaction was deadlocked')))
+        self.assertTrue(is_retryable(_error(DBAPIError, 1222,
+                                            b'Lock request time out')))
+        self.assertTrue(is_retryable(_error(OperationalError, '40001',
+                                            'serialization failure')))
+
+    def test_values_in_the_message_do_not_count(self):
+        msg = ("[23000] Violation of PRIMARY KEY constraint 'PKIV00102'. "
+               "The duplicate key value is (1205, 1222). (2627) "
+               "(SQLExecDirectW)")
+        self.assertFalse(is_retryable(_error(IntegrityError, '23000', msg)))
+        self.assertFalse(is_retryable(_error(
+            IntegrityError, '23000', 'duplicate key value is (1205)')))
+        self.assertFalse(is_retryable(_error(
+            OperationalError, 'HY000', 'item ITEM-1205 deadlock table')))
+        self.assertFalse(is_retryable(ValueError(1205)))
+
+
+class ChunkedWriterTest(unittest.TestCase):
+
+    def setUp(self):
+        self.engine = engine(('IV00101', 'IV00102'))
+        self.sm = sessionmaker(bind=self.engine)
+
+    def _rows(self, *items):
+        return [fill(_QTYS, ITEMNMBR=item, LOCNCODE='WH') for item in items]
+
+    def _written(self):
+        return sorted([r[0] for r in self.engine.execute(
+            select([_QTYS.c.ITEMNMBR]))])
+
+    def _insert(self, s, rows):
+        s.execute(_QTYS.insert(), rows)
+
+    def test_a_bad_row_is_split_off(self):
+        w = ChunkedWriter(self._insert, self.sm, chunksize=8, backoff=0)
+        rows = self._rows('A', 'B', 'C', 'D', 'C', 'E', 'F')
+        failures = w.run(rows)
+        self.assertEqual(self._written(), ['A', 'B', 'C', 'D', 'E', 'F'])
+        self.assertEqual([(f[0], f[1]['ITEMNMBR']) for f in failures],
+                         [(4, 'C')])
+        self.assertTrue(isinstance(failures[0][2], IntegrityError))
+        self.assertEqual(w.stats['failed'], 1)
+        self.assertEqual(w.stats['rows'], 6)
+
+    def test_deadlocks_are_retried_with_smaller_chunks(self):
+        calls = []
+
+        def write(s, rows):
+            calls.append(len(rows))
+            if len(calls) == 1:
+                raise _error(OperationalError, *_DEADLOCK)
+            self._insert(s, rows)
+
+        w = ChunkedWriter(write, self.sm, chunksize=4, backoff=0,
+                          grow_after=2)
+        self.assertEqual(w.run(self._rows(*'ABCDEFGH')), [])
+        self.assertEqual(self._written(), list('ABCDEFGH'))
+        # The deadlocked chunk is retried whole, then the size halves and
+        # grows back after each clean commit
+        self.assertEqual(calls, [4, 4, 2, 2])
+        self.assertEqual(w.stats['retries'], 1)
+        self.assertEqual(w.stats['splits'], 0)
+
+    def test_resume_skips_committed_rows(self):
+        checkpoint = Checkpoint()
+        seen = []
+
+        def write(s, rows):
+            seen.extend([r['ITEMNMBR'] for r in rows])
+            if 'C' in [r['ITEMNMBR'] for r in rows]:
+                raise RuntimeError('interrupted')
+            self._insert(s, rows)
+
+        rows = self._rows('A', 'B', 'C', 'D')
+        ChunkedWriter(write, self.sm, chunksize=2,
+                      checkpoint=checkpoint).run(rows)
+        self.assertEqual(sorted(checkpoint.offsets), [0, 1, 3])
+        del seen[:]
+        w = ChunkedWriter(self._insert, self.sm, chunksize=2,
+                          checkpoint=checkpoint)
+        w.run(rows)
+        self.assertEqual(w.stats['skipped'], 3)
+        self.assertEqual(self._written(), ['A', 'B', 'C', 'D'])
+
+    def test_run_in_transaction_retries(self):
+        attempts = []
+
+        def fn(s):
+            attempts.append(1)
+            self._insert(s, self._rows('A'))
+            if len(attempts) < 3:
+                raise _error(OperationalError, 1222, b'Lock request time out')
+            return 'done'
+
+        self.assertEqual(run_in_transaction(self.sm, fn, backoff=0), 'done')
+        self.assertEqual(len(attempts), 3)
+        self.assertEqual(self._written(), ['A'])
+        self.assertRaises(IntegrityError, run_in_transaction, self.sm,
+                          lambda s: self._insert(s, self._rows('A')))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,85 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2009 John Hampton <pacopablo@pacopablo.com>
+# All rights reserved.
+#
+# This software is licensed as described in the file COPYING, which
+# you should have received as part of this distribution.
+#
+# Author: John Hampton <pacopablo@pacopablo.com>
+
+# Standard library imports
+import os
+import shutil
+import tempfile
+import threading
+import unittest
+
+# Local imports
+from gp10.companies import CompanyRegistry
+from gp10.errors import UnknownCompany
+from gp10.inventory import IV_Item_MSTR
+from tests.fixtures import engine, insert
+
+
+def _items(s):
+    return [i.item for i in s.query(IV_Item_MSTR).order_by(IV_Item_MSTR.item)]
+
+
+class CompanyRegistryTest(unittest.TestCase):
+    """ Three company databases as SQLite files, with different items """
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        companies = {}
+        for company, count in (('TWO', 2), ('THREE', 3), ('FOUR', 40)):
+            e = engine(('IV00101',),
+                       'sqlite:///' + os.path.join(self.dir, company + '.db'))
+            insert(e, IV_Item_MSTR, *[{'ITEMNMBR': '%s%02d' % (company, i)}
+                                      for i in range(count)])
+            companies[company] = e
+        self.registry = CompanyRegistry(companies)
+
+    def tearDown(self):
+        for company in self.registry.companies:
+            self.registry.engine(company).dispose()
+        shutil.rmtree(self.dir)
+
+    def test_fan_out(self):
+        def count(s):
+            if s.get_bind() is self.registry.engine('THREE'):
+                raise ValueError('THREE')
+            return len(_items(s))
+
+        results, errors = self.registry.fan_out(count, workers=2)
+        self.assertEqual(results, {'TWO': 2, 'FOUR': 40})
+        self.assertEqual(list(errors), ['THREE'])
+        self.assertRaises(UnknownCompany, self.registry.fan_out, count,
+                          ['FIVE'])
+
+    def test_query_merges_in_company_order(self):
+        rows = self.registry.query(_items, ['TWO', 'THREE'])
+        self.assertEqual(rows, [('THREE', 'THREE00'), ('THREE', 'THREE01'),
+                                ('THREE', 'THREE02'), ('TWO', 'TWO00'),
+                                ('TWO', 'TWO01')])
+
+    def test_stream(self):
+        rows = sorted(self.registry.stream(_items, buffer=5))
+        self.assertEqual(len(rows), 45)
+        self.assertEqual(rows[0], ('FOUR', 'FOUR00'))
+
+    def test_stream_stops_its_workers(self):
+        before = threading.active_count()
+        stream = self.registry.stream(_items, buffer=1, workers=1)
+        next(stream)
+        stream.close()
+        self.assertEqual(threading.active_count(), before)
+
+        def fail(s):
+            raise ValueError('down')
+        self.assertRaises(ValueError, list, self.registry.stream(fail))
+        self.assertEqual(threading.active_count(), before)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,114 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2009 John Hampton <pacopablo@pacopablo.com>
+# All rights reserved.
+#
+# This software is licensed as described in the file COPYING, which
+# you should have received as part of this distribution.
+#
+# Author: John Hampton <pacopablo@pacopablo.com>
+
+# Standard library imports
+import unittest
+from decimal import Decimal
+
+# Third Party imports
+from sqlalchemy.sql import select
+
+# Local imports
+from gp10.costing import CostRollup
+from gp10.errors import BOMCycle
+from gp10.inventory import IV_Item_MSTR
+from gp10.manufacturing import BOM_Line, routing_mstr, routing_line
+from tests.fixtures import insert, session
+
+_D = Decimal
+
+
+def _rollup(**kwargs):
+    """ TOP takes 2 SUB and 1 C; SUB takes 3 C; C is purchased """
+    costs = {'TOP': _D(0), 'SUB': _D(0), 'C': _D('1.5')}
+    components = {'TOP': [('SUB', _D(2)), ('C', _D(1))],
+                  'SUB': [('C', _D(3))]}
+    operations = {'SUB': [('WC1', _D(10), _D(1), _D('0.5'))]}
+    return CostRollup(costs, components, operations,
+                      {'WC1': (_D(20), _D(4))}, **kwargs)
+
+
+class CostRollupTest(unittest.TestCase):
+
+    def test_levels_are_low_level_codes(self):
+        self.assertEqual(_rollup().levels(),
+                         [('C', 0), ('SUB', 1), ('TOP', 2)])
+
+    def test_roll_splits_buckets(self):
+        rolled = _rollup(lot_size=5).roll()
+        sub = rolled['SUB']
+        self.assertEqual(sub.material, _D('4.5'))
+        # One hour of labor plus 10 hours setup over a lot of 5, at 20/h
+        self.assertEqual(sub.labor, _D(60))
+        self.assertEqual(sub.machine, _D(2))
+        top = rolled['TOP']
+        self.assertEqual(top.material, _D('10.5'))
+        self.assertEqual(top.labor, _D(120))
+        self.assertEqual(top.machine, _D(4))
+        self.assertEqual(top.total, _D('134.5'))
+        self.assertEqual(top.level, 2)
+
+    def test_roll_of_some_items_reuses_assemblies(self):
+        r = _rollup()
+        self.assertEqual(sorted(r.roll(['SUB'])), ['SUB'])
+        self.assertFalse('TOP' in r._rolled)
+        sub = r._rolled['SUB']
+        r.roll(['TOP'])
+        self.assertTrue(r._rolled['SUB'] is sub)
+
+    def test_cycle_is_reported(self):
+        r = CostRollup({}, {'A': [('B', 1)], 'B': [('A', 1)], 'C': []}, {})
+        try:
+            r.levels()
+        except BOMCycle:
+            pass
+        else:
+            self.fail('BOMCycle not raised')
+
+
+class CostRollupDatabaseTest(unittest.TestCase):
+
+    def setUp(self):
+        self.s = session(('IV00101', 'BM010415', 'BM010115',
+                          'RT010001', 'RT010130'))
+        bind = self.s.get_bind()
+        insert(bind, IV_Item_MSTR,
+               {'ITEMNMBR': 'TOP', 'STNDCOST': _D(1)},
+               {'ITEMNMBR': 'C', 'STNDCOST': _D('2.5')})
+        insert(bind, BOM_Line,
+               {'PPN_I': 'TOP', 'CPN_I': 'C', 'BOMCAT_I': 1,
+                'POSITION_NUMBER': 1, 'QUANTITY_I': _D(4)},
+               # Not the manufacturing BOM, so ignored
+               {'PPN_I': 'TOP', 'CPN_I': 'C', 'BOMCAT_I': 2,
+                'POSITION_NUMBER': 1, 'QUANTITY_I': _D(100)})
+        insert(bind, routing_mstr,
+               {'ITEMNMBR': 'TOP', 'ROUTINGNAME_I': 'P', 'RTPRIMARY_I': 1},
+               {'ITEMNMBR': 'TOP', 'ROUTINGNAME_I': 'ALT', 'RTPRIMARY_I': 0})
+        insert(bind, routing_line,
+               {'ITEMNMBR': 'TOP', 'ROUTINGNAME_I': 'P', 'RTSEQNUM_I': '1',
+                'WCID_I': 'WC1', 'LABORTIME_I': _D(1)},
+               {'ITEMNMBR': 'TOP', 'ROUTINGNAME_I': 'ALT', 'RTSEQNUM_I': '1',
+                'WCID_I': 'WC1', 'LABORTIME_I': _D(50)})
+
+    def test_load_roll_and_save(self):
+        r = CostRollup.load(self.s, wc_rates={'WC1': (_D(3), _D(0))})
+        self.assertEqual(r.roll(['TOP'])['TOP'].total, _D(13))
+        self.assertEqual(r.changes(), [('TOP', _D(13))])
+        self.assertEqual(r.save(self.s), 1)
+        c = IV_Item_MSTR.__table__.c
+        costs = dict(self.s.execute(select([c.ITEMNMBR, c.STNDCOST]))
+                     .fetchall())
+        self.assertEqual(costs, {'TOP': _D(13), 'C': _D('2.5')})
+        # Nothing left to write
+        self.assertEqual(r.save(self.s), 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
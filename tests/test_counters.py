@@ -0,0 +1,79 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2009 John Hampton <pacopablo@pacopablo.com>
+# All rights reserved.
+#
+# This software is licensed as described in the file COPYING, which
+# you should have received as part of this distribution.
+#
+# Author: John Hampton <pacopablo@pacopablo.com>
+
+# Standard library imports
+import unittest
+from datetime import datetime
+
+# Local imports
+from gp10.counters import CounterBatch
+from gp10.errors import InsufficientLotQuantity
+from gp10.inventory import IV_Item_MSTR_QTYS, IV_Lot_MSTR
+from tests.fixtures import insert, session
+
+_RECEIVED = datetime(2009, 1, 1)
+
+
+class CounterBatchTest(unittest.TestCase):
+
+    def setUp(self):
+        self.s = session(('IV00101', 'IV00102', 'IV00300'))
+        bind = self.s.get_bind()
+        insert(bind, IV_Item_MSTR_QTYS,
+               {'ITEMNMBR': 'A', 'LOCNCODE': 'WH', 'RCRDTYPE': 2,
+                'QTYONHND': 10, 'ATYALLOC': 4, 'QTYSOLD': 5})
+        insert(bind, IV_Lot_MSTR,
+               {'ITEMNMBR': 'A', 'LOCNCODE': 'WH', 'DATERECD': _RECEIVED,
+                'DTSEQNUM': 1, 'QTYTYPE': 1, 'LOTNUMBR': 'L1',
+                'QTYRECVD': 10, 'ATYALLOC': 4, 'QTYSOLD': 5})
+
+    def _site(self):
+        self.s.expire_all()
+        return self.s.query(IV_Item_MSTR_QTYS).one()
+
+    def test_site_guard_agrees_with_available(self):
+        site = self._site()
+        # Sold stock has already left QTYONHND
+        self.assertEqual(site.available, 6)
+        batch = CounterBatch(self.s)
+        batch.allocate(IV_Item_MSTR_QTYS, site, 7)
+        try:
+            batch.flush()
+        except InsufficientLotQuantity as e:
+            self.assertEqual(e.available, 6)
+        else:
+            self.fail('allocated more than available')
+        batch.allocate(IV_Item_MSTR_QTYS, site, 6)
+        batch.flush()
+        site = self._site()
+        self.assertEqual(site.qtyallocated, 10)
+        self.assertEqual(site.available, 0)
+
+    def test_lot_guard_takes_out_sales(self):
+        lot = self.s.query(IV_Lot_MSTR).one()
+        self.assertEqual(lot.available, 1)
+        batch = CounterBatch(self.s)
+        batch.allocate(IV_Lot_MSTR, lot, 2)
+        self.assertRaises(InsufficientLotQuantity, batch.flush)
+
+    def test_deltas_are_coalesced_and_floored(self):
+        site = self._site()
+        batch = CounterBatch(self.s)
+        batch.allocate(IV_Item_MSTR_QTYS, site, 3)
+        batch.release(IV_Item_MSTR_QTYS, site, 1)
+        self.assertEqual(len(batch), 1)
+        batch.flush()
+        self.assertEqual(self._site().qtyallocated, 6)
+        batch.release(IV_Item_MSTR_QTYS, site, 7)
+        self.assertRaises(InsufficientLotQuantity, batch.flush)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,97 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2009 John Hampton <pacopablo@pacopablo.com>
+# All rights reserved.
+#
+# This software is licensed as described in the file COPYING, which
+# you should have received as part of this distribution.
+#
+# Author: John Hampton <pacopablo@pacopablo.com>
+
+# Standard library imports
+import unittest
+from datetime import datetime
+
+# Local imports
+from gp10.errors import InsufficientLotQuantity
+from gp10.expiry import NEVER, ExpiryIndex
+from gp10.inventory import IV_Lot_MSTR, IV_Lot_Attribute
+from gp10.inventory import IV_TRX_HIST_Serial_Lot
+from gp10.manufacturing import MOP_Lot_Issue
+from tests.fixtures import insert, session
+
+
+def _day(month, day=1):
+    return datetime(2009, month, day)
+
+
+def _index():
+    index = ExpiryIndex()
+    index.receive('A', 'WH', 'LATE', _day(1), 1, 5, expiration=_day(9))
+    index.receive('A', 'WH', 'SOON', _day(2), 1, 3, expiration=_day(4))
+    index.receive('A', 'WH', 'NONE', _day(1), 2, 10)
+    index.receive('A', 'WH', 'GONE', _day(1), 3, 2, expiration=_day(2))
+    index.receive('A', 'XX', 'SOON', _day(2), 1, 1, expiration=_day(4))
+    return index
+
+
+class ExpiryIndexTest(unittest.TestCase):
+
+    def test_pick_first_expiring_first(self):
+        index = _index()
+        picks = index.pick('A', 'WH', 9, asof=_day(3))
+        self.assertEqual([(e.lot, q) for e, q in picks],
+                         [('SOON', 3), ('LATE', 5), ('NONE', 1)])
+        self.assertEqual(picks[-1][0].expiration, NEVER)
+        self.assertEqual(len(index), 5)
+        index.pick('A', 'WH', 8, asof=_day(3), commit=True)
+        self.assertEqual([(e.lot, q) for e, q in index.pick('A', 'WH', 10)],
+                         [('GONE', 2), ('NONE', 8)])
+        self.assertRaises(InsufficientLotQuantity, index.pick, 'A', 'WH', 13)
+
+    def test_expiring_sweep(self):
+        index = _index()
+        found = index.expiring(_day(1), _day(5))
+        self.assertEqual([(e.location, e.lot) for e in found],
+                         [('WH', 'GONE'), ('WH', 'SOON'), ('XX', 'SOON')])
+        self.assertEqual(len(index.expiring(_day(1), _day(5),
+                                            location='XX')), 1)
+
+    def test_issue_by_lot(self):
+        index = _index()
+        index.issue('A', 'WH', 'SOON', 3)
+        self.assertEqual(len(index.expiring(_day(4), _day(4))), 1)
+        self.assertRaises(InsufficientLotQuantity, index.issue, 'A', 'WH',
+                          'LATE', 6)
+
+    def test_load(self):
+        s = session(('IV00300', 'IV00301', 'WO010302', 'IV30400'))
+        bind = s.get_bind()
+        lot = {'ITEMNMBR': 'A', 'LOCNCODE': 'WH', 'DATERECD': _day(1),
+               'LOTNUMBR': 'L1', 'QTYRECVD': 4}
+        insert(bind, IV_Lot_MSTR,
+               dict(lot, DTSEQNUM=1, QTYTYPE=1),
+               # Same receipt, another layer of the same lot
+               dict(lot, DTSEQNUM=2, QTYTYPE=1, QTYRECVD=6, QTYSOLD=1),
+               # Not on hand stock
+               dict(lot, DTSEQNUM=1, QTYTYPE=3),
+               dict(lot, DTSEQNUM=3, QTYTYPE=1, LOTNUMBR='L2'),
+               dict(lot, DTSEQNUM=4, QTYTYPE=1, LOTNUMBR='L3'),
+               dict(lot, DTSEQNUM=5, QTYTYPE=1, LOTNUMBR='L4', ATYALLOC=4))
+        insert(bind, IV_Lot_Attribute,
+               {'ITEMNMBR': 'A', 'LOTNUMBR': 'L1', 'LOTATRB4': _day(3)},
+               {'ITEMNMBR': 'A', 'LOTNUMBR': 'L2', 'LOTATRB4': _day(3)})
+        insert(bind, MOP_Lot_Issue,
+               {'ITEMNMBR': 'A', 'LOTNUMBR': 'L1', 'EXPNDATE': _day(6)})
+        insert(bind, IV_TRX_HIST_Serial_Lot,
+               {'ITEMNMBR': 'A', 'SERLTNUM': 'L1', 'EXPNDATE': _day(8)})
+        index = ExpiryIndex.load(s)
+        entries = index.expiring(datetime.min, NEVER)
+        self.assertEqual([(e.lot, e.dateseq, e.available, e.expiration)
+                          for e in entries],
+                         [('L2', 3, 4, _day(3)), ('L1', 1, 4, _day(8)),
+                          ('L1', 2, 5, _day(8)), ('L3', 4, 4, NEVER)])
+
+
+if __name__ == '__main__':
+    unittest.main()
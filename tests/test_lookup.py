@@ -0,0 +1,64 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2009 John Hampton <pacopablo@pacopablo.com>
+# All rights reserved.
+#
+# This software is licensed as described in the file COPYING, which
+# you should have received as part of this distribution.
+#
+# Author: John Hampton <pacopablo@pacopablo.com>
+
+# Standard library imports
+import unittest
+from decimal import Decimal
+
+# Local imports
+from gp10.inventory import IV_Item_MSTR_QTYS
+from gp10.lookup import KeyLookup, lookup_for, get, get_many
+from tests.fixtures import insert, session
+
+
+class KeyLookupTest(unittest.TestCase):
+
+    def setUp(self):
+        self.s = session(('IV00102',))
+        insert(self.s.get_bind(), IV_Item_MSTR_QTYS,
+               *[{'ITEMNMBR': 'ITEM%d' % i, 'LOCNCODE': 'MAIN',
+                  'RCRDTYPE': 2, 'QTYONHND': Decimal(i)} for i in range(7)])
+
+    def test_get_uses_the_identity_map(self):
+        q = get(IV_Item_MSTR_QTYS, ('ITEM3', 'MAIN', 2), self.s)
+        self.assertEqual(q.qtyonhand, Decimal(3))
+        self.assertTrue(get(IV_Item_MSTR_QTYS, ('ITEM3', 'MAIN', 2),
+                            self.s) is q)
+        self.assertTrue(q is self.s.query(IV_Item_MSTR_QTYS)
+                        .get(('ITEM3', 'MAIN', 2)))
+        self.assertEqual(get(IV_Item_MSTR_QTYS, ('NONE', 'MAIN', 2),
+                             self.s), None)
+        self.assertTrue(lookup_for(IV_Item_MSTR_QTYS) is
+                        lookup_for(IV_Item_MSTR_QTYS))
+
+    def test_get_many_chunks_and_pads(self):
+        lookup = KeyLookup(IV_Item_MSTR_QTYS, chunksize=4)
+        cached = lookup.get(('ITEM0', 'MAIN', 2), self.s)
+        keys = [('ITEM%d' % i, 'MAIN', 2) for i in range(7)]
+        found = lookup.get_many(keys + [('NONE', 'MAIN', 2), keys[1]],
+                                self.s)
+        self.assertEqual(sorted(found), keys)
+        self.assertTrue(found[keys[0]] is cached)
+        for key, q in found.items():
+            self.assertEqual(q.qtyonhand, Decimal(key[0][4:]))
+        # Seven missing keys in chunks of four: one padded statement
+        self.assertEqual(sorted([n for d, n in lookup._compiled]), [1, 4])
+
+    def test_small_requests_round_up_to_a_power_of_two(self):
+        lookup = KeyLookup(IV_Item_MSTR_QTYS)
+        found = lookup.get_many([('ITEM%d' % i, 'MAIN', 2)
+                                 for i in range(3)], self.s)
+        self.assertEqual(len(found), 3)
+        self.assertEqual([n for d, n in lookup._compiled], [4])
+        self.assertEqual(get_many(IV_Item_MSTR_QTYS, [], self.s), {})
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,155 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2009 John Hampton <pacopablo@pacopablo.com>
+# All rights reserved.
+#
+# This software is licensed as described in the file COPYING, which
+# you should have received as part of this distribution.
+#
+# Author: John Hampton <pacopablo@pacopablo.com>
+
+# Standard library imports
+import unittest
+from datetime import datetime
+from decimal import Decimal
+
+# Third Party imports
+from sqlalchemy.sql import select
+
+# Local imports
+from gp10.errors import InvalidTransaction, InvalidSite, InvalidLot
+from gp10.inventory import IV_Item_MSTR_QTYS, IV_Lot_MSTR, IV_TRX_HIST_LINE
+from gp10.manufacturing import MOP_Pending_Serial_Lot
+from gp10.manufacturing import MOP_Pending_Serial_Lot_HIST, MOP_Lot_Issue
+from gp10.manufacturing import MOP_PickDoc_MSTR
+from gp10.posting import IVLine, IVLineLot, IVTransaction, validate, \
+     post_batch, post_pick_documents
+from tests.fixtures import insert, session
+
+_D = Decimal
+_DAY = datetime(2009, 6, 1)
+_SITE = IV_Item_MSTR_QTYS.__table__.c
+_LOT = IV_Lot_MSTR.__table__.c
+
+
+def _issue(docnum, qty, location='MAIN', lots=None):
+    return IVTransaction(docnum, _DAY,
+                         [IVLine(16384, 'A', 'Each', qty, '2.5', location,
+                                 1, 2, lots=lots)])
+
+
+class PostBatchTest(unittest.TestCase):
+
+    def setUp(self):
+        self.s = session(('IV00102', 'IV00300', 'IV30100', 'IV30200',
+                          'IV30300', 'IV30301', 'IV30400'))
+        bind = self.s.get_bind()
+        insert(bind, IV_Item_MSTR_QTYS,
+               {'ITEMNMBR': 'A', 'LOCNCODE': 'MAIN', 'RCRDTYPE': 2,
+                'QTYONHND': _D(10)})
+        insert(bind, IV_Lot_MSTR,
+               {'ITEMNMBR': 'A', 'LOCNCODE': 'MAIN', 'DATERECD': _DAY,
+                'DTSEQNUM': 1, 'QTYTYPE': 1, 'LOTNUMBR': 'L1',
+                'QTYRECVD': _D(10)})
+
+    def _sites(self):
+        return dict([((r[0], r[1]), r[2]) for r in self.s.execute(
+            select([_SITE.ITEMNMBR, _SITE.LOCNCODE, _SITE.QTYONHND]))])
+
+    def _history(self):
+        c = IV_TRX_HIST_LINE.__table__.c
+        return sorted([r[0] for r in self.s.execute(select([c.DOCNUMBR]))])
+
+    def test_validate(self):
+        self.assertRaises(InvalidTransaction, validate,
+                          [_issue('D1', -1), _issue('D1', -2)])
+        self.assertRaises(InvalidTransaction, validate, [_issue('D1', 0)])
+        lots = [IVLineLot(1, 'L1', 2, _DAY, 1)]
+        self.assertRaises(InvalidTransaction, validate,
+                          [_issue('D1', -3, lots=lots)])
+        self.assertRaises(InvalidSite, validate, [_issue('D1', -1, 'WEST')],
+                          self.s)
+        validate([_issue('D1', 1, 'WEST')], self.s)
+
+    def test_post_applies_aggregated_deltas(self):
+        lots = [IVLineLot(1, 'L1', 3, _DAY, 1)]
+        trxs = [_issue('D1', -3, lots=lots), _issue('D2', -1),
+                _issue('D3', 4, 'WEST')]
+        result = post_batch('IVTRX1', 'IV_Trxent', 'B1', trxs, self.s,
+                            posteddate=_DAY)
+        self.assertEqual(result.numtrx, 3)
+        self.assertEqual(result.total, _D('0'))
+        self.assertEqual(result.rows['IV30300'], 3)
+        self.assertEqual(result.rows['IV30400'], 1)
+        self.assertEqual(result.rows['IV00102'], 2)
+        self.assertEqual(self._sites(), {('A', 'MAIN'): _D(6),
+                                         ('A', 'WEST'): _D(4)})
+        row = self.s.execute(select([_LOT.QTYRECVD, _LOT.QTYSOLD])).fetchone()
+        self.assertEqual(tuple(row), (_D(10), _D(3)))
+        self.assertEqual(self._history(), ['D1', 'D2', 'D3'])
+
+    def test_missing_lot_rolls_back(self):
+        lots = [IVLineLot(1, 'L2', 1, _DAY, 2)]
+        trxs = [_issue('D1', -2), _issue('D2', -1, lots=lots)]
+        self.assertRaises(InvalidLot, post_batch, 'IVTRX1', 'IV_Trxent',
+                          'B1', trxs, self.s)
+        self.assertEqual(self._history(), [])
+        self.assertEqual(self._sites(), {('A', 'MAIN'): _D(10)})
+
+
+class PostPickDocumentsTest(unittest.TestCase):
+
+    def setUp(self):
+        self.s = session(('MOP1020', 'MOP1090', 'WO010302', 'MOP1200'))
+        bind = self.s.get_bind()
+        insert(bind, MOP_PickDoc_MSTR, *[{'PICKNUMBER': p, 'POSTED': False}
+                                         for p in ('P1', 'P2', 'P3')])
+        insert(bind, MOP_Pending_Serial_Lot,
+               *[{'DOCNUMBR': p, 'SEQ_I': i, 'SERLTNUM': 'L%d' % i,
+                  'SERLTQTY': _D(i)}
+                 for i, p in enumerate(('P1', 'P1', 'P2', 'P3'))])
+        insert(bind, MOP_Lot_Issue,
+               {'PICKNUMBER': 'P1', 'LOTNUMBR': 'L0', 'QTYCONSUMED': _D(1),
+                'QTYPENDING': _D(2), 'POSTED': 0},
+               {'PICKNUMBER': 'P3', 'LOTNUMBR': 'L3', 'QTYPENDING': _D(3),
+                'POSTED': 0})
+
+    def _docs(self, model, column='DOCNUMBR'):
+        c = model.__table__.c[column]
+        return sorted([r[0] for r in self.s.execute(select([c]))])
+
+    def test_pending_lots_move_to_history(self):
+        result = post_pick_documents(['P2', 'P1', 'P1'], self.s,
+                                     chunksize=1, posteddate=_DAY)
+        self.assertEqual(result.numtrx, 2)
+        self.assertEqual(result.rows, {'MOP1090': 3, 'MOP1020': 3,
+                                       'WO010302': 1, 'MOP1200': 2})
+        self.assertEqual(self._docs(MOP_Pending_Serial_Lot), ['P3'])
+        self.assertEqual(self._docs(MOP_Pending_Serial_Lot_HIST),
+                         ['P1', 'P1', 'P2'])
+        hist = MOP_Pending_Serial_Lot_HIST.__table__.c
+        self.assertEqual(sorted([r[0] for r in self.s.execute(
+                            select([hist.SERLTQTY]))]), [_D(0), _D(1), _D(2)])
+        c = MOP_Lot_Issue.__table__.c
+        rows = self.s.execute(select([c.PICKNUMBER, c.POSTED, c.QTYCONSUMED,
+                                      c.QTYPENDING])
+                              .order_by(c.PICKNUMBER)).fetchall()
+        self.assertEqual([tuple(r) for r in rows],
+                         [('P1', 1, _D(3), _D(0)), ('P3', 0, _D(0), _D(3))])
+        c = MOP_PickDoc_MSTR.__table__.c
+        rows = self.s.execute(select([c.PICKNUMBER, c.POSTED])
+                              .order_by(c.PICKNUMBER)).fetchall()
+        self.assertEqual([tuple(r) for r in rows],
+                         [('P1', True), ('P2', True), ('P3', False)])
+
+    def test_posting_again_does_nothing(self):
+        post_pick_documents(['P1'], self.s)
+        result = post_pick_documents(['P1'], self.s)
+        self.assertEqual(result.rows, {'MOP1090': 0, 'MOP1020': 0,
+                                       'WO010302': 0, 'MOP1200': 0})
+        self.assertEqual(self._docs(MOP_Pending_Serial_Lot_HIST),
+                         ['P1', 'P1'])
+
+
+if __name__ == '__main__':
+    unittest.main()
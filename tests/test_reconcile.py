@@ -0,0 +1,104 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2009 John Hampton <pacopablo@pacopablo.com>
+# All rights reserved.
+#
+# This software is licensed as described in the file COPYING, which
+# you should have received as part of this distribution.
+#
+# Author: John Hampton <pacopablo@pacopablo.com>
+
+# Standard library imports
+import os
+import shutil
+import tempfile
+import threading
+import unittest
+from datetime import datetime
+
+# Third Party imports
+from sqlalchemy.orm import sessionmaker
+
+# Local imports
+from gp10.inventory import IV_Item_MSTR, IV_Item_MSTR_QTYS, IV_Lot_MSTR
+from gp10.reconcile import correct, item_ranges, reconcile
+from tests.fixtures import engine, insert
+
+
+def _site(item, onhand, alloc=0):
+    return {'ITEMNMBR': item, 'LOCNCODE': 'WH', 'RCRDTYPE': 2,
+            'QTYONHND': onhand, 'ATYALLOC': alloc}
+
+
+def _lot(item, seq, recvd, sold=0, alloc=0):
+    return {'ITEMNMBR': item, 'LOCNCODE': 'WH', 'QTYTYPE': 1,
+            'DATERECD': datetime(2009, 1, 1), 'DTSEQNUM': seq,
+            'LOTNUMBR': 'L%d' % seq, 'QTYRECVD': recvd, 'QTYSOLD': sold,
+            'ATYALLOC': alloc}
+
+
+def _found(discrepancies):
+    return [(d.item, d.column, d.site, d.lots) for d in discrepancies]
+
+
+class ReconcileTest(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.engine = engine(('IV00101', 'IV00102', 'IV00300'),
+                             'sqlite:///' + os.path.join(self.dir, 'r.db'))
+        self.sm = sessionmaker(bind=self.engine)
+        insert(self.engine, IV_Item_MSTR,
+               *[{'ITEMNMBR': i, 'ITMTRKOP': 2} for i in 'ABCDEFGH'] +
+               [{'ITEMNMBR': 'Z', 'ITMTRKOP': 1}])
+        insert(self.engine, IV_Item_MSTR_QTYS,
+               # In step: 10 received, 2 sold
+               _site('A', 8, 1), _site('B', 9), _site('C', 4),
+               _site('E', 1), _site('F', 1), _site('G', 1), _site('H', 1),
+               # Not tracked
+               _site('Z', 99))
+        insert(self.engine, IV_Lot_MSTR,
+               _lot('A', 1, 6, sold=2, alloc=1), _lot('A', 2, 4),
+               _lot('B', 1, 10, sold=2), _lot('D', 1, 3),
+               _lot('E', 1, 1), _lot('F', 1, 1), _lot('G', 1, 1),
+               _lot('H', 1, 1))
+
+    def tearDown(self):
+        self.engine.dispose()
+        shutil.rmtree(self.dir)
+
+    def test_item_ranges(self):
+        ranges = item_ranges(self.sm(), 3)
+        self.assertEqual(ranges, [('A', 'D'), ('D', 'G'), ('G', None)])
+
+    def test_discrepancies(self):
+        found = _found(reconcile(self.sm, partitions=3, workers=2))
+        self.assertEqual(sorted(found),
+                         [('B', 'QTYONHND', 9, 8),
+                          ('C', 'ATYALLOC', 0, None),
+                          ('C', 'QTYONHND', 4, None),
+                          ('D', 'ATYALLOC', None, 0),
+                          ('D', 'QTYONHND', None, 3)])
+
+    def test_correct(self):
+        s = self.sm()
+        self.assertEqual(correct(reconcile(self.sm, partitions=2), s), 3)
+        s.commit()
+        # Site rows without lots are zeroed but still reported, and lots
+        # without a site row are left alone
+        self.assertEqual(sorted(_found(reconcile(self.sm))),
+                         [('C', 'ATYALLOC', 0, None),
+                          ('C', 'QTYONHND', 0, None),
+                          ('D', 'ATYALLOC', None, 0),
+                          ('D', 'QTYONHND', None, 3)])
+
+    def test_closing_early_stops_the_workers(self):
+        before = threading.active_count()
+        found = reconcile(self.sm, partitions=8, workers=2)
+        next(found)
+        found.close()
+        self.assertEqual(threading.active_count(), before)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,120 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2009 John Hampton <pacopablo@pacopablo.com>
+# All rights reserved.
+#
+# This software is licensed as described in the file COPYING, which
+# you should have received as part of this distribution.
+#
+# Author: John Hampton <pacopablo@pacopablo.com>
+
+# Standard library imports
+import os
+import shutil
+import tempfile
+import unittest
+
+# Third Party imports
+from sqlalchemy.sql import select
+
+# Local imports
+from gp10.inventory import IV_Item_MSTR_QTYS, IV_TRX_HIST_LINE
+from gp10.routing import Replica, routing_sessionmaker
+from tests.fixtures import engine, insert
+
+_TABLES = ('IV00101', 'IV00102', 'IV30300')
+
+
+class RoutingSessionTest(unittest.TestCase):
+    """ A primary and a replica as two SQLite files holding different
+    history rows, so every read shows where it went
+    """
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.primary_path = os.path.join(self.dir, 'p.db')
+        self.primary = engine(_TABLES, 'sqlite:///' + self.primary_path)
+        self.replica_path = os.path.join(self.dir, 'r.db')
+        self.replica = engine(_TABLES, 'sqlite:///' + self.replica_path)
+        insert(self.primary, IV_TRX_HIST_LINE, {'DOCNUMBR': 'PRIMARY'})
+        insert(self.replica, IV_TRX_HIST_LINE, {'DOCNUMBR': 'REPLICA'})
+        insert(self.primary, IV_Item_MSTR_QTYS,
+               {'ITEMNMBR': 'A', 'LOCNCODE': 'PRIMARY'})
+        insert(self.replica, IV_Item_MSTR_QTYS,
+               {'ITEMNMBR': 'A', 'LOCNCODE': 'REPLICA'})
+
+    def tearDown(self):
+        self.primary.dispose()
+        self.replica.dispose()
+        shutil.rmtree(self.dir)
+
+    def _session(self, replica=None, **kwargs):
+        replica = replica or Replica(self.replica)
+        sm = routing_sessionmaker(self.primary, [replica],
+                                  read_models=[IV_TRX_HIST_LINE], **kwargs)
+        return sm()
+
+    def _history(self, s):
+        c = IV_TRX_HIST_LINE.__table__.c
+        return [r[0] for r in s.execute(select([c.DOCNUMBR]))]
+
+    def test_reads_of_read_models_go_to_the_replica(self):
+        s = self._session()
+        self.assertEqual(self._history(s), ['REPLICA'])
+        self.assertEqual([l.docnum for l in s.query(IV_TRX_HIST_LINE)],
+                         ['REPLICA'])
+        # Other models are always read from the primary
+        self.assertEqual([q.location for q in s.query(IV_Item_MSTR_QTYS)],
+                         ['PRIMARY'])
+
+    def test_reads_follow_writes_until_commit(self):
+        s = self._session()
+        s.execute(IV_Item_MSTR_QTYS.__table__.update().values(BINNMBR='X'))
+        self.assertEqual(self._history(s), ['PRIMARY'])
+        s.commit()
+        self.assertEqual(self._history(s), ['REPLICA'])
+
+        q = s.query(IV_Item_MSTR_QTYS).one()
+        q.bin = 'Y'
+        s.flush()
+        self.assertEqual([l.docnum for l in s.query(IV_TRX_HIST_LINE)],
+                         ['PRIMARY'])
+        s.rollback()
+        self.assertEqual(self._history(s), ['REPLICA'])
+
+    def test_lagging_replica_is_skipped(self):
+        replica = Replica(self.replica, lag_check=lambda conn: 30)
+        s = self._session(replica, max_lag=10)
+        self.assertEqual(self._history(s), ['PRIMARY'])
+        s = self._session(Replica(self.replica, lag_check=lambda conn: 3),
+                          max_lag=10)
+        self.assertEqual(self._history(s), ['REPLICA'])
+
+    def test_failed_replica_falls_back_to_the_primary(self):
+        replica = Replica(self.replica, interval=3600)
+        self.assertTrue(replica.check(force=True))
+        # The replica goes away between health checks: connecting now
+        # opens an empty database without the history table
+        self.replica.dispose()
+        os.remove(self.replica_path)
+
+        s = self._session(replica)
+        self.assertEqual(self._history(s), ['PRIMARY'])
+        self.assertFalse(replica.available)
+
+        replica.available = True
+        s = self._session(replica)
+        self.assertEqual([l.docnum for l in s.query(IV_TRX_HIST_LINE)],
+                         ['PRIMARY'])
+        self.assertFalse(replica.available)
+
+    def test_failure_on_the_primary_is_raised(self):
+        s = self._session()
+        s.use_primary()
+        self.primary.dispose()
+        os.remove(self.primary_path)
+        self.assertRaises(Exception, self._history, s)
+
+
+if __name__ == '__main__':
+    unittest.main()
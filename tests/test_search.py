@@ -0,0 +1,89 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2009 John Hampton <pacopablo@pacopablo.com>
+# All rights reserved.
+#
+# This software is licensed as described in the file COPYING, which
+# you should have received as part of this distribution.
+#
+# Author: John Hampton <pacopablo@pacopablo.com>
+
+# Standard library imports
+import os
+import shutil
+import tempfile
+import unittest
+
+# Local imports
+from gp10.inventory import IV_Item_MSTR
+from gp10.search import ItemSearchIndex, MappedSearchIndex
+from tests.fixtures import insert, session
+
+
+class ItemSearchIndexTest(unittest.TestCase):
+
+    def setUp(self):
+        self.s = session(('IV00101',))
+        insert(self.s.get_bind(), IV_Item_MSTR,
+               {'ITEMNMBR': 'BOLT-10', 'ITEMDESC': 'Hex bolt 10mm',
+                'ITMSHNAM': 'BOLT'},
+               {'ITEMNMBR': 'NUT-10', 'ITEMDESC': 'Hex nut 10mm',
+                'ALTITEM1': 'BOLTNUT'},
+               {'ITEMNMBR': 'WASHER', 'ITEMDESC': 'Flat washer'})
+        self.index = ItemSearchIndex.load(self.s)
+        self.dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def test_prefix_matches_rank_by_field(self):
+        self.assertEqual(self.index.search('bolt'),
+                         [('BOLT-10', 20), ('NUT-10', 8)])
+        self.assertEqual(self.index.search('BOLT-1'), [('BOLT-10', 10)])
+        self.assertEqual(self.index.search(''), [])
+
+    def test_substring_matches_through_trigrams(self):
+        # Not a token prefix anywhere, only found inside 'washer'
+        self.assertEqual(self.index.search('ashe'), [('WASHER', 5.0)])
+        self.assertEqual(self.index.search('10mm', limit=1),
+                         [('BOLT-10', 8)])
+
+    def test_update_and_remove(self):
+        self.index.update({'item': 'WASHER', 'itemdesc': 'Spring washer'})
+        self.assertEqual(self.index.search('spring'), [('WASHER', 8)])
+        self.assertEqual(self.index.search('flat'), [])
+        self.index.remove('BOLT-10')
+        self.assertEqual(self.index.search('bolt'), [('NUT-10', 8)])
+        self.assertEqual(len(self.index), 2)
+        self.index.compact()
+        self.assertEqual(self.index.holes, 0)
+        self.assertEqual(self.index.search('nut'), [('NUT-10', 20)])
+
+    def test_refresh_rereads_items(self):
+        c = IV_Item_MSTR.__table__.c
+        self.s.execute(IV_Item_MSTR.__table__.update()
+                       .where(c.ITEMNMBR == 'NUT-10')
+                       .values(ALTITEM1=''))
+        self.s.execute(IV_Item_MSTR.__table__.delete()
+                       .where(c.ITEMNMBR == 'WASHER'))
+        self.index.refresh(self.s, ['NUT-10', 'WASHER'])
+        self.assertEqual(self.index.search('bolt'), [('BOLT-10', 20)])
+        self.assertEqual(self.index.search('washer'), [])
+
+    def test_mapped_index_matches_the_memory_index(self):
+        self.index.remove('WASHER')
+        path = self.index.dump(os.path.join(self.dir, 'items.idx'))
+        mapped = MappedSearchIndex(path)
+        try:
+            self.assertEqual(len(mapped), 2)
+            for text in ('bolt', 'hex', '10mm', 'nut-10', 'washer'):
+                self.assertEqual(mapped.search(text),
+                                 self.index.search(text))
+        finally:
+            mapped.close()
+        index = ItemSearchIndex.load_file(path)
+        self.assertEqual(index.search('hex'), self.index.search('hex'))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,83 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2009 John Hampton <pacopablo@pacopablo.com>
+# All rights reserved.
+#
+# This software is licensed as described in the file COPYING, which
+# you should have received as part of this distribution.
+#
+# Author: John Hampton <pacopablo@pacopablo.com>
+
+# Standard library imports
+import unittest
+
+# Third Party imports
+from sqlalchemy.sql import select
+
+# Local imports
+from gp10.inventory import IV_TRX_HIST_LINE, IV_TRX_HIST_Serial_Lot
+from gp10.sequence import STEP, OrdinalAllocator
+from tests.fixtures import insert, session
+
+_LINE = IV_TRX_HIST_LINE.__table__.c
+_LOT = IV_TRX_HIST_Serial_Lot.__table__.c
+
+
+class OrdinalAllocatorTest(unittest.TestCase):
+
+    def test_append_and_insert(self):
+        a = OrdinalAllocator()
+        self.assertEqual(a.append(2), [STEP, 2 * STEP])
+        self.assertEqual(a.insert_after(STEP, 3),
+                         [STEP + STEP // 4, STEP + STEP // 2,
+                          STEP + 3 * STEP // 4])
+        self.assertEqual(a.insert_after(None), [STEP // 2])
+        # Appends go back to whole steps
+        self.assertEqual(a.append(), [3 * STEP])
+        self.assertEqual(len(a), 7)
+
+    def test_pending_numbers_are_not_moved(self):
+        a = OrdinalAllocator([STEP, STEP + 1])
+        seqs = a.append()
+        self.assertRaises(ValueError, a.insert_after, STEP)
+        self.assertEqual(list(a), [STEP, STEP + 1, seqs[0]])
+        a.commit(seqs)
+        new = a.insert_after(STEP)
+        self.assertEqual(list(a), [STEP, new[0], 2 * STEP, 3 * STEP])
+        # The committed append is stored, so its move is recorded too
+        self.assertEqual(a.moves, {STEP + 1: 2 * STEP, 2 * STEP: 3 * STEP})
+
+    def test_wide_insert_makes_room(self):
+        a = OrdinalAllocator([STEP, 2 * STEP])
+        seqs = a.insert_after(STEP, STEP)
+        self.assertEqual(len(seqs), STEP)
+        self.assertEqual(list(a)[-1], (STEP + 2) * STEP)
+        self.assertEqual(sorted(a.moves.items()),
+                         [(2 * STEP, (STEP + 2) * STEP)])
+
+    def test_save_renumbers_every_target(self):
+        s = session(('IV30300', 'IV30400'))
+        bind = s.get_bind()
+        for seq in (STEP, STEP + 1, STEP + 2):
+            insert(bind, IV_TRX_HIST_LINE,
+                   {'DOCTYPE': 1, 'DOCNUMBR': 'DOC', 'LNSEQNBR': seq})
+            insert(bind, IV_TRX_HIST_Serial_Lot,
+                   {'IVDOCTYP': 1, 'DOCNUMBR': 'DOC', 'LNSEQNBR': seq,
+                    'SERLTNUM': 'L%d' % seq})
+        a = OrdinalAllocator.load(_LINE.LNSEQNBR, _LINE.DOCNUMBR == 'DOC', s)
+        new = a.insert_after(STEP + 1)
+        a.save([(_LINE.LNSEQNBR, _LINE.DOCNUMBR == 'DOC'),
+                (_LOT.LNSEQNBR, _LOT.DOCNUMBR == 'DOC')], s)
+        self.assertEqual(new, [2 * STEP + STEP // 2])
+        self.assertEqual([r[0] for r in s.execute(
+            select([_LINE.LNSEQNBR], order_by=[_LINE.LNSEQNBR]))],
+            [STEP, 2 * STEP, 3 * STEP])
+        self.assertEqual([tuple(r) for r in s.execute(
+            select([_LOT.SERLTNUM, _LOT.LNSEQNBR],
+                   order_by=[_LOT.LNSEQNBR]))],
+            [('L16384', STEP), ('L16385', 2 * STEP), ('L16386', 3 * STEP)])
+        self.assertEqual(a.moves, {})
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,80 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2009 John Hampton <pacopablo@pacopablo.com>
+# All rights reserved.
+#
+# This software is licensed as described in the file COPYING, which
+# you should have received as part of this distribution.
+#
+# Author: John Hampton <pacopablo@pacopablo.com>
+
+# Standard library imports
+import json
+import unittest
+from datetime import datetime
+from decimal import Decimal
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+# Local imports
+from gp10.inventory import IV_Lot_MSTR
+from gp10.serialize import Serializer, serializer_for
+
+_FIELDS = ('item', 'lot', 'received', 'dateseq', 'cost', 'qtyreceived',
+           'qtysold')
+
+
+def _lot(i, **kwargs):
+    return IV_Lot_MSTR('ITEM"%d' % i, 'MAIN', i, u'L\xf6t%d' % i,
+                       Decimal('0.10000') * i, Decimal(i), qtysold=None,
+                       received=datetime(2009, 6, i + 1), **kwargs)
+
+
+class SerializerTest(unittest.TestCase):
+
+    def test_json_matches_the_column_values(self):
+        ser = serializer_for(IV_Lot_MSTR, _FIELDS)
+        self.assertTrue(ser is serializer_for(IV_Lot_MSTR, list(_FIELDS)))
+        text = ser.to_json(_lot(3))
+        # Numerics are written out exactly, not through float
+        self.assertTrue('"cost":0.30000' in text)
+        self.assertEqual(json.loads(text, parse_float=Decimal),
+                         {'item': 'ITEM"3', 'lot': u'L\xf6t3',
+                          'received': '2009-06-04T00:00:00', 'dateseq': 3,
+                          'cost': Decimal('0.30000'), 'qtyreceived': 3,
+                          'qtysold': None})
+
+    def test_json_arrays_in_chunks(self):
+        ser = Serializer(IV_Lot_MSTR, ('item', 'dateseq'))
+        pieces = list(ser.iter_json([_lot(i) for i in range(5)], chunksize=2))
+        self.assertEqual(len(pieces), 3)
+        self.assertEqual(json.loads(''.join(pieces)),
+                         [{'item': 'ITEM"%d' % i, 'dateseq': i}
+                          for i in range(5)])
+        self.assertEqual(ser.dumps_json([]), '[]')
+        self.assertEqual(ser.dumps_json([_lot(1), _lot(2)]),
+                         '[{"item":"ITEM\\"1","dateseq":1},'
+                         '{"item":"ITEM\\"2","dateseq":2}]')
+        self.assertEqual(Serializer(IV_Lot_MSTR, ()).to_json(_lot(1)), '{}')
+
+    def test_unknown_field(self):
+        self.assertRaises(ValueError, Serializer, IV_Lot_MSTR, ('nope',))
+
+    if msgpack is not None:
+        def test_msgpack_round_trip(self):
+            ser = Serializer(IV_Lot_MSTR, _FIELDS)
+            unpacker = msgpack.Unpacker(raw=False)
+            unpacker.feed(b''.join(ser.iter_msgpack([_lot(1), _lot(2)])))
+            rows = list(unpacker)
+            self.assertEqual(len(rows), 2)
+            self.assertEqual(rows[1], {'item': 'ITEM"2', 'lot': u'L\xf6t2',
+                                       'received': '2009-06-03T00:00:00',
+                                       'dateseq': 2, 'cost': '0.20000',
+                                       'qtyreceived': '2', 'qtysold': None})
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,87 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2009 John Hampton <pacopablo@pacopablo.com>
+# All rights reserved.
+#
+# This software is licensed as described in the file COPYING, which
+# you should have received as part of this distribution.
+#
+# Author: John Hampton <pacopablo@pacopablo.com>
+
+# Standard library imports
+import unittest
+from datetime import datetime
+from decimal import Decimal
+
+# Local imports
+from gp10.errors import InsufficientLotQuantity, InvalidSite
+from gp10.inventory import IV_Item_MSTR, IV_Item_MSTR_QTYS, IV_Lot_MSTR
+from gp10.simulate import ReleaseSimulation
+from tests.fixtures import insert, session
+
+_DAY = datetime(2009, 3, 2)
+
+
+def _simulation():
+    """ Two orders on the same item: MO1 urgent, MO2 normal """
+    sim = ReleaseSimulation()
+    sim.orders = {'MO1': (1, _DAY, Decimal(10)),
+                  'MO2': (2, _DAY, Decimal(10))}
+    sim.lines = {'MO1': [(1, 'A', 'WH', Decimal(6), Decimal(0), Decimal(1))],
+                 'MO2': [(1, 'A', 'WH', Decimal(6), Decimal(0), Decimal(1)),
+                         (2, 'B', 'XX', Decimal(1), Decimal(0), Decimal(1))]}
+    sim.steps = {'MO1': [('WC1', _DAY, Decimal(1))],
+                 'MO2': [('WC1', _DAY, Decimal(1))]}
+    sim.sites = {('A', 'WH'): Decimal(10)}
+    sim.lots = {('A', 'WH'): [('L1', (_DAY, 1), Decimal(4)),
+                              ('L2', (_DAY, 2), Decimal(4))]}
+    sim.tracked = set(['A'])
+    return sim
+
+
+class ReleaseSimulationTest(unittest.TestCase):
+
+    def test_priority_order_and_shortages(self):
+        outcome = _simulation().run(capacity={'WC1': 15})
+        self.assertEqual(outcome.released, ['MO1', 'MO2'])
+        self.assertEqual([(a.mo, a.lots) for a in outcome.allocations],
+                         [('MO1', [('L1', 4), ('L2', 2)])])
+        short = [(s.mo, s.item, type(s.error)) for s in outcome.shortages]
+        self.assertEqual(short, [('MO2', 'A', InsufficientLotQuantity),
+                                 ('MO2', 'B', InvalidSite)])
+        self.assertEqual([(o.wc, o.load) for o in outcome.overloads],
+                         [('WC1', 20)])
+
+    def test_shortages_name_the_site(self):
+        sim = _simulation()
+        site = sim.run(['MO2', 'MO1'], quantities={'MO2': 20},
+                       ordered=True).shortages[0].error
+        sim.sites[('A', 'WH')] = Decimal(20)
+        lots = sim.run(['MO1', 'MO2'], ordered=True).shortages[0].error
+        self.assertEqual(site.lot, ('A', 'WH'))
+        self.assertEqual(site.available, 10)
+        self.assertEqual(lots.lot, ('A', 'WH'))
+        self.assertEqual(lots.available, 2)
+
+    def test_site_stock_agrees_with_available(self):
+        s = session(('IV00101', 'IV00102', 'IV00300'))
+        bind = s.get_bind()
+        insert(bind, IV_Item_MSTR, {'ITEMNMBR': 'A', 'ITMTRKOP': 2})
+        insert(bind, IV_Item_MSTR_QTYS,
+               {'ITEMNMBR': 'A', 'LOCNCODE': 'WH', 'RCRDTYPE': 2,
+                'QTYONHND': 10, 'ATYALLOC': 4, 'QTYSOLD': 5})
+        insert(bind, IV_Lot_MSTR,
+               {'ITEMNMBR': 'A', 'LOCNCODE': 'WH', 'DATERECD': _DAY,
+                'DTSEQNUM': 1, 'QTYTYPE': 1, 'LOTNUMBR': 'L1',
+                'QTYRECVD': 10, 'ATYALLOC': 4, 'QTYSOLD': 5})
+        sim = ReleaseSimulation()
+        sim._load_stock(s, ['A'])
+        self.assertEqual(sim.sites[('A', 'WH')],
+                         s.query(IV_Item_MSTR_QTYS).one().available)
+        self.assertEqual([l[2] for l in sim.lots[('A', 'WH')]],
+                         [s.query(IV_Lot_MSTR).one().available])
+        self.assertEqual(sim.tracked, set(['A']))
+
+
+if __name__ == '__main__':
+    unittest.main()
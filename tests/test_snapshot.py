@@ -0,0 +1,78 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2009 John Hampton <pacopablo@pacopablo.com>
+# All rights reserved.
+#
+# This software is licensed as described in the file COPYING, which
+# you should have received as part of this distribution.
+#
+# Author: John Hampton <pacopablo@pacopablo.com>
+
+# Standard library imports
+import os
+import shutil
+import tempfile
+import unittest
+from decimal import Decimal
+
+# Local imports
+from gp10.inventory import IV_Item_MSTR, IV_Item_MSTR_QTYS, IV_Location_SETP
+from gp10.snapshot import Snapshot, build_snapshot
+from tests.fixtures import insert, session
+
+
+class SnapshotTest(unittest.TestCase):
+
+    def setUp(self):
+        s = session(('IV00101', 'IV00102', 'IV40700'))
+        bind = s.get_bind()
+        insert(bind, IV_Item_MSTR,
+               *[{'ITEMNMBR': 'ITEM%02d' % i, 'ITEMDESC': u'Item n\xb0%d' % i,
+                  'STNDCOST': Decimal('1.00001') * i, 'ITEMTYPE': i % 3}
+                 for i in range(20)])
+        insert(bind, IV_Item_MSTR_QTYS,
+               *[{'ITEMNMBR': 'ITEM%02d' % i, 'LOCNCODE': site, 'RCRDTYPE': 2,
+                  'QTYONHND': Decimal(i)}
+                 for i in range(20) for site in ('MAIN', 'WEST')])
+        insert(bind, IV_Location_SETP,
+               {'LOCNCODE': 'MAIN', 'LOCNDSCR': 'Main warehouse'},
+               {'LOCNCODE': 'WEST', 'LOCNDSCR': 'West'})
+        self.dir = tempfile.mkdtemp()
+        self.path = build_snapshot(os.path.join(self.dir, 'snap'), s)
+        self.snap = Snapshot(self.path)
+        s.close()
+
+    def tearDown(self):
+        self.snap.close()
+        shutil.rmtree(self.dir)
+
+    def test_records_decode_to_column_values(self):
+        item = self.snap.items.get('ITEM07')
+        self.assertEqual(item.itemdesc, u'Item n\xb07')
+        self.assertEqual(item.stdcost, Decimal('7.00007'))
+        self.assertEqual(item.itemtype, 1)
+        self.assertEqual(len(self.snap.items), 20)
+        self.assertEqual(self.snap.items[-1].item, 'ITEM19')
+        self.assertRaises(IndexError, self.snap.items.__getitem__, 20)
+        self.assertEqual(sorted([l.desc for l in self.snap.locations]),
+                         ['Main warehouse', 'West'])
+
+    def test_composite_key_index(self):
+        q = self.snap.quantities.get('ITEM12', 'WEST')
+        self.assertEqual((q.item, q.location, q.qtyonhand),
+                         ('ITEM12', 'WEST', Decimal(12)))
+        self.assertEqual(self.snap.quantities.get('ITEM12', 'EAST'), None)
+        self.assertTrue(('ITEM03', 'MAIN') in self.snap.quantities)
+        self.assertTrue('MAIN' in self.snap.locations)
+        self.assertFalse('ITEM99' in self.snap.items)
+
+    def test_other_files_are_rejected(self):
+        path = os.path.join(self.dir, 'other')
+        f = open(path, 'wb')
+        f.write(b'not a snapshot')
+        f.close()
+        self.assertRaises(ValueError, Snapshot, path)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,98 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2009 John Hampton <pacopablo@pacopablo.com>
+# All rights reserved.
+#
+# This software is licensed as described in the file COPYING, which
+# you should have received as part of this distribution.
+#
+# Author: John Hampton <pacopablo@pacopablo.com>
+
+# Standard library imports
+import unittest
+from decimal import Decimal
+
+# Third Party imports
+import numpy
+from sqlalchemy import func
+from sqlalchemy.sql import select
+
+# Local imports
+from gp10.inventory import IV_Lot_MSTR
+from gp10.types import SCALE, to_scaled, from_scaled, format_scaled, \
+     scaled_mul, scaled_div, scaled_extend, scaled
+from tests.fixtures import engine, insert
+
+_LOT = IV_Lot_MSTR.__table__.c
+
+
+class ScaledArithmeticTest(unittest.TestCase):
+
+    def test_round_trip(self):
+        self.assertEqual(to_scaled(Decimal('1.23456')), 123456)
+        self.assertEqual(to_scaled('0.000005'), 1)
+        self.assertEqual(to_scaled(-0.000005), -1)
+        self.assertEqual(to_scaled(0.29), 29000)
+        self.assertEqual(from_scaled(123456), Decimal('1.23456'))
+        self.assertEqual(format_scaled(123456, 2), '1.23')
+        self.assertEqual(format_scaled(-150, 3), '-0.002')
+
+    def test_mul_and_div_round_half_up(self):
+        self.assertEqual(scaled_mul(to_scaled('0.00001'), to_scaled('0.5')), 1)
+        self.assertEqual(scaled_mul(to_scaled('-2'), to_scaled('1.5')),
+                         to_scaled('-3'))
+        self.assertEqual(scaled_div(to_scaled('2'), to_scaled('3')),
+                         to_scaled('0.66667'))
+        self.assertEqual(scaled_div(to_scaled('-1'), to_scaled('3')),
+                         to_scaled('-0.33333'))
+
+    def test_extend_is_exact(self):
+        qty = numpy.array([to_scaled('3.5'), to_scaled('-2'),
+                           to_scaled('123456789.12345')], dtype='int64')
+        cost = numpy.array([to_scaled('0.33333'), to_scaled('19.99999'),
+                            to_scaled('98765.43211')], dtype='int64')
+        whole, rem = scaled_extend(qty, cost)
+        for i in range(len(qty)):
+            exact = from_scaled(int(qty[i])) * from_scaled(int(cost[i]))
+            got = Decimal(int(whole[i]) * SCALE + int(rem[i])).scaleb(-10)
+            self.assertEqual(got, exact)
+
+    def test_extend_overflow(self):
+        qty = numpy.array([2 ** 40], dtype='int64')
+        cost = numpy.array([2 ** 40], dtype='int64')
+        self.assertRaises(OverflowError, scaled_extend, qty, cost)
+
+
+class ScaledNumericTest(unittest.TestCase):
+
+    def setUp(self):
+        self.engine = engine(('IV00300',))
+        insert(self.engine, IV_Lot_MSTR,
+               {'LOTNUMBR': 'A', 'DTSEQNUM': 1, 'QTYRECVD': Decimal('1.1'),
+                'UNITCOST': Decimal('0.29')},
+               {'LOTNUMBR': 'B', 'DTSEQNUM': 2, 'QTYRECVD': Decimal('2.2'),
+                'UNITCOST': Decimal('7.00001')})
+
+    def test_selects_come_back_as_scaled_ints(self):
+        rows = self.engine.execute(
+            select([scaled(_LOT.QTYRECVD), scaled(_LOT.UNITCOST)])
+            .order_by(_LOT.LOTNUMBR)).fetchall()
+        self.assertEqual([tuple(r) for r in rows],
+                         [(110000, 29000), (220000, 700001)])
+        for v in rows[0]:
+            self.assertTrue(isinstance(v, int))
+        total = self.engine.execute(
+            select([func.sum(scaled(_LOT.QTYRECVD))])).scalar()
+        self.assertEqual(total, 330000)
+
+    def test_ints_bind_as_scaled_values(self):
+        q = select([_LOT.LOTNUMBR], scaled(_LOT.QTYRECVD) > 150000)
+        self.assertEqual([r[0] for r in self.engine.execute(q)], ['B'])
+        # The column itself still reads Decimals
+        v = self.engine.execute(select([_LOT.UNITCOST])
+                                .order_by(_LOT.LOTNUMBR)).scalar()
+        self.assertEqual(v, Decimal('0.29'))
+
+
+if __name__ == '__main__':
+    unittest.main()
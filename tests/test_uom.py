@@ -0,0 +1,85 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2009 John Hampton <pacopablo@pacopablo.com>
+# All rights reserved.
+#
+# This software is licensed as described in the file COPYING, which
+# you should have received as part of this distribution.
+#
+# Author: John Hampton <pacopablo@pacopablo.com>
+
+# Standard library imports
+import random
+import unittest
+from decimal import Decimal
+
+# Local imports
+from gp10.errors import InvalidUofM
+from gp10.inventory import IV_Item_MSTR, IV_UofM_SETP_HDR, IV_UofM_SETP_DTL
+from gp10.types import to_scaled
+from gp10.uom import UofMTable
+from tests.fixtures import insert, session
+
+D = Decimal
+
+
+def _table():
+    # DECPLQTY is the number of decimal places plus one
+    return UofMTable({'EACH': 'EA', 'WEIGHT': 'LB'},
+                     [('EACH', 'BOX', D(12)), ('EACH', 'THIRD', D('0.33333')),
+                      ('WEIGHT', 'OZ', D('0.0625'))],
+                     {'BOLT': ('EACH', 1), 'FLOUR': ('WEIGHT', 3),
+                      'ODD': ('NONE', 1)})
+
+
+class UofMTableTest(unittest.TestCase):
+
+    def test_round_half_up_to_the_item_places(self):
+        t = _table()
+        self.assertEqual(t.to_base('BOLT', 'BOX', D('1.5')), 18)
+        # 1.5 thirds = 0.499995 each, so rounds down
+        self.assertEqual(t.convert(['BOLT', 'BOLT', 'BOLT', 'FLOUR', 'FLOUR'],
+                                   ['THIRD', 'THIRD', 'EA', 'OZ', 'OZ'],
+                                   [D('1.5'), D('-1.50002'), D('2.5'),
+                                    D('0.08'), D('-0.08')]),
+                         [0, D(-1), D(3), D('0.01'), D('-0.01')])
+
+    def test_convert_agrees_with_to_base(self):
+        t = _table()
+        rnd = random.Random(1)
+        lines = [(rnd.choice(['BOLT', 'FLOUR']), None,
+                  D(rnd.randint(-10 ** 9, 10 ** 9)).scaleb(-5))
+                 for i in range(500)]
+        lines = [(i, i == 'BOLT' and rnd.choice(['BOX', 'THIRD', 'EA'])
+                  or rnd.choice(['OZ', 'LB']), q) for i, u, q in lines]
+        items, uoms, qtys = zip(*lines)
+        expected = [t.to_base(i, u, q) for i, u, q in lines]
+        self.assertEqual(t.convert(items, uoms, qtys), expected)
+        scaled = t.convert(items, uoms, [to_scaled(q) for q in qtys],
+                           scaled=True)
+        self.assertEqual(list(scaled), [to_scaled(q) for q in expected])
+
+    def test_unknown_units(self):
+        t = _table()
+        self.assertRaises(InvalidUofM, t.factor, 'BOLT', 'OZ')
+        self.assertRaises(InvalidUofM, t.convert, ['BOLT', 'NONE'],
+                          ['EA', 'EA'], [1, 1])
+        self.assertRaises(InvalidUofM, t.convert, ['ODD'], ['EA'], [1])
+        self.assertEqual(t.convert([], [], []), [])
+
+    def test_load(self):
+        s = session(('IV00101', 'IV40201', 'IV40202'))
+        bind = s.get_bind()
+        insert(bind, IV_UofM_SETP_HDR, {'UOMSCHDL': 'EACH', 'BASEUOFM': 'EA'})
+        insert(bind, IV_UofM_SETP_DTL,
+               {'UOMSCHDL': 'EACH', 'SEQNUMBR': 1, 'UOFM': 'BOX',
+                'QTYBSUOM': 12})
+        insert(bind, IV_Item_MSTR,
+               {'ITEMNMBR': 'BOLT', 'UOMSCHDL': 'EACH', 'DECPLQTY': 1})
+        t = UofMTable.load(s)
+        self.assertEqual(t.factor('BOLT', 'EA'), 1)
+        self.assertEqual(t.convert(['BOLT'], ['BOX'], [D(2)]), [24])
+
+
+if __name__ == '__main__':
+    unittest.main()
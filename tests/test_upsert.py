@@ -0,0 +1,77 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2009 John Hampton <pacopablo@pacopablo.com>
+# All rights reserved.
+#
+# This software is licensed as described in the file COPYING, which
+# you should have received as part of this distribution.
+#
+# Author: John Hampton <pacopablo@pacopablo.com>
+
+# Standard library imports
+import unittest
+from datetime import date, datetime
+from decimal import Decimal
+
+# Third Party imports
+from sqlalchemy.sql import select
+
+# Local imports
+from gp10.inventory import IV_Item_MSTR, IV_Lot_Attribute
+from gp10.upsert import bulk_upsert, model_columns
+from tests.fixtures import fill, session
+
+
+def _item(item, desc, cost):
+    """ A feed row for IV00101 keyed by attribute, without CURRCOST """
+    names = dict([(c.name, a) for a, c in model_columns(IV_Item_MSTR)])
+    row = fill(IV_Item_MSTR.__table__, ITEMNMBR=item, ITEMDESC=desc,
+               STNDCOST=Decimal(cost))
+    del row['CURRCOST']
+    return dict([(names[k], v) for k, v in row.items()])
+
+
+class BulkUpsertTest(unittest.TestCase):
+
+    def setUp(self):
+        self.s = session(('IV00101', 'IV00301'))
+
+    def test_insert_update_and_skip(self):
+        feed = [_item('A', 'Widget', '1.5'), _item('B', 'Gadget', '2')]
+        result = bulk_upsert(IV_Item_MSTR, feed, self.s,
+                             columns=['itemdesc', 'stdcost'])
+        self.assertEqual((result.inserted, result.updated), (2, 0))
+        c = IV_Item_MSTR.__table__.c
+        rows = self.s.execute(select([c.ITEMNMBR, c.STNDCOST, c.CURRCOST],
+                                     order_by=[c.ITEMNMBR])).fetchall()
+        # Current cost starts out as the standard cost
+        self.assertEqual([tuple(r) for r in rows],
+                         [('A', Decimal('1.5'), Decimal('1.5')),
+                          ('B', 2, 2)])
+
+        # Padding and scale differences are not changes
+        feed = [_item('A  ', 'Widget ', '1.50000'), _item('B', 'Gizmo', '2')]
+        result = bulk_upsert(IV_Item_MSTR, feed, self.s,
+                             columns=['itemdesc', 'stdcost'])
+        self.assertEqual((result.inserted, result.updated, result.unchanged),
+                         (0, 1, 1))
+        self.assertEqual(self.s.query(IV_Item_MSTR).get('B').itemdesc,
+                         'Gizmo')
+
+    def test_dates_compare_as_the_column_type(self):
+        bulk_upsert(IV_Lot_Attribute,
+                    [{'item': 'A', 'lot': 'L1',
+                      'attr4': datetime(2009, 5, 1)}], self.s)
+        result = bulk_upsert(IV_Lot_Attribute,
+                             [{'item': 'A', 'lot': 'L1',
+                               'attr4': date(2009, 5, 1)}], self.s)
+        self.assertEqual((result.updated, result.unchanged), (0, 1))
+        result = bulk_upsert(IV_Lot_Attribute,
+                             [{'item': 'A', 'lot': 'L1',
+                               'attr4': date(2009, 5, 2)}], self.s,
+                             insert=False)
+        self.assertEqual(result.updated, 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,83 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2009 John Hampton <pacopablo@pacopablo.com>
+# All rights reserved.
+#
+# This software is licensed as described in the file COPYING, which
+# you should have received as part of this distribution.
+#
+# Author: John Hampton <pacopablo@pacopablo.com>
+
+# Standard library imports
+import unittest
+from datetime import datetime
+from decimal import Decimal
+
+# Local imports
+from gp10.inventory import IV_Item_MSTR, IV_Lot_MSTR
+from gp10.valuation import InventoryValuation
+from tests.fixtures import insert, session
+
+D = Decimal
+
+
+def _row(item, location, itemclass, recvd, alloc, sold, cost, std, cur):
+    return (item, location, itemclass, '', '', '', '', '', '',
+            D(recvd), D(alloc), D(sold), D(cost), D(std), D(cur))
+
+
+_ROWS = [
+    _row('A', 'WH1', 'RAW', '10', '2', '3', '1.23457', '1.2', '1.25'),
+    _row('A', 'WH2', 'RAW', '5', '-1', '0', '1.00001', '1.2', '1.25'),
+    _row('B', 'WH1', 'FIN', '0.00001', '0', '0', '99999.99999', '5', '5'),
+    _row('C ', 'WH1', 'RAW', '4', '0', '4', '3', '3', '3'),
+]
+
+
+class InventoryValuationTest(unittest.TestCase):
+
+    def test_rollup_by_item_is_exact(self):
+        v = InventoryValuation.from_rows(_ROWS)
+        rows = dict([(r.key, r) for r in v.rollup('item')])
+        self.assertEqual(sorted(rows), ['A', 'B', 'C'])
+        # Negative allocations do not add stock
+        a = rows['A']
+        self.assertEqual((a.lots, a.qty), (2, D(10)))
+        self.assertEqual(a.value, D('5') * D('1.23457') + D('5') * D('1.00001'))
+        self.assertEqual(a.std_value, D(12))
+        self.assertEqual(a.cur_variance, a.value - D('12.5'))
+        self.assertEqual(rows['B'].value, D('0.9999999999'))
+        self.assertEqual(rows['C'].qty, 0)
+
+    def test_rollup_on_several_dimensions(self):
+        v = InventoryValuation.from_rows(_ROWS)
+        keys = [(r.key, r.lots) for r in v.rollup('itemclass', 'location')]
+        self.assertEqual(keys, [(('FIN', 'WH1'), 1), (('RAW', 'WH1'), 2),
+                                (('RAW', 'WH2'), 1)])
+        total = v.total()
+        self.assertEqual(total.lots, 4)
+        self.assertEqual(total.value, sum([r.value for r in v.rollup()]))
+        self.assertRaises(ValueError, v.rollup, 'color')
+
+    def test_load_scales_on_the_database(self):
+        s = session(('IV00101', 'IV00300'))
+        bind = s.get_bind()
+        insert(bind, IV_Item_MSTR,
+               {'ITEMNMBR': 'A', 'ITMCLSCD': 'RAW', 'STNDCOST': D('1.2'),
+                'CURRCOST': D('1.25')})
+        lot = {'ITEMNMBR': 'A', 'LOCNCODE': 'WH1',
+               'DATERECD': datetime(2009, 1, 1), 'LOTNUMBR': 'L'}
+        insert(bind, IV_Lot_MSTR,
+               dict(lot, DTSEQNUM=1, QTYTYPE=1, QTYRECVD=D('10'),
+                    ATYALLOC=D('2'), QTYSOLD=D('3'), UNITCOST=D('1.23457')),
+               dict(lot, DTSEQNUM=2, QTYTYPE=3, QTYRECVD=D('7'),
+                    UNITCOST=D('1')))
+        v = InventoryValuation.load(s)
+        self.assertEqual(len(v), 1)
+        row = v.total()
+        self.assertEqual((row.qty, row.value), (D(5), D('6.17285')))
+        self.assertEqual(len(InventoryValuation.load(s, qtytype=None)), 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,93 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2009 John Hampton <pacopablo@pacopablo.com>
+# All rights reserved.
+#
+# This software is licensed as described in the file COPYING, which
+# you should have received as part of this distribution.
+#
+# Author: John Hampton <pacopablo@pacopablo.com>
+
+# Standard library imports
+import os
+import shutil
+import tempfile
+import unittest
+from datetime import datetime
+
+# Third Party imports
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.sql import select
+
+# Local imports
+from gp10.errors import InsufficientLotQuantity
+from gp10.manufacturing import MOP_WIP_Stack
+from gp10.wip import WIPStack, close_orders
+from tests.fixtures import engine, insert
+
+_STACK = MOP_WIP_Stack.__table__
+
+
+def _layer(mo, item, day, seq, qty, cost, sold=0):
+    return {'MANUFACTUREORDER_I': mo, 'ITEMNMBR': item, 'TO_SITE_I': 'WIP',
+            'DATERECD': datetime(2009, 1, day), 'WIPSEQNMBR': seq,
+            'QTYRECVD': qty, 'QTYSOLD': sold, 'WIPQTYSOLD': sold,
+            'ITEM_COSTS_ARRAY_I_1': cost}
+
+
+class WIPTest(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.engine = engine(('MOP1000',),
+                             'sqlite:///' + os.path.join(self.dir, 'w.db'))
+        self.sm = sessionmaker(bind=self.engine)
+        insert(self.engine, MOP_WIP_Stack,
+               _layer('MO1', 'A', 1, 1, 5, 2),
+               _layer('MO1', 'A', 2, 2, 5, 3, sold=1),
+               _layer('MO1', 'B', 1, 1, 2, 7),
+               _layer('MO2', 'A', 1, 1, 4, 1))
+
+    def tearDown(self):
+        self.engine.dispose()
+        shutil.rmtree(self.dir)
+
+    def _sold(self, mo, column='QTYSOLD'):
+        c = _STACK.c
+        return [r[0] for r in self.engine.execute(
+            select([c[column]], c.MANUFACTUREORDER_I == mo,
+                   order_by=[c.ITEMNMBR, c.DATERECD]))]
+
+    def test_fifo_cost_flow(self):
+        s = self.sm()
+        stack = WIPStack.load(s, 'MO1')
+        self.assertEqual(stack.available('A'), 9)
+        flow = stack.consume('A', 7)
+        self.assertEqual([(l.wipseq, qty, cost) for l, qty, cost in flow],
+                         [(1, 5, 10), (2, 2, 6)])
+        self.assertEqual(stack.save(s), 2)
+        s.commit()
+        self.assertEqual(self._sold('MO1'), [5, 3, 0])
+        self.assertEqual(self._sold('MO1', 'WIPQTYSOLD'), [5, 3, 0])
+
+    def test_consume_all_is_all_or_nothing(self):
+        stack = WIPStack.load(self.sm(), 'MO1')
+        self.assertRaises(InsufficientLotQuantity, stack.consume_all,
+                          [('A', 3), ('B', 3)])
+        self.assertEqual(stack.changed(), [])
+        self.assertEqual(stack.available('A'), 9)
+
+    def test_close_orders(self):
+        flows, errors = close_orders({'MO1': {'A': 9, 'B': 3},
+                                      'MO2': [('A', 4)],
+                                      'MO3': []}, self.sm, workers=2)
+        self.assertEqual(sorted(flows), ['MO2', 'MO3'])
+        self.assertEqual(list(errors), ['MO1'])
+        self.assertTrue(isinstance(errors['MO1'], InsufficientLotQuantity))
+        self.assertEqual(sum([cost for l, q, cost in flows['MO2']]), 4)
+        self.assertEqual(self._sold('MO1'), [0, 1, 0])
+        self.assertEqual(self._sold('MO2'), [4])
+
+
+if __name__ == '__main__':
+    unittest.main()